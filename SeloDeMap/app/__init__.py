@@ -8,4 +8,14 @@ def create_app():
 
     with app.app_context():
         from . import routes # Importa as rotas
+        from . import comandos
+        comandos.init_app(app) # Registra os comandos de preparação de dados
+        from . import lote
+        lote.init_app(app) # Executor da fila de análises em lote
+        from . import metricas
+        metricas.init_app(app) # Duração das requisições e cabeçalho Server-Timing
+        from . import aquecimento
+        aquecimento.init_app(app) # Prontidão fora do gunicorn: aquece na primeira requisição
+        from . import compressao
+        compressao.init_app(app) # brotli/gzip das respostas grandes (registrado depois: roda antes do Server-Timing)
     return app
\ No newline at end of file
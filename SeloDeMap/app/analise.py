@@ -0,0 +1,188 @@
+# SeloDeMap/app/analise.py
+# Pipeline de análise sem mapa (localização do imóvel CAR + PRODES), usado
+# onde só os números interessam, como na análise em lote.
+import shapely
+from flask import current_app
+from shapely.geometry import mapping
+
+from . import cache_analise, car_local, estatisticas, prodes_postgis, prodes_vetorial, utils
+
+_app_worker = None
+
+
+def inicializar_worker():
+    """Initializer de pools de processos: cria a aplicação (config, pool de conexões, caches) uma vez por processo."""
+    global _app_worker
+    from . import create_app
+    _app_worker = create_app()
+
+
+def app_do_worker():
+    return _app_worker
+
+
+def buscar_imovel_por_codigo(car_code):
+    """utils.get_imovel_car_from_code com o cache de resultados na frente."""
+    em_cache = cache_analise.obter_resultado(car_code, utils.sigla_uf_from_car_code(car_code))
+    if em_cache is not None:
+        return em_cache['imovel'], None
+    return utils.get_imovel_car_from_code(car_code)
+
+
+def buscar_imovel_por_coords(lat, lon):
+    """utils.get_imovel_car_from_coords com o cache coordenada -> cod_imovel na frente.
+
+    Coordenadas sem imóvel também são lembradas; falhas de banco não.
+    """
+    cod_imovel = cache_analise.obter_cod_coordenada(lat, lon)
+    if cod_imovel == cache_analise.SEM_IMOVEL:
+        return None, utils.MSG_CAR_NAO_ENCONTRADO_COORDS
+    if cod_imovel is not None:
+        imovel_car_data, _ = buscar_imovel_por_codigo(cod_imovel)
+        if imovel_car_data is not None:
+            return imovel_car_data, None
+
+    imovel_car_data, err_car = utils.get_imovel_car_from_coords(lat, lon)
+    if imovel_car_data is not None:
+        cache_analise.gravar_cod_coordenada(lat, lon, imovel_car_data['cod_imovel'])
+    elif utils.car_nao_encontrado_coords(err_car):
+        cache_analise.gravar_cod_coordenada(lat, lon, None)
+    return imovel_car_data, err_car
+
+
+def localizar_imovel(car_code=None, sigla_uf=None, lat=None, lon=None):
+    """Busca o imóvel CAR por código ou coordenada na tabela nacional.
+
+    A busca não depende de `sigla_uf`; ela só preenche a UF do resultado
+    quando o imóvel não é encontrado. Retorna (imovel_car_data, sigla_uf,
+    avisos); imovel_car_data é None se não encontrado, com o motivo em `avisos`.
+    """
+    avisos = []
+    if car_code:
+        imovel_car_data, err_car = buscar_imovel_por_codigo(car_code)
+        sigla_uf = utils.sigla_uf_from_car_code(car_code) or sigla_uf
+    elif lat is not None and lon is not None:
+        imovel_car_data, err_car = buscar_imovel_por_coords(lat, lon)
+    else:
+        return None, None, ["Informe um código CAR ou um par de coordenadas."]
+
+    if err_car:
+        avisos.append(f"Imóvel CAR: {err_car}")
+    if imovel_car_data is not None:
+        sigla_uf = imovel_car_data['sigla_uf']
+    return imovel_car_data, sigla_uf, avisos
+
+
+def _usar_estatisticas(imovel_car_data):
+    """Se vale consultar a tabela pré-calculada: não quando a consulta CAR já trouxe o
+    histograma, no motor vetorial (não há pré-cálculo dele) nem no backend CAR local
+    sem o motor PostGIS, que não deve ir ao banco (que pode nem estar acessível)."""
+    if 'prodes_contagens' in imovel_car_data or prodes_vetorial.ativo():
+        return False
+    return not car_local.ativo() or prodes_postgis.ativo()
+
+
+def prodes_imovel(imovel_car_data, precisa_pixels=False):
+    """Resultado PRODES do imóvel: dict com valores, desmatamento_ha, transform,
+    crs, na_area (há pixels PRODES válidos no imóvel) e aviso.
+
+    Ordem: cache de resultados -> tabela pré-calculada pelo mesmo motor
+    (quando os pixels do recorte não são necessários; ver _usar_estatisticas) -> histograma no PostGIS Raster (motor
+    'postgis', idem) ou polígonos de desmatamento (motor 'vetorial', idem)
+    -> cálculo ao vivo no raster.
+    """
+    cod_imovel, sigla_uf = imovel_car_data.get('cod_imovel'), imovel_car_data.get('sigla_uf')
+    em_cache = cache_analise.obter_resultado(cod_imovel, sigla_uf)
+    if em_cache is not None and (not precisa_pixels or em_cache['prodes']['valores'] is not None):
+        return em_cache['prodes']
+
+    registro, prodes = None, None
+    if not precisa_pixels:
+        versao = utils.versao_prodes_atual()
+        if _usar_estatisticas(imovel_car_data):
+            registro = estatisticas.buscar_estatisticas(cod_imovel, versao, current_app.config['PRODES_ENGINE'])
+        if registro is None and prodes_postgis.ativo():
+            prodes = prodes_postgis.prodes_imovel(imovel_car_data, versao)
+        elif registro is None and prodes_vetorial.ativo():
+            prodes = prodes_vetorial.prodes_imovel(imovel_car_data, versao)
+    if registro is not None:
+        prodes = {'valores': None, 'desmatamento_ha': registro['desmatamento_ha'], 'transform': None, 'crs': None,
+                  'na_area': bool(registro['classes_ha']), 'aviso': registro['aviso']}
+    elif prodes is None:
+        valores, desmatamento_areas_ha, transform, crs, err_prodes = \
+            utils.analyze_prodes_recorter(imovel_car_data['geometry'])
+        prodes = {'valores': valores, 'desmatamento_ha': desmatamento_areas_ha, 'transform': transform, 'crs': crs,
+                  'na_area': valores is not None and valores.size > 0 and transform is not None, 'aviso': err_prodes}
+        if valores is None:
+            return prodes # Falha (arquivo ausente, erro de leitura): não vai para o cache
+    cache_analise.gravar_resultado(cod_imovel, sigla_uf, imovel_car_data, prodes)
+    return prodes
+
+
+def desmatamento_imovel(imovel_car_data):
+    """Áreas desmatadas por ano do imóvel: (desmatamento_areas_ha, aviso)."""
+    prodes = prodes_imovel(imovel_car_data)
+    return prodes['desmatamento_ha'], prodes['aviso']
+
+
+def geometria_geojson(geometria, tolerancia=0.00005, casas_decimais=6, propriedades=None):
+    """Feature GeoJSON simplificada da geometria do imóvel, para desenho no cliente.
+
+    `tolerancia` em graus (0.00005 ~ 5 m); as coordenadas são arredondadas
+    para `casas_decimais`. EPSG:4674 é tratado como EPSG:4326 (diferença
+    abaixo de 1 m, irrelevante no mapa).
+    """
+    if tolerancia:
+        geometria = geometria.simplify(tolerancia, preserve_topology=True)
+    geometria = shapely.set_precision(geometria, 10 ** -casas_decimais)
+    return {
+        'type': 'Feature',
+        'geometry': mapping(geometria),
+        'bbox': [round(c, casas_decimais) for c in geometria.bounds],
+        'properties': propriedades or {},
+    }
+
+
+def analisar_imovel(car_code=None, sigla_uf=None, lat=None, lon=None, incluir_geometria=False, tolerancia=0.00005,
+                    vizinhos=0, distancia_vizinhos_m=0):
+    """Localiza o imóvel e calcula o desmatamento PRODES por ano, sem renderizar mapa.
+
+    Retorna um dict serializável em JSON; com `incluir_geometria`, inclui a
+    geometria simplificada do imóvel em 'geometria' (Feature GeoJSON). Com
+    `vizinhos` > 0, inclui em 'vizinhos' até esse número de imóveis a até
+    `distancia_vizinhos_m` metros, com o desmatamento de cada um (app/vizinhos.py).
+    """
+    imovel_car_data, sigla_uf, avisos = localizar_imovel(car_code, sigla_uf, lat, lon)
+    area_ha_car = imovel_car_data.get('area_ha_car') if imovel_car_data else None
+    resultado = {
+        'cod_imovel': imovel_car_data.get('cod_imovel') if imovel_car_data else None,
+        'sigla_uf': sigla_uf,
+        'municipio': imovel_car_data.get('municipio') if imovel_car_data else None,
+        'area_ha_car': float(area_ha_car) if area_ha_car is not None else None, # numeric -> Decimal no psycopg2
+        'desmatamento_ha': {},
+        'avisos': avisos,
+        'status': 'erro' if imovel_car_data is None else 'ok',
+    }
+    if imovel_car_data is None or not imovel_car_data.get('geometry'):
+        return resultado
+
+    desmatamento_areas_ha, err_prodes = desmatamento_imovel(imovel_car_data)
+    if err_prodes:
+        avisos.append(f"PRODES: {err_prodes}")
+        current_app.logger.info(f"Aviso PRODES para {resultado['cod_imovel']}: {err_prodes}")
+    resultado['desmatamento_ha'] = {int(ano): round(float(area), 4) for ano, area in sorted(desmatamento_areas_ha.items())}
+    if incluir_geometria:
+        # A variante compacta (já simplificada no banco) serve se a tolerância pedida não for mais fina
+        geometria = imovel_car_data['geometry']
+        if imovel_car_data.get('geometria_exibicao') is not None and \
+                tolerancia >= current_app.config['CAR_GEOMETRIA_TOLERANCIA_EXIBICAO']:
+            geometria = imovel_car_data['geometria_exibicao']
+        resultado['geometria'] = geometria_geojson(geometria, tolerancia,
+                                                   propriedades={'cod_imovel': resultado['cod_imovel']})
+    if vizinhos:
+        from .vizinhos import analisar_vizinhos
+        resultado['vizinhos'], err_vizinhos = analisar_vizinhos(imovel_car_data, vizinhos, distancia_vizinhos_m,
+                                                                incluir_geometria, tolerancia)
+        if err_vizinhos:
+            avisos.append(f"Vizinhos: {err_vizinhos}")
+    return resultado
@@ -0,0 +1,153 @@
+# SeloDeMap/app/aquecimento.py
+# Aquecimento do servidor de produção (gunicorn.conf.py) e prontidão (/status/pronto).
+#
+# Em duas fases:
+# - no processo mestre, antes do fork (preload_app): as bibliotecas pesadas
+#   (geopandas, rasterio/GDAL, folium, owslib) já foram importadas pelo
+#   create_app; aqui são montados o índice das UFs e seus limites
+#   simplificados (e, no motor PRODES vetorial, o STRtree dos polígonos de
+#   desmatamento; no backend CAR local, os índices dos arquivos por UF), renderizados os esqueletos do mapa (app/mapa.py) e lidos os metadados do raster PRODES (registro dos drivers
+#   GDAL, banco do PROJ), e o coletor de lixo é congelado, para que essas
+#   páginas fiquem compartilhadas (copy-on-write) entre os workers em vez de
+#   cada um refazer o trabalho;
+# - em cada worker, depois do fork: o que não atravessa um fork (conexões do
+#   pool PostgreSQL, handles GDAL abertos, conexão SQLite do catálogo,
+#   Transformers com contexto PROJ) é criado antes da primeira requisição.
+#
+# Só depois da fase do worker o /status/pronto responde 200; falhas de uma
+# etapa (ex: banco fora do ar) viram avisos e não impedem a prontidão. Em
+# servidores sem os ganchos do gunicorn.conf.py (`flask run`, outros hosts
+# WSGI), a fase do worker roda na primeira requisição do processo.
+import gc
+import os
+import threading
+import time
+
+import rasterio
+
+from . import car_local, catalogo_prodes, db, estados, mapa, prodes_postgis, prodes_vetorial, projecao, raster
+
+_estado = {'pronto': False, 'pid': None, 'etapas': {}, 'avisos': []}
+_estado_lock = threading.Lock()
+_aquecimento_tardio_lock = threading.Lock()
+
+
+def _cronometrar(app, registro, nome, funcao):
+    inicio = time.perf_counter()
+    try:
+        funcao()
+    except Exception as e:
+        app.logger.warning(f"Aquecimento: etapa '{nome}' falhou: {e}")
+        registro['avisos'].append(f"{nome}: {e}")
+    finally:
+        registro['etapas'][nome] = round(time.perf_counter() - inicio, 4)
+
+
+def _crs_prodes(app):
+    catalogo = catalogo_prodes.get_catalogo(app.config['PRODES_CATALOGO'])
+    if catalogo is not None:
+        return catalogo.crs
+    caminho = app.config['PRODES_FILE_MS_RECORTE']
+    if not os.path.exists(caminho):
+        return None
+    with rasterio.open(caminho) as src: # Fora do pool de handles: não atravessa o fork
+        return src.crs
+
+
+def _transformers(app):
+    projecao.get_transformer(projecao.WGS84, projecao.SIRGAS2000)
+    projecao.get_transformer(projecao.SIRGAS2000, projecao.WGS84)
+    crs_prodes = _crs_prodes(app)
+    if crs_prodes is not None:
+        projecao.get_transformer(projecao.SIRGAS2000, crs_prodes)
+        projecao.get_transformer(crs_prodes, projecao.WGS84)
+
+
+def _estados(app):
+    indice = estados.get_indice_estados(app.config['ESTADOS_FILE'])
+    if indice is None:
+        raise FileNotFoundError(f"snapshot {app.config['ESTADOS_FILE']} ausente (a consulta usará o WFS)")
+    for tolerancia in estados.TOLERANCIAS_EXIBICAO:
+        indice.geometria_exibicao(indice.atributos[0].get('cd_uf'), tolerancia)
+
+
+def _prodes_vetorial(app):
+    if prodes_vetorial.get_indice(app.config['PRODES_VETORIAL_FILE']) is None:
+        raise FileNotFoundError(f"índice {app.config['PRODES_VETORIAL_FILE']} ausente (a análise usará o raster)")
+
+
+def _car_local(app):
+    if car_local.carregar_todos() == 0:
+        raise FileNotFoundError(f"nenhum imóvel CAR exportado em {app.config['CAR_LOCAL_DIR']} (flask exportar-car-local)")
+
+
+def aquecer_mestre(app):
+    """Fase anterior ao fork: estado imutável compartilhado entre os workers."""
+    registro = {'etapas': {}, 'avisos': []}
+    with app.app_context():
+        _cronometrar(app, registro, 'estados', lambda: _estados(app))
+        _cronometrar(app, registro, 'raster_metadados', lambda: _crs_prodes(app))
+        if prodes_vetorial.ativo(): # STRtree dos polígonos PRODES: só objetos GEOS, compartilháveis entre os workers
+            _cronometrar(app, registro, 'prodes_vetorial', lambda: _prodes_vetorial(app))
+        if car_local.ativo(): # Índices de código e retângulos das UFs; os arquivos mapeados ficam no cache de páginas do SO
+            _cronometrar(app, registro, 'car_local', lambda: _car_local(app))
+        _cronometrar(app, registro, 'mapa', lambda: [mapa.get_esqueleto(legenda) for legenda in (False, True)])
+    gc.collect()
+    gc.freeze() # Objetos já existentes saem do GC: a contagem de referências deixa de sujar as páginas compartilhadas
+    app.logger.info(f"Aquecimento do mestre (s): {registro['etapas']}")
+    return registro
+
+
+def _raster(app):
+    catalogo = catalogo_prodes.get_catalogo(app.config['PRODES_CATALOGO'])
+    if catalogo is not None:
+        catalogo.tiles_intersectando((0, 0, 0, 0)) # Abre a conexão SQLite desta thread
+    caminho = app.config['PRODES_FILE_MS_RECORTE']
+    if os.path.exists(caminho):
+        raster.aquecer(caminho)
+    elif catalogo is None:
+        raise FileNotFoundError(f"raster PRODES {caminho} ausente")
+
+
+def aquecer_worker(app, aquecer=True):
+    """Fase do worker: conexões e handles do processo; marca o worker como pronto.
+
+    Com aquecer=False (Config.SERVIDOR_AQUECIMENTO desligado), só marca o worker como pronto.
+    """
+    registro = {'etapas': {}, 'avisos': []}
+    if aquecer:
+        with app.app_context():
+            if not car_local.ativo() or prodes_postgis.ativo(): # Backend CAR local: o /analisar não usa o banco
+                _cronometrar(app, registro, 'pool_db', lambda: db.get_pool().aquecer())
+            _cronometrar(app, registro, 'raster', lambda: _raster(app))
+            _cronometrar(app, registro, 'transformers', lambda: _transformers(app))
+            _cronometrar(app, registro, 'estados', lambda: _estados(app)) # Já pronto se veio do mestre
+    with _estado_lock:
+        _estado.update(pronto=True, pid=os.getpid(), etapas=registro['etapas'], avisos=registro['avisos'])
+    app.logger.info(f"Worker {os.getpid()} pronto; aquecimento (s): {registro['etapas']}")
+    return registro
+
+
+def situacao():
+    """Prontidão do worker atual: dict com 'pronto', tempos das etapas e avisos."""
+    with _estado_lock:
+        if _estado['pid'] != os.getpid(): # Estado herdado do mestre num fork: este worker ainda não aqueceu
+            return {'pronto': False, 'pid': os.getpid(), 'etapas': {}, 'avisos': []}
+        return dict(_estado, etapas=dict(_estado['etapas']), avisos=list(_estado['avisos']))
+
+
+def _aquecido():
+    with _estado_lock:
+        return _estado['pronto'] and _estado['pid'] == os.getpid()
+
+
+def init_app(app):
+    @app.before_request
+    def _aquecer_se_preciso():
+        # Nenhum gancho aqueceu este processo (gunicorn o faz antes de aceitar conexões):
+        # a primeira requisição faz a fase do worker, e as concorrentes esperam por ela.
+        if _aquecido():
+            return
+        with _aquecimento_tardio_lock:
+            if not _aquecido():
+                aquecer_worker(app, aquecer=app.config['SERVIDOR_AQUECIMENTO'])
@@ -0,0 +1,129 @@
+# SeloDeMap/app/cache.py
+# Caches em memória compartilhados pelas threads do worker, com nível
+# opcional em disco compartilhado entre processos.
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+_AUSENTE = object()
+
+
+class CacheLRU:
+    """Dicionário limitado com despejo LRU, seguro para várias threads."""
+
+    def __init__(self, max_itens=128):
+        self.max_itens = max_itens
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chave, default=None):
+        with self._lock:
+            try:
+                valor = self._dados[chave]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._dados.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def set(self, chave, valor):
+        if self.max_itens <= 0:
+            return
+        with self._lock:
+            self._dados[chave] = valor
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
+
+    def __contains__(self, chave):
+        return chave in self._dados
+
+
+class CacheDisco:
+    """Cache em disco (um pickle por chave), compartilhável entre processos e workers.
+
+    Escritas atômicas (arquivo temporário + rename); arquivos ilegíveis contam
+    como miss. Use apenas em diretórios confiáveis: o conteúdo é despickleado.
+    """
+
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+        self.hits = 0
+        self.misses = 0
+
+    def _caminho(self, chave):
+        nome = hashlib.sha1(repr(chave).encode('utf-8')).hexdigest()
+        return os.path.join(self.diretorio, nome[:2], nome + '.pkl')
+
+    def get(self, chave, default=None):
+        try:
+            with open(self._caminho(chave), 'rb') as f:
+                chave_gravada, valor = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            self.misses += 1
+            return default
+        if chave_gravada != chave:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return valor
+
+    def set(self, chave, valor):
+        caminho = self._caminho(chave)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((chave, valor), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, caminho)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+class CacheDoisNiveis:
+    """LRU em memória na frente de um CacheDisco opcional; hits do disco sobem para a memória."""
+
+    def __init__(self, memoria, disco=None):
+        self.memoria = memoria
+        self.disco = disco
+
+    def get(self, chave, default=None):
+        valor = self.memoria.get(chave, _AUSENTE)
+        if valor is not _AUSENTE:
+            return valor
+        if self.disco is not None:
+            valor = self.disco.get(chave, _AUSENTE)
+            if valor is not _AUSENTE:
+                self.memoria.set(chave, valor)
+                return valor
+        return default
+
+    def set(self, chave, valor):
+        self.memoria.set(chave, valor)
+        if self.disco is not None:
+            try:
+                self.disco.set(chave, valor)
+            except OSError:
+                pass # O nível em disco é só uma otimização
+
+    def metricas(self):
+        metricas = {'memoria': {'itens': len(self.memoria), 'hits': self.memoria.hits, 'misses': self.memoria.misses}}
+        if self.disco is not None:
+            metricas['disco'] = {'hits': self.disco.hits, 'misses': self.disco.misses}
+        return metricas
+
@@ -0,0 +1,130 @@
+# SeloDeMap/app/cache_analise.py
+# Cache de resultados de análise por imóvel e de coordenada -> imóvel.
+#
+# Resultados (dados do imóvel + PRODES) ficam sob (cod_imovel, UF, versão do
+# PRODES, motor PRODES, versão da tabela CAR); coordenadas arredondadas numa grade guardam o
+# cod_imovel encontrado ou SEM_IMOVEL, para que cliques repetidos fora de
+# imóveis também não voltem ao banco. Como as versões fazem parte das chaves,
+# trocar o raster ou recarregar a tabela CAR invalida as entradas antigas, que
+# saem pelo LRU (e ficam órfãs no disco até limpeza manual do diretório).
+import os
+import threading
+import time
+
+import psycopg2
+from flask import current_app
+
+from . import car_local, db, utils
+from .cache import CacheDisco, CacheDoisNiveis, CacheLRU
+
+SEM_IMOVEL = '-'  # Coordenada consultada sem imóvel CAR
+
+# Contador da tabela (nacional ou partição) em car_versoes, incrementado por
+# gatilho a cada escrita (ver app/car.py). Nenhuma linha se a tabela não tem
+# versionamento: nesse caso nada é cacheado.
+SQL_VERSAO_CAR = """
+    SELECT versao::text FROM car_versoes WHERE tabela = $1::text
+"""
+
+_caches = None
+_caches_lock = threading.Lock()
+_versoes_car = {}  # {tabela ou partição: (versao, instante da consulta)}
+_versoes_car_lock = threading.Lock()
+
+
+def _get_caches():
+    global _caches
+    if _caches is None:
+        with _caches_lock:
+            if _caches is None:
+                config = current_app.config
+                dir_disco = config['CACHE_ANALISE_DIR']
+                _caches = {
+                    'resultados': CacheDoisNiveis(
+                        CacheLRU(config['CACHE_ANALISE_SIZE']),
+                        CacheDisco(os.path.join(dir_disco, 'resultados')) if dir_disco else None),
+                    'coordenadas': CacheDoisNiveis(
+                        CacheLRU(config['CACHE_COORDENADAS_SIZE']),
+                        CacheDisco(os.path.join(dir_disco, 'coordenadas')) if dir_disco else None),
+                }
+    return _caches
+
+
+def versao_car(sigla_uf=None):
+    """Versão da partição CAR da UF (ou da tabela nacional inteira, sem UF):
+    Config.CAR_VERSAO, os arquivos do backend CAR local ou o contador da tabela em
+    car_versoes (consultado no máximo a cada CACHE_VERSAO_CAR_TTL segundos).
+
+    None se a versão não puder ser determinada; nesse caso nada é cacheado.
+    """
+    if current_app.config.get('CAR_VERSAO'):
+        return current_app.config['CAR_VERSAO']
+    if car_local.ativo(): # Assinatura (mtime, tamanho) dos arquivos exportados
+        return car_local.versao(sigla_uf)
+    table_name = utils.car_table_name(sigla_uf)
+    if not table_name:
+        return None
+    agora = time.monotonic()
+    with _versoes_car_lock:
+        versao, consultada_em = _versoes_car.get(table_name, (None, None))
+    if consultada_em is not None and agora - consultada_em < current_app.config['CACHE_VERSAO_CAR_TTL']:
+        return versao
+    try:
+        with db.conexao() as conn:
+            with conn.cursor() as cursor:
+                db.executar_preparada(cursor, "versao_car", SQL_VERSAO_CAR, (table_name,))
+                registro = cursor.fetchone()
+    except psycopg2.Error as e:
+        current_app.logger.warning(f"Versão da tabela CAR '{table_name}' indisponível, cache ignorado: {e}")
+        return None
+    versao = registro[0] if registro else None
+    with _versoes_car_lock:
+        _versoes_car[table_name] = (versao, agora)
+    return versao
+
+
+def _chave_resultado(cod_imovel, sigla_uf):
+    if not cod_imovel or not sigla_uf:
+        return None
+    versao = versao_car(sigla_uf)
+    if versao is None:
+        return None
+    # O motor PRODES entra na chave: cada um conta os pixels de um jeito (ver estatisticas.py)
+    return (cod_imovel, sigla_uf.upper(), utils.versao_prodes_atual(), current_app.config['PRODES_ENGINE'], versao)
+
+
+def _chave_coordenada(lat, lon):
+    versao = versao_car()
+    if versao is None:
+        return None
+    grade = current_app.config['CACHE_COORDENADAS_GRADE']
+    return (round(lat / grade), round(lon / grade), versao)
+
+
+def obter_resultado(cod_imovel, sigla_uf):
+    """Resultado cacheado {'imovel': ..., 'prodes': ...} do imóvel, ou None."""
+    chave = _chave_resultado(cod_imovel, sigla_uf)
+    return _get_caches()['resultados'].get(chave) if chave else None
+
+
+def gravar_resultado(cod_imovel, sigla_uf, imovel_car_data, prodes):
+    chave = _chave_resultado(cod_imovel, sigla_uf)
+    if chave:
+        _get_caches()['resultados'].set(chave, {'imovel': imovel_car_data, 'prodes': prodes})
+
+
+def obter_cod_coordenada(lat, lon):
+    """cod_imovel conhecido para a coordenada, SEM_IMOVEL, ou None se nunca consultada."""
+    chave = _chave_coordenada(lat, lon)
+    return _get_caches()['coordenadas'].get(chave) if chave else None
+
+
+def gravar_cod_coordenada(lat, lon, cod_imovel):
+    chave = _chave_coordenada(lat, lon)
+    if chave:
+        _get_caches()['coordenadas'].set(chave, cod_imovel or SEM_IMOVEL)
+
+
+def metricas():
+    caches = _get_caches()
+    return {nome: cache.metricas() for nome, cache in caches.items()}
@@ -0,0 +1,146 @@
+# SeloDeMap/app/car.py
+# Tabela CAR nacional (Config.CAR_TABELA), particionada por UF.
+#
+# Uma única tabela com índice GiST em geom permite localizar o imóvel de uma
+# coordenada numa só consulta, sem descobrir a UF antes. Cada UF é uma
+# partição (<CAR_TABELA>_<uf>); consultas por código filtram também a UF (o
+# prefixo do código) e só tocam uma partição. O CHECK garante que a UF é o
+# prefixo do código, de modo que o índice único (cod_imovel, sigla_uf) - a
+# chave de partição precisa fazer parte dele - vale para cod_imovel sozinho.
+#
+# `flask migrar-car-nacional` cria a estrutura e copia as tabelas antigas por
+# UF (imoveis_car_<uf>), que podem ser descartadas depois.
+#
+# Versão dos dados (chave do cache de análises, app/cache_analise.py): a
+# tabela car_versoes guarda um contador por tabela nacional e por partição,
+# incrementado por gatilhos de instrução (FOR EACH STATEMENT) a cada INSERT,
+# UPDATE, DELETE, COPY ou TRUNCATE. O incremento é transacional: a versão nova
+# fica visível junto com os dados, também nas réplicas de leitura. Uma
+# escrita na partição incrementa a partição e a tabela nacional; uma escrita
+# pela tabela nacional pode ter tocado qualquer partição e incrementa todas.
+import psycopg2
+from psycopg2 import sql
+
+from . import db, utils
+
+TABELA_LEGADA = "imoveis_car_{uf}"  # Tabelas por UF anteriores à tabela nacional
+
+# A versão começa no instante de criação da linha (ms): recriar a tabela de
+# versões não repete versões já usadas nas chaves do cache em disco.
+SQL_VERSIONAMENTO = """
+    CREATE TABLE IF NOT EXISTS car_versoes (
+        tabela text PRIMARY KEY,
+        versao bigint NOT NULL DEFAULT (extract(epoch FROM clock_timestamp()) * 1000)::bigint,
+        atualizada_em timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE OR REPLACE FUNCTION car_versao_incrementar() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_TABLE_NAME = TG_ARGV[0] THEN
+            UPDATE car_versoes SET versao = versao + 1, atualizada_em = now()
+            WHERE tabela = TG_ARGV[0] OR starts_with(tabela, TG_ARGV[0] || '_');
+        ELSE
+            UPDATE car_versoes SET versao = versao + 1, atualizada_em = now()
+            WHERE tabela IN (TG_TABLE_NAME, TG_ARGV[0]);
+        END IF;
+        RETURN NULL;
+    END $$;
+"""
+
+
+def _ddl_tabela(tabela, srid):
+    nome = sql.Identifier(tabela)
+    return sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {nome} (
+            id bigint,
+            cod_imovel text NOT NULL,
+            sigla_uf text NOT NULL CHECK (sigla_uf = upper(left(cod_imovel, 2))),
+            municipio text,
+            area numeric,
+            geom geometry(MultiPolygon, {srid}) NOT NULL
+        ) PARTITION BY LIST (sigla_uf);
+        CREATE UNIQUE INDEX IF NOT EXISTS {idx_cod} ON {nome} (cod_imovel, sigla_uf);
+        CREATE INDEX IF NOT EXISTS {idx_geom} ON {nome} USING gist (geom);
+    """).format(nome=nome, srid=sql.Literal(int(srid)),
+                idx_cod=sql.Identifier(f"{tabela}_cod_imovel_uidx"),
+                idx_geom=sql.Identifier(f"{tabela}_geom_gist"))
+
+
+def _ddl_versionamento(tabela_gatilho, tabela):
+    """Linha de car_versoes e gatilho de instrução de `tabela_gatilho` (a nacional ou uma partição)."""
+    # TRUNCATE da tabela nacional se estende às partições e dispara os gatilhos delas
+    eventos = "INSERT OR UPDATE OR DELETE" if tabela_gatilho == tabela else "INSERT OR UPDATE OR DELETE OR TRUNCATE"
+    return sql.SQL("""
+        INSERT INTO car_versoes (tabela) VALUES ({nome_gatilho}) ON CONFLICT (tabela) DO NOTHING;
+        DROP TRIGGER IF EXISTS car_versao ON {alvo};
+        CREATE TRIGGER car_versao AFTER {eventos} ON {alvo}
+            FOR EACH STATEMENT EXECUTE FUNCTION car_versao_incrementar({nome_tabela});
+    """).format(nome_gatilho=sql.Literal(tabela_gatilho), alvo=sql.Identifier(tabela_gatilho),
+                 eventos=sql.SQL(eventos), nome_tabela=sql.Literal(tabela))
+
+
+def criar_estrutura(conn, tabela, srid):
+    """Cria a tabela particionada, seus índices e o versionamento (idempotente)."""
+    with conn.cursor() as cursor:
+        cursor.execute(_ddl_tabela(tabela, srid))
+        cursor.execute(SQL_VERSIONAMENTO)
+        cursor.execute(_ddl_versionamento(tabela, tabela))
+    conn.commit()
+
+
+def criar_particao(conn, tabela, sigla_uf):
+    particao = f"{tabela}_{sigla_uf.lower()}"
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {particao} PARTITION OF {tabela} FOR VALUES IN ({uf})").format(
+            particao=sql.Identifier(particao), tabela=sql.Identifier(tabela), uf=sql.Literal(sigla_uf.upper())))
+        # Gatilhos de instrução não são herdados: cada partição tem o seu (cargas direto na partição)
+        cursor.execute(_ddl_versionamento(particao, tabela))
+    conn.commit()
+    return particao
+
+
+def copiar_tabela_legada(conn, tabela, sigla_uf, srid):
+    """Copia imoveis_car_<uf> para a partição da UF.
+
+    Retorna (copiados, ignorados); ignorados são registros cujo código não
+    começa pela UF ou que já estavam na tabela nacional. None se a tabela
+    antiga não existe.
+    """
+    legada = TABELA_LEGADA.format(uf=sigla_uf.lower())
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (legada,))
+        if not cursor.fetchone()[0]:
+            return None
+        cursor.execute(sql.SQL("SELECT count(*) FROM {legada}").format(legada=sql.Identifier(legada)))
+        total = cursor.fetchone()[0]
+        cursor.execute(sql.SQL("""
+            INSERT INTO {tabela} (id, cod_imovel, sigla_uf, municipio, area, geom)
+            SELECT id, cod_imovel, {uf}, municipio, area, ST_Multi(ST_Transform(geom, {srid}))
+            FROM {legada}
+            WHERE upper(left(cod_imovel, 2)) = {uf}
+            ON CONFLICT (cod_imovel, sigla_uf) DO NOTHING
+        """).format(tabela=sql.Identifier(tabela), legada=sql.Identifier(legada),
+                    uf=sql.Literal(sigla_uf.upper()), srid=sql.Literal(int(srid))))
+        copiados = cursor.rowcount
+    conn.commit()
+    return copiados, total - copiados
+
+
+def migrar(tabela, srid, ufs=None, progresso=None):
+    """Cria a tabela nacional, as partições das `ufs` (padrão: todas) e copia as tabelas antigas."""
+    ufs = sorted(uf.upper() for uf in ufs) if ufs else sorted(utils.SIGLAS_UF)
+    conn = db.nova_conexao()
+    try:
+        criar_estrutura(conn, tabela, srid)
+        for sigla_uf in ufs:
+            particao = criar_particao(conn, tabela, sigla_uf)
+            resultado = copiar_tabela_legada(conn, tabela, sigla_uf, srid)
+            if progresso:
+                progresso(sigla_uf, particao, resultado)
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("ANALYZE {tabela}").format(tabela=sql.Identifier(tabela)))
+        conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
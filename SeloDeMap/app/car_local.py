@@ -0,0 +1,441 @@
+# SeloDeMap/app/car_local.py
+# Backend CAR embutido (Config.CAR_BACKEND = 'local').
+#
+# As consultas CAR do /analisar (imóvel por coordenada, por código e
+# vizinhos) vão, no backend 'postgis', ao banco da VPS: cada busca paga a
+# latência da rede e a aplicação para quando o banco está fora do ar. Aqui
+# as partições CAR são exportadas do PostGIS (`flask --app run
+# exportar-car-local`) para um arquivo por UF em CAR_LOCAL_DIR e consultadas
+# no próprio processo, com os mesmos registros (id, código, UF, município,
+# área numeric, WKB do ST_AsBinary e a geometria de exibição já simplificada
+# no PostGIS) que o banco devolveria.
+#
+# Dois formatos, cada um com o seu índice espacial embutido no arquivo:
+# - GeoParquet (car_<uf>.parquet, preferido): linhas em ordem de geohash,
+#   em row groups pequenos, com a coluna `bbox` (covering do GeoParquet 1.1).
+#   Na carga só os códigos e os retângulos são lidos; o índice é de dois
+#   níveis (retângulo de cada row group, depois de cada linha) e uma busca
+#   lê apenas os row groups com candidatos, do arquivo mapeado em memória
+#   (as páginas ficam no cache do sistema, compartilhadas entre os workers);
+# - FlatGeobuf (car_<uf>.fgb): a R-tree empacotada do próprio arquivo,
+#   consultada pelo GDAL a cada busca por retângulo; registros pelo FID.
+# O código CAR tem um índice hash (uint64 ordenado, busca binária) para a
+# linha/FID; a igualdade do código é conferida no registro lido.
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import numpy as np
+import pyarrow as pa
+import shapely
+from flask import current_app
+from pyproj import CRS, Geod
+
+from . import db, projecao, utils
+
+FORMATOS = {'parquet': '.parquet', 'fgb': '.fgb'}  # Ordem de preferência quando os dois existem
+TAMANHO_ROW_GROUP = 64  # Linhas por row group do GeoParquet: o que uma busca lê por candidato
+COLUNAS = ('id', 'cod_imovel', 'sigla_uf', 'municipio', 'area', 'geom_exibicao')
+# Mesmas colunas das consultas de app/utils.py; `area` em texto preserva o numeric exato
+SQL_EXPORTAR = """
+    SELECT id, cod_imovel, sigla_uf, municipio, area::text AS area, ST_AsBinary(geom) AS geom_wkb{geom_exibicao}
+    FROM {table_name}
+    ORDER BY ST_GeoHash(ST_Centroid(ST_Envelope(geom)), 10), id
+"""
+_GEOD = Geod(ellps='WGS84')  # Elipsoide do ST_Distance(geography)
+
+_arquivos = {}  # {caminho: ArquivoCarParquet | ArquivoCarFlatGeobuf}
+_arquivos_lock = threading.Lock()
+
+
+class ArquivoCarAusente(FileNotFoundError):
+    pass
+
+
+def ativo():
+    return current_app.config['CAR_BACKEND'] == 'local'
+
+
+def _esquema(com_bbox):
+    campos = [('id', pa.int64()), ('cod_imovel', pa.string()), ('sigla_uf', pa.string()), ('municipio', pa.string()),
+              ('area', pa.string()), ('geom_exibicao', pa.binary())]
+    if com_bbox:
+        campos.append(('bbox', pa.struct([(nome, pa.float64()) for nome in ('xmin', 'ymin', 'xmax', 'ymax')])))
+    campos.append(('geometry', pa.binary()))
+    return pa.schema(campos)
+
+
+def _intersectam(caixas, xmin, ymin, xmax, ymax):
+    """Máscara das caixas (n x 4: xmin, ymin, xmax, ymax) que tocam o retângulo."""
+    return (caixas[:, 0] <= xmax) & (caixas[:, 2] >= xmin) & (caixas[:, 1] <= ymax) & (caixas[:, 3] >= ymin)
+
+
+def _hash_codigo(cod_imovel):
+    return hashlib.blake2b(cod_imovel.encode(), digest_size=8).digest()
+
+
+class _IndiceCodigo:
+    """cod_imovel -> posições, por hash uint64 ordenado (sem guardar os códigos em memória)."""
+
+    def __init__(self, codigos, posicoes):
+        hashes = np.frombuffer(b''.join(_hash_codigo(codigo) for codigo in codigos), dtype='<u8')
+        ordem = np.argsort(hashes, kind='stable')
+        self.hashes = hashes[ordem]
+        self.posicoes = np.asarray(posicoes, dtype=np.int64)[ordem]
+
+    def buscar(self, cod_imovel):
+        valor = np.frombuffer(_hash_codigo(cod_imovel), dtype='<u8')[0]
+        inicio, fim = np.searchsorted(self.hashes, valor, side='left'), np.searchsorted(self.hashes, valor, side='right')
+        return self.posicoes[inicio:fim] # Colisões possíveis: o código é conferido no registro lido
+
+
+class ArquivoCarParquet:
+    """Partição CAR exportada em GeoParquet (row groups em ordem de geohash, coluna bbox)."""
+
+    def __init__(self, caminho):
+        import pyarrow.parquet as pq
+        self.caminho = caminho
+        stat = os.stat(caminho)
+        self.assinatura = (stat.st_mtime_ns, stat.st_size)
+        arquivo = pq.ParquetFile(caminho, memory_map=True)
+        self._metadados_parquet = arquivo.metadata # Reaproveitado pelos leitores de cada thread (sem reler o rodapé)
+        self.metadados = json.loads(arquivo.schema_arrow.metadata[b'selodemap'])
+        tabela = arquivo.read(columns=['cod_imovel', 'bbox'], use_threads=False)
+        bbox = tabela.column('bbox').combine_chunks()
+        self.caixas = np.column_stack([bbox.field(nome).to_numpy() for nome in ('xmin', 'ymin', 'xmax', 'ymax')])
+        self.indice_codigo = _IndiceCodigo(tabela.column('cod_imovel').to_pylist(), np.arange(len(self.caixas)))
+        linhas = [self._metadados_parquet.row_group(i).num_rows for i in range(self._metadados_parquet.num_row_groups)]
+        self.inicios = np.concatenate(([0], np.cumsum(linhas))).astype(np.int64)
+        validos = np.flatnonzero(np.diff(self.inicios) > 0)
+        self.caixas_grupos = np.full((len(linhas), 4), np.nan)
+        if len(validos):
+            inicios = self.inicios[validos]
+            self.caixas_grupos[validos] = np.column_stack((
+                np.minimum.reduceat(self.caixas[:, 0], inicios), np.minimum.reduceat(self.caixas[:, 1], inicios),
+                np.maximum.reduceat(self.caixas[:, 2], inicios), np.maximum.reduceat(self.caixas[:, 3], inicios)))
+        self.limites = (tuple(np.nanmin(self.caixas_grupos[:, :2], axis=0)) + tuple(np.nanmax(self.caixas_grupos[:, 2:], axis=0))
+                        if len(validos) else None)
+        self._local = threading.local()
+
+    def _leitor(self):
+        import pyarrow.parquet as pq
+        leitor = getattr(self._local, 'leitor', None)
+        if leitor is None: # ParquetFile não é compartilhado entre threads
+            leitor = self._local.leitor = pq.ParquetFile(self.caminho, memory_map=True, metadata=self._metadados_parquet)
+        return leitor
+
+    def _ler_linhas(self, linhas):
+        """Tabela Arrow (COLUNAS + geometry) das linhas, lendo só os row groups que as contêm."""
+        linhas = np.unique(linhas)
+        grupos = np.searchsorted(self.inicios, linhas, side='right') - 1
+        leitor, partes = self._leitor(), []
+        for grupo in np.unique(grupos):
+            locais = linhas[grupos == grupo] - self.inicios[grupo]
+            tabela = leitor.read_row_group(int(grupo), columns=list(COLUNAS) + ['geometry'], use_threads=False)
+            partes.append(tabela.take(pa.array(locais)))
+        return pa.concat_tables(partes) if partes else _esquema(False).empty_table()
+
+    def por_retangulo(self, xmin, ymin, xmax, ymax):
+        grupos = np.flatnonzero(_intersectam(self.caixas_grupos, xmin, ymin, xmax, ymax))
+        linhas = [self.inicios[grupo] + np.flatnonzero(_intersectam(self.caixas[self.inicios[grupo]:self.inicios[grupo + 1]],
+                                                                    xmin, ymin, xmax, ymax))
+                  for grupo in grupos]
+        return self._ler_linhas(np.concatenate(linhas) if linhas else np.empty(0, dtype=np.int64))
+
+    def por_codigo(self, cod_imovel):
+        return self._ler_linhas(self.indice_codigo.buscar(cod_imovel))
+
+
+class ArquivoCarFlatGeobuf:
+    """Partição CAR exportada em FlatGeobuf (R-tree empacotada do arquivo)."""
+
+    def __init__(self, caminho):
+        import pyogrio
+        from pyogrio import raw
+        self.caminho = caminho
+        stat = os.stat(caminho)
+        self.assinatura = (stat.st_mtime_ns, stat.st_size)
+        info = pyogrio.read_info(caminho)
+        self.metadados = json.loads((info.get('layer_metadata') or {}).get('selodemap', '{}'))
+        self.limites = tuple(info['total_bounds']) if info['features'] else None
+        _, tabela = raw.read_arrow(caminho, columns=['cod_imovel'], read_geometry=False, return_fids=True)
+        self.indice_codigo = _IndiceCodigo(tabela.column('cod_imovel').to_pylist(),
+                                           tabela.column(0).to_numpy())
+
+    def _ler(self, **filtro):
+        from pyogrio import raw
+        meta, tabela = raw.read_arrow(self.caminho, columns=list(COLUNAS), **filtro)
+        geometria = meta['geometry_name'] or 'wkb_geometry'
+        return tabela.rename_columns(['geometry' if nome == geometria else nome for nome in tabela.schema.names])
+
+    def por_retangulo(self, xmin, ymin, xmax, ymax):
+        return self._ler(bbox=(xmin, ymin, xmax, ymax))
+
+    def por_codigo(self, cod_imovel):
+        fids = self.indice_codigo.buscar(cod_imovel)
+        if not len(fids):
+            return _esquema(False).empty_table()
+        return self._ler(fids=fids)
+
+
+# --- Arquivos ---
+def caminho_uf(sigla_uf, diretorio=None):
+    """Arquivo da UF em CAR_LOCAL_DIR (GeoParquet antes de FlatGeobuf), ou None se não foi exportado."""
+    diretorio = diretorio or current_app.config['CAR_LOCAL_DIR']
+    for extensao in FORMATOS.values():
+        caminho = os.path.join(diretorio, f"car_{sigla_uf.lower()}{extensao}")
+        if os.path.exists(caminho):
+            return caminho
+    return None
+
+
+def _ufs_exportadas():
+    return [sigla for sigla in sorted(utils.SIGLAS_UF) if caminho_uf(sigla)]
+
+
+def get_arquivo(caminho):
+    """Arquivo carregado no processo (recarregado se foi reexportado)."""
+    stat = os.stat(caminho)
+    assinatura = (stat.st_mtime_ns, stat.st_size)
+    arquivo = _arquivos.get(caminho)
+    if arquivo is not None and arquivo.assinatura == assinatura:
+        return arquivo
+    with _arquivos_lock:
+        arquivo = _arquivos.get(caminho)
+        if arquivo is None or arquivo.assinatura != assinatura:
+            arquivo = ArquivoCarParquet(caminho) if caminho.endswith('.parquet') else ArquivoCarFlatGeobuf(caminho)
+            config = current_app.config
+            if (arquivo.metadados.get('tolerancia_exibicao'), arquivo.metadados.get('precisao')) != \
+                    (config['CAR_GEOMETRIA_TOLERANCIA_EXIBICAO'], config['CAR_GEOMETRIA_PRECISAO']):
+                current_app.logger.warning(f"{caminho}: geometria de exibição exportada com outra tolerância/precisão "
+                                           f"({arquivo.metadados}); reexporte para seguir a Config.")
+            _arquivos[caminho] = arquivo
+    return arquivo
+
+
+def _arquivo_uf(sigla_uf):
+    caminho = caminho_uf(sigla_uf)
+    if caminho is None:
+        raise ArquivoCarAusente(f"CAR local da UF {sigla_uf} não encontrado em {current_app.config['CAR_LOCAL_DIR']} "
+                                f"(gere com `flask exportar-car-local --uf {sigla_uf}`).")
+    return get_arquivo(caminho)
+
+
+def carregar_todos():
+    """Carrega os arquivos de todas as UFs exportadas (aquecimento do mestre); retorna o nº de imóveis."""
+    return sum(len(_arquivo_uf(sigla).indice_codigo.hashes) for sigla in _ufs_exportadas())
+
+
+def versao(sigla_uf=None):
+    """Versão (para o cache de análises) do arquivo da UF ou, sem UF, do conjunto exportado; None se ausente."""
+    siglas = [sigla_uf.upper()] if sigla_uf else _ufs_exportadas()
+    assinaturas = []
+    for sigla in siglas:
+        caminho = caminho_uf(sigla) if sigla in utils.SIGLAS_UF else None
+        if caminho is None:
+            return None
+        stat = os.stat(caminho)
+        assinaturas.append(f"{sigla}:{stat.st_mtime_ns}:{stat.st_size}")
+    return 'local:' + ','.join(assinaturas) if assinaturas else None
+
+
+# --- Consulta ---
+def _registros(tabela, compacta, indices=None):
+    """Registros no formato das linhas do PostGIS (RealDictCursor) de app/utils.py."""
+    if indices is not None:
+        tabela = tabela.take(pa.array(indices, type=pa.int64()))
+    registros = []
+    for linha in tabela.to_pylist():
+        registro = {'id': linha['id'], 'cod_imovel': linha['cod_imovel'], 'sigla_uf': linha['sigla_uf'],
+                    'municipio': linha['municipio'], 'area': Decimal(linha['area']) if linha['area'] is not None else None,
+                    'geom_wkb': linha['geometry']}
+        if compacta:
+            registro['geom_exibicao_wkb'] = linha['geom_exibicao']
+        registros.append(registro)
+    return registros
+
+
+def _geometrias(tabela):
+    return shapely.from_wkb(tabela.column('geometry').to_numpy(zero_copy_only=False))
+
+
+def _registro_codigo(arquivo, cod_imovel, compacta=False):
+    tabela = arquivo.por_codigo(cod_imovel)
+    iguais = np.flatnonzero(tabela.column('cod_imovel').to_numpy(zero_copy_only=False) == cod_imovel)
+    return _registros(tabela, compacta, iguais[:1])[0] if len(iguais) else None
+
+
+def buscar_registro(tipo, params):
+    """Registro CAR de get_imovel_car_from_coords ('coords', (lon, lat) em EPSG:4326) ou
+    get_imovel_car_from_code ('code', (cod_imovel, sigla_uf)); None se não houver.
+
+    Por coordenada, entre imóveis sobrepostos, o de menor id (como no SQL).
+    Levanta ArquivoCarAusente se nenhuma UF (coords) ou a UF do código não foi exportada.
+    """
+    compacta = current_app.config['CAR_GEOMETRIA_COMPACTA']
+    if tipo == 'code':
+        return _registro_codigo(_arquivo_uf(params[1]), params[0], compacta)
+
+    siglas = _ufs_exportadas()
+    if not siglas:
+        raise ArquivoCarAusente(f"Nenhum arquivo CAR local em {current_app.config['CAR_LOCAL_DIR']} "
+                                "(gere com `flask exportar-car-local`).")
+    x, y = projecao.reprojetar_ponto(params[0], params[1], projecao.WGS84, f"EPSG:{int(current_app.config['CAR_SRID'])}")
+    melhor = None # (id, tabela, índice)
+    for sigla in siglas:
+        arquivo = _arquivo_uf(sigla)
+        if arquivo.limites is None or not _intersectam(np.array([arquivo.limites]), x, y, x, y)[0]:
+            continue
+        tabela = arquivo.por_retangulo(x, y, x, y)
+        if tabela.num_rows == 0:
+            continue
+        dentro = np.flatnonzero(shapely.contains_xy(_geometrias(tabela), x, y))
+        if len(dentro):
+            i = dentro[np.argmin(tabela.column('id').to_numpy()[dentro])]
+            id_imovel = int(tabela.column('id')[int(i)].as_py())
+            if melhor is None or id_imovel < melhor[0]:
+                melhor = (id_imovel, tabela, i)
+    return _registros(melhor[1], compacta, [melhor[2]])[0] if melhor is not None else None
+
+
+def _distancia_m(geometria, referencia):
+    """Distância geodésica (m) entre os pontos mais próximos (no plano lon/lat) das duas geometrias.
+
+    Aproxima o ST_Distance(geography), que procura o mínimo no próprio
+    elipsoide; a diferença é de centímetros a poucos metros nas distâncias dos vizinhos.
+    """
+    linha = shapely.shortest_line(geometria, referencia)
+    (x0, y0), (x1, y1) = shapely.get_coordinates(linha)
+    return float(_GEOD.inv(x0, y0, x1, y1)[2])
+
+
+def registros_vizinhos(cod_imovel, sigla_uf, distancia_graus, limite):
+    """Linhas do SQL_CAR_VIZINHOS: imóveis da UF a até `distancia_graus`, pela distância e pelo id, com distancia_m."""
+    arquivo = _arquivo_uf(sigla_uf)
+    referencia = _registro_codigo(arquivo, cod_imovel)
+    if referencia is None:
+        return []
+    geometria = shapely.from_wkb(referencia['geom_wkb'])
+    xmin, ymin, xmax, ymax = shapely.bounds(geometria)
+    tabela = arquivo.por_retangulo(xmin - distancia_graus, ymin - distancia_graus, xmax + distancia_graus, ymax + distancia_graus)
+    if tabela.num_rows == 0:
+        return []
+    geometrias = _geometrias(tabela)
+    shapely.prepare(geometria)
+    candidatos = np.flatnonzero(shapely.dwithin(geometrias, geometria, distancia_graus)
+                                & (tabela.column('cod_imovel').to_numpy(zero_copy_only=False) != cod_imovel))
+    distancias = shapely.distance(geometrias[candidatos], geometria)
+    ordem = np.lexsort((tabela.column('id').to_numpy()[candidatos], distancias))[:limite]
+    registros = _registros(tabela, False, candidatos[ordem])
+    for registro, i, distancia in zip(registros, candidatos[ordem], distancias[ordem]):
+        registro['distancia_m'] = _distancia_m(geometrias[i], geometria) if distancia > 0 else 0.0
+    return registros
+
+
+# --- Exportação ---
+def _lote_arrow(linhas, com_bbox):
+    geometrias_wkb = [bytes(linha['geom_wkb']) for linha in linhas]
+    colunas = {
+        'id': [linha['id'] for linha in linhas],
+        'cod_imovel': [linha['cod_imovel'] for linha in linhas],
+        'sigla_uf': [linha['sigla_uf'] for linha in linhas],
+        'municipio': [linha['municipio'] for linha in linhas],
+        'area': [str(linha['area']) if linha['area'] is not None else None for linha in linhas],
+        'geom_exibicao': [bytes(linha['geom_exibicao_wkb']) if linha.get('geom_exibicao_wkb') is not None else None
+                          for linha in linhas],
+    }
+    if com_bbox:
+        limites = shapely.bounds(utils.decodificar_wkb(geometrias_wkb))
+        colunas['bbox'] = pa.StructArray.from_arrays([pa.array(limites[:, i]) for i in range(4)],
+                                                     names=['xmin', 'ymin', 'xmax', 'ymax'])
+    colunas['geometry'] = geometrias_wkb
+    esquema = _esquema(com_bbox)
+    return pa.RecordBatch.from_arrays([pa.array(colunas[campo.name], type=campo.type) for campo in esquema], schema=esquema)
+
+
+def _metadados_geo(srid):
+    return {
+        'version': '1.1.0',
+        'primary_column': 'geometry',
+        'columns': {'geometry': {
+            'encoding': 'WKB', 'geometry_types': ['MultiPolygon'], 'crs': CRS.from_epsg(srid).to_json_dict(),
+            'covering': {'bbox': {nome: ['bbox', nome] for nome in ('xmin', 'ymin', 'xmax', 'ymax')}},
+        }},
+    }
+
+
+def gravar(blocos, destino, metadados, progresso=None):
+    """Grava os blocos de linhas (dicts no formato do SQL_EXPORTAR) em GeoParquet ou FlatGeobuf, pela extensão
+    de `destino`; o arquivo é substituído de forma atômica. Retorna o nº de imóveis gravados."""
+    import pyarrow.parquet as pq
+    from pyogrio import raw
+    os.makedirs(os.path.dirname(os.path.abspath(destino)), exist_ok=True)
+    extensao = os.path.splitext(destino)[1]
+    destino_tmp = destino + '.tmp' + extensao # O GDAL escolhe o driver também pela extensão
+    total = 0
+
+    def lotes(com_bbox):
+        nonlocal total
+        for linhas in blocos:
+            lote = _lote_arrow(linhas, com_bbox)
+            total += lote.num_rows
+            if progresso:
+                progresso(total)
+            yield lote
+
+    if extensao == FORMATOS['parquet']:
+        esquema = _esquema(True).with_metadata({b'geo': json.dumps(_metadados_geo(metadados['srid'])).encode(),
+                                                b'selodemap': json.dumps(metadados).encode()})
+        with pq.ParquetWriter(destino_tmp, esquema) as writer:
+            for lote in lotes(True):
+                writer.write_table(pa.Table.from_batches([lote]), row_group_size=TAMANHO_ROW_GROUP)
+    elif extensao == FORMATOS['fgb']:
+        # A R-tree (SPATIAL_INDEX) reordena os registros pela curva de Hilbert ao fechar o arquivo
+        raw.write_arrow(pa.RecordBatchReader.from_batches(_esquema(False), lotes(False)), destino_tmp, driver='FlatGeobuf',
+                        geometry_name='geometry', geometry_type='MultiPolygon', crs=f"EPSG:{metadados['srid']}",
+                        layer_options={'SPATIAL_INDEX': 'YES'}, layer_metadata={'selodemap': json.dumps(metadados)})
+    else:
+        raise ValueError(f"Formato do CAR local não suportado: {destino} (use .parquet ou .fgb).")
+    os.replace(destino_tmp, destino)
+    return total
+
+
+def exportar_uf(sigla_uf, destino, tamanho_lote=2000, progresso=None):
+    """Exporta a partição CAR da UF do PostGIS para `destino` (.parquet ou .fgb); retorna o nº de imóveis."""
+    from psycopg2.extras import RealDictCursor
+    config = current_app.config
+    table_name = utils.car_table_name(sigla_uf)
+    if not table_name:
+        raise ValueError(f"UF inválida: '{sigla_uf}'.")
+    geom_exibicao = utils.SQL_CAR_GEOM_EXIBICAO.format(tolerancia=float(config['CAR_GEOMETRIA_TOLERANCIA_EXIBICAO']),
+                                                       precisao=float(config['CAR_GEOMETRIA_PRECISAO']))
+    metadados = {
+        'sigla_uf': sigla_uf.upper(),
+        'tabela': table_name,
+        'srid': int(config['CAR_SRID']),
+        'tolerancia_exibicao': config['CAR_GEOMETRIA_TOLERANCIA_EXIBICAO'],
+        'precisao': config['CAR_GEOMETRIA_PRECISAO'],
+        'exportado_em': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+    conn = db.nova_conexao()
+    try:
+        # Cursor nomeado (server-side): a partição chega em blocos, sem carregar a UF inteira em memória
+        cursor = conn.cursor(name=f"exportar_car_{sigla_uf.lower()}", cursor_factory=RealDictCursor)
+        cursor.itersize = tamanho_lote
+        cursor.execute(SQL_EXPORTAR.format(table_name=table_name, geom_exibicao=geom_exibicao))
+
+        def blocos():
+            while True:
+                linhas = cursor.fetchmany(tamanho_lote)
+                if not linhas:
+                    return
+                yield linhas
+
+        total = gravar(blocos(), destino, metadados, progresso)
+        cursor.close()
+    finally:
+        conn.close()
+    return total
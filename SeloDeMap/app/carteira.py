@@ -0,0 +1,347 @@
+# SeloDeMap/app/carteira.py
+# Análise de carteiras de imóveis (polígonos enviados pelo cliente, com ou sem
+# CAR) fora do Flask: `python selodemap.py analisar carteira.gpkg -o resultado.parquet`.
+#
+# O arquivo de entrada (GeoPackage, Shapefile, FlatGeobuf, GeoJSON ou
+# GeoParquet) é lido em blocos de feições (Arrow), sem carregar o arquivo
+# inteiro. Cada bloco vai, em WKB, para um pool de processos; cada processo
+# mantém um único handle do raster PRODES (ou do catálogo de tiles) aberto
+# durante toda a execução. Os resultados são gravados em ordem, bloco a
+# bloco, em GeoParquet ou CSV. Só alguns blocos ficam em memória ao mesmo
+# tempo, então o consumo não cresce com o tamanho da carteira. A saída é
+# gravada num arquivo temporário e só recebe o nome final quando a carteira
+# inteira foi analisada: uma execução interrompida não deixa um resultado
+# truncado com cara de completo.
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import ExitStack
+
+import geopandas as gpd
+import numpy as np
+import pyogrio
+import shapely
+
+from . import catalogo_prodes, projecao, raster, utils
+
+TAMANHO_BLOCO = 500
+ANOS_PRODES = list(range(2001, 2024)) # Valores 1..23 do raster
+EXTENSOES_PARQUET = ('.parquet', '.geoparquet')
+COLUNAS_RESULTADO = ['desmatamento_total_ha'] + [f'desmatamento_{ano}_ha' for ano in ANOS_PRODES] + ['aviso_prodes']
+
+
+class EntradaCarteiraInvalida(ValueError):
+    """Arquivo de carteira ilegível ou em formato não suportado."""
+
+
+# --- Leitura em blocos ---
+def _eh_parquet(caminho):
+    return caminho.lower().endswith(EXTENSOES_PARQUET)
+
+
+def _verificar_entrada(caminho):
+    if not os.path.exists(caminho):
+        raise EntradaCarteiraInvalida(f"Arquivo de carteira não encontrado: {caminho}")
+
+
+def contar_feicoes(caminho, camada=None):
+    """Número de feições da carteira (None se o formato não informa sem percorrer o arquivo)."""
+    _verificar_entrada(caminho)
+    if _eh_parquet(caminho):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(caminho).metadata.num_rows
+    total = pyogrio.read_info(caminho, layer=camada)['features']
+    return total if total >= 0 else None
+
+
+def _blocos_parquet(caminho, tamanho_bloco):
+    import pyarrow.parquet as pq
+    arquivo = pq.ParquetFile(caminho)
+    metadados = (arquivo.schema_arrow.metadata or {}).get(b'geo')
+    if metadados is None:
+        raise EntradaCarteiraInvalida(f"{caminho}: Parquet sem metadados GeoParquet ('geo').")
+    geo = json.loads(metadados)
+    coluna = geo['primary_column']
+    if geo['columns'][coluna].get('encoding', 'WKB').upper() != 'WKB':
+        raise EntradaCarteiraInvalida(f"{caminho}: codificação de geometria {geo['columns'][coluna]['encoding']} não suportada (use WKB).")
+    crs = geo['columns'][coluna].get('crs', 'OGC:CRS84') # Sem 'crs' a especificação assume OGC:CRS84
+    for lote in arquivo.iter_batches(batch_size=tamanho_bloco):
+        df = lote.to_pandas()
+        geometria = gpd.GeoSeries.from_wkb(df.pop(coluna), crs=crs)
+        yield gpd.GeoDataFrame(df, geometry=geometria)
+
+
+def _blocos_ogr(caminho, tamanho_bloco, camada):
+    with pyogrio.open_arrow(caminho, layer=camada, batch_size=tamanho_bloco, use_pyarrow=True) as (meta, leitor):
+        coluna = meta['geometry_name'] or 'wkb_geometry'
+        for lote in leitor:
+            df = lote.to_pandas()
+            geometria = gpd.GeoSeries.from_wkb(df.pop(coluna), crs=meta['crs'])
+            yield gpd.GeoDataFrame(df, geometry=geometria)
+
+
+def ler_blocos(caminho, tamanho_bloco=TAMANHO_BLOCO, camada=None):
+    """Gera GeoDataFrames de até `tamanho_bloco` feições da carteira, na ordem do arquivo."""
+    _verificar_entrada(caminho)
+    if _eh_parquet(caminho):
+        return _blocos_parquet(caminho, tamanho_bloco)
+    return _blocos_ogr(caminho, tamanho_bloco, camada)
+
+
+# --- Processos de análise ---
+_fonte = {'prodes': None, 'catalogo': None}
+
+
+def inicializar_processo(prodes_path, catalogo_path):
+    """Initializer do pool: fontes PRODES deste processo (catálogo de tiles, se existir, ou arquivo único)."""
+    _fonte['prodes'] = prodes_path
+    _fonte['catalogo'] = catalogo_path
+
+
+def _recortar(src_prodes, catalogo, geometria_4674):
+    if catalogo is not None:
+        valores, transform = catalogo_prodes.recortar(catalogo, geometria_4674)
+        return valores, transform, catalogo.crs
+    valores, transform = utils.recortar_prodes(src_prodes, geometria_4674)
+    return valores, transform, src_prodes.crs
+
+
+def _analisar_geometria(src_prodes, catalogo, geometria_4674):
+    """(áreas desmatadas por ano, aviso) de uma geometria em EPSG:4674."""
+    if geometria_4674 is None or geometria_4674.is_empty:
+        return {}, "Feição sem geometria."
+    aviso = None
+    if not geometria_4674.is_valid:
+        geometria_4674 = shapely.make_valid(geometria_4674)
+        aviso = "Geometria inválida corrigida (make_valid)."
+    valores, transform, crs = _recortar(src_prodes, catalogo, geometria_4674)
+    if valores is None:
+        return {}, "Imóvel fora da área do raster PRODES de recorte."
+    if valores.size == 0 or np.all(valores == 255):
+        return {}, "Nenhuma área PRODES válida no recorte."
+    return utils.prodes_areas_por_ano(valores, utils.prodes_pixel_area_m2(crs, transform)), aviso
+
+
+def analisar_bloco(geometrias_wkb, crs_entrada):
+    """Áreas PRODES de um bloco de geometrias (WKB no CRS de entrada): lista de (áreas por ano, aviso)."""
+    geometrias = projecao.reprojetar_geometria(shapely.from_wkb(geometrias_wkb), crs_entrada, projecao.SIRGAS2000)
+    catalogo = catalogo_prodes.get_catalogo(_fonte['catalogo'])
+    resultados = []
+    with ExitStack() as pilha:
+        src_prodes = None
+        if catalogo is None:
+            if not os.path.exists(_fonte['prodes']):
+                raise FileNotFoundError(f"Arquivo PRODES de recorte não encontrado: {_fonte['prodes']}")
+            # Handle do pool do processo: o mesmo dataset atende todos os blocos deste processo
+            src_prodes = pilha.enter_context(raster.dataset(_fonte['prodes']))
+        for geometria in geometrias:
+            try:
+                resultados.append(_analisar_geometria(src_prodes, catalogo, geometria))
+            except Exception as e:
+                resultados.append(({}, f"Erro ao processar imagem PRODES: {e}"))
+    return resultados
+
+
+def _colunas_resultado(resultados):
+    colunas = {coluna: [] for coluna in COLUNAS_RESULTADO}
+    for areas, aviso in resultados:
+        colunas['desmatamento_total_ha'].append(round(sum(areas.values()), 4))
+        for ano in ANOS_PRODES:
+            colunas[f'desmatamento_{ano}_ha'].append(round(areas.get(ano, 0.0), 4))
+        colunas['aviso_prodes'].append(aviso)
+    return colunas
+
+
+# --- Saída ---
+def _tipos_resultado():
+    """Tipos Arrow das colunas de resultado, fixos (não inferidos do primeiro bloco)."""
+    import pyarrow as pa
+    tipos = {coluna: pa.float64() for coluna in COLUNAS_RESULTADO}
+    tipos['aviso_prodes'] = pa.string()
+    return tipos
+
+
+class _SaidaTemporaria:
+    """Grava em `<caminho>.tmp<extensão>`; fechar() publica o arquivo com os.replace, descartar() o apaga."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        raiz, extensao = os.path.splitext(caminho)
+        self.caminho_tmp = f"{raiz}.tmp{extensao}"
+        if os.path.exists(self.caminho_tmp): # Sobra de uma execução interrompida
+            os.remove(self.caminho_tmp)
+
+    def _encerrar(self):
+        pass
+
+    def fechar(self):
+        self._encerrar()
+        if os.path.exists(self.caminho_tmp):
+            os.replace(self.caminho_tmp, self.caminho)
+
+    def descartar(self):
+        try:
+            self._encerrar()
+        finally:
+            if os.path.exists(self.caminho_tmp):
+                os.remove(self.caminho_tmp)
+
+
+class SaidaCsv(_SaidaTemporaria):
+    """Resultados em CSV (atributos da entrada + áreas, sem a geometria)."""
+
+    def __init__(self, caminho):
+        super().__init__(caminho)
+        self._cabecalho = True
+
+    def escrever(self, bloco):
+        bloco.drop(columns=bloco.geometry.name).to_csv(self.caminho_tmp, mode='w' if self._cabecalho else 'a',
+                                                        header=self._cabecalho, index=False)
+        self._cabecalho = False
+
+
+class SaidaGeoParquet(_SaidaTemporaria):
+    """Resultados em GeoParquet 1.0 (geometria WKB), um row group por bloco.
+
+    O schema é fixado no primeiro bloco: as colunas de resultado têm tipos
+    fixos e atributos da entrada só com nulos nesse bloco são gravados como
+    texto (os blocos seguintes são convertidos para ele).
+    `metadados` (dict serializável em JSON) vai no schema, na chave 'selodemap'.
+    """
+
+    def __init__(self, caminho, metadados=None):
+        super().__init__(caminho)
+        self.metadados = metadados
+        self._writer = None
+        self._schema = None
+
+    def escrever(self, bloco):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        coluna = bloco.geometry.name
+        tabela = pa.Table.from_pandas(bloco.drop(columns=coluna), preserve_index=False)
+        tabela = tabela.append_column(coluna, pa.array(shapely.to_wkb(bloco.geometry.values), type=pa.binary()))
+        if self._writer is None:
+            geo = {
+                'version': '1.0.0',
+                'primary_column': coluna,
+                # geometry_types vazio: qualquer tipo (os blocos seguintes ainda não foram lidos)
+                'columns': {coluna: {'encoding': 'WKB', 'geometry_types': [],
+                                     'crs': bloco.crs.to_json_dict() if bloco.crs is not None else None}},
+            }
+            metadados = {b'geo': json.dumps(geo).encode()}
+            if self.metadados is not None:
+                metadados[b'selodemap'] = json.dumps(self.metadados).encode()
+            tipos = _tipos_resultado()
+            campos = [campo.with_type(tipos.get(campo.name, pa.string() if pa.types.is_null(campo.type) else campo.type))
+                      for campo in tabela.schema]
+            self._schema = pa.schema(campos, metadata=metadados)
+            self._writer = pq.ParquetWriter(self.caminho_tmp, self._schema)
+        self._writer.write_table(tabela.cast(self._schema)) # Colunas só com nulos num bloco assumem o tipo do schema
+
+    def _encerrar(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def abrir_saida(caminho):
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    if _eh_parquet(caminho):
+        return SaidaGeoParquet(caminho)
+    if caminho.lower().endswith('.csv'):
+        return SaidaCsv(caminho)
+    raise EntradaCarteiraInvalida(f"Formato de saída não suportado: {caminho} (use .parquet ou .csv).")
+
+
+# --- Execução ---
+def _formatar_duracao(segundos):
+    segundos = int(segundos)
+    return f"{segundos // 3600}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+
+
+class Progresso:
+    """Vazão e estimativa de término, impressas em stderr a cada `intervalo` segundos."""
+
+    def __init__(self, total, intervalo=2.0, saida=sys.stderr):
+        self.total = total
+        self.intervalo = intervalo
+        self.saida = saida
+        self.feitos = 0
+        self.inicio = time.monotonic()
+        self._ultimo = 0.0
+
+    def avancar(self, quantidade, final=False):
+        self.feitos += quantidade
+        decorrido = time.monotonic() - self.inicio
+        if not final and decorrido - self._ultimo < self.intervalo:
+            return
+        self._ultimo = decorrido
+        vazao = self.feitos / decorrido if decorrido > 0 else 0.0
+        if self.total:
+            restante = (self.total - self.feitos) / vazao if vazao > 0 else 0
+            linha = (f"{self.feitos}/{self.total} imóveis ({100 * self.feitos / self.total:.1f}%)"
+                     f" | {vazao:.1f} imóveis/s | decorrido {_formatar_duracao(decorrido)}"
+                     f" | restante {_formatar_duracao(restante)}")
+        else:
+            linha = f"{self.feitos} imóveis | {vazao:.1f} imóveis/s | decorrido {_formatar_duracao(decorrido)}"
+        print(linha, file=self.saida, flush=True)
+
+
+def analisar_carteira(entrada, saida, prodes_path, catalogo_path=None, workers=None, tamanho_bloco=TAMANHO_BLOCO,
+                      camada=None, progresso=None):
+    """Analisa a carteira `entrada` e grava as áreas PRODES por feição em `saida`. Retorna o total de feições."""
+    workers = workers or os.cpu_count() or 1
+    blocos = ler_blocos(entrada, tamanho_bloco, camada)
+    destino = abrir_saida(saida)
+    max_em_andamento = workers * 2 # Blocos em voo: limita a memória independentemente do tamanho da entrada
+    pendentes = {} # futuro -> número do bloco
+    prontos = {}   # número do bloco -> GeoDataFrame com resultados, aguardando os anteriores
+    em_memoria = {}
+    proximo_gravar = 0
+    total = 0
+    # 'spawn': processos novos, sem herdar handles GDAL ou contextos PROJ do processo principal
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=inicializar_processo, initargs=(prodes_path, catalogo_path)) as pool:
+        try:
+            numero = 0
+            esgotado = False
+            while True:
+                while not esgotado and len(pendentes) + len(prontos) < max_em_andamento:
+                    bloco = next(blocos, None)
+                    if bloco is None:
+                        esgotado = True
+                        break
+                    if bloco.crs is None:
+                        bloco = bloco.set_crs(projecao.SIRGAS2000) # Sem CRS: assume o do CAR
+                    wkb = shapely.to_wkb(bloco.geometry.values)
+                    futuro = pool.submit(analisar_bloco, wkb, bloco.crs)
+                    pendentes[futuro] = numero
+                    em_memoria[numero] = bloco
+                    numero += 1
+                if not pendentes:
+                    break
+                concluidos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+                for futuro in concluidos:
+                    numero_bloco = pendentes.pop(futuro)
+                    bloco = em_memoria.pop(numero_bloco)
+                    for coluna, valores in _colunas_resultado(futuro.result()).items():
+                        bloco[coluna] = valores
+                    prontos[numero_bloco] = bloco
+                while proximo_gravar in prontos: # Grava na ordem da entrada
+                    bloco = prontos.pop(proximo_gravar)
+                    destino.escrever(bloco)
+                    total += len(bloco)
+                    proximo_gravar += 1
+                    if progresso:
+                        progresso.avancar(len(bloco))
+        except BaseException:
+            destino.descartar()
+            raise
+    destino.fechar()
+    if progresso:
+        progresso.avancar(0, final=True)
+    return total
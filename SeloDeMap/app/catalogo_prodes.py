@@ -0,0 +1,225 @@
+# SeloDeMap/app/catalogo_prodes.py
+# Catálogo de tiles PRODES (vários biomas/UFs) com índice espacial persistido.
+#
+# `flask catalogar-prodes --diretorio dados/prodes` percorre os GeoTIFFs do
+# diretório e grava, num SQLite ao lado dos dados (Config.PRODES_CATALOGO),
+# os metadados de cada tile e sua área de cobertura (em EPSG:4674) numa tabela
+# R*Tree. Na análise, o retângulo envolvente do imóvel consulta o R*Tree e só
+# os tiles que o intersectam são abertos; as janelas lidas de cada um formam
+# um mosaico virtual alinhado à grade dos tiles. O custo por requisição
+# depende do tamanho do imóvel, não da cobertura nacional do catálogo.
+#
+# Todos os tiles de um catálogo devem estar no mesmo CRS e resolução (como os
+# recortes de um mesmo produto PRODES); a construção recusa misturas.
+import os
+import sqlite3
+import threading
+from contextlib import ExitStack
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.features import geometry_mask
+from rasterio.mask import mask
+from rasterio.merge import merge
+
+from . import projecao, raster
+
+EXTENSOES_RASTER = ('.tif', '.tiff')
+NODATA_PRODES = 255
+
+SQL_CRIAR = """
+CREATE TABLE tiles (
+    id INTEGER PRIMARY KEY,
+    caminho TEXT NOT NULL UNIQUE,  -- relativo ao diretório do catálogo
+    bioma TEXT,
+    largura INTEGER NOT NULL,
+    altura INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE tiles_rtree USING rtree(id, min_x, max_x, min_y, max_y);
+CREATE TABLE metadados (chave TEXT PRIMARY KEY, valor TEXT NOT NULL);
+"""
+
+SQL_INTERSECTANDO = """
+    SELECT t.caminho FROM tiles_rtree r JOIN tiles t ON t.id = r.id
+    WHERE r.min_x <= ? AND r.max_x >= ? AND r.min_y <= ? AND r.max_y >= ?
+    ORDER BY t.id
+"""
+
+_catalogo = None
+_catalogo_lock = threading.Lock()
+
+
+class CatalogoProdes:
+    """Consulta ao R*Tree de um catálogo; uma conexão SQLite somente leitura por thread."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.diretorio = os.path.dirname(os.path.abspath(caminho))
+        stat = os.stat(caminho)
+        self.assinatura = (stat.st_mtime_ns, stat.st_size)
+        self.pid = os.getpid()
+        self._local = threading.local()
+        metadados = dict(self._conexao().execute("SELECT chave, valor FROM metadados").fetchall())
+        self.versao = metadados['versao']
+        self.crs = CRS.from_wkt(metadados['crs'])
+        self.origem = (float(metadados['origem_x']), float(metadados['origem_y']))
+        self.resolucao = (float(metadados['resolucao_x']), float(metadados['resolucao_y']))
+        self.total_tiles = int(metadados['total_tiles'])
+
+    def _conexao(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{os.path.abspath(self.caminho)}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def tiles_intersectando(self, limites_4674):
+        """Caminhos absolutos dos tiles cuja cobertura intersecta (min_x, min_y, max_x, max_y) em EPSG:4674."""
+        min_x, min_y, max_x, max_y = limites_4674
+        linhas = self._conexao().execute(SQL_INTERSECTANDO, (max_x, min_x, max_y, min_y)).fetchall()
+        return [os.path.join(self.diretorio, caminho) for caminho, in linhas]
+
+    def alinhar_limites(self, limites):
+        """Expande (min_x, min_y, max_x, max_y), no CRS do catálogo, até a grade de pixels dos tiles."""
+        origem_x, origem_y = self.origem
+        res_x, res_y = self.resolucao
+        min_x, min_y, max_x, max_y = limites
+        coluna_ini = np.floor((min_x - origem_x) / res_x)
+        coluna_fim = np.ceil((max_x - origem_x) / res_x)
+        linha_ini = np.floor((origem_y - max_y) / res_y)
+        linha_fim = np.ceil((origem_y - min_y) / res_y)
+        return (origem_x + coluna_ini * res_x, origem_y - linha_fim * res_y,
+                origem_x + coluna_fim * res_x, origem_y - linha_ini * res_y)
+
+
+def _ler_tile(caminho):
+    with rasterio.open(caminho) as src:
+        if src.count < 1 or src.dtypes[0] != 'uint8':
+            raise ValueError(f"{caminho}: esperado raster PRODES uint8, encontrado {src.dtypes[0]}.")
+        if src.transform.b or src.transform.d:
+            raise ValueError(f"{caminho}: rasters rotacionados não são suportados.")
+        return {
+            'crs': src.crs,
+            'transform': src.transform,
+            'largura': src.width,
+            'altura': src.height,
+            'limites_4674': projecao.reprojetar_limites(src.bounds, src.crs, projecao.SIRGAS2000),
+        }
+
+
+def listar_rasters(diretorio):
+    """GeoTIFFs do diretório (recursivo), em ordem estável."""
+    arquivos = []
+    for raiz, pastas, nomes in os.walk(diretorio):
+        pastas.sort()
+        arquivos += [os.path.join(raiz, nome) for nome in sorted(nomes) if nome.lower().endswith(EXTENSOES_RASTER)]
+    return arquivos
+
+
+def construir_catalogo(diretorio, destino, versao=None, progresso=None):
+    """Grava o catálogo dos GeoTIFFs de `diretorio` em `destino` (substituído de forma atômica).
+
+    O bioma de cada tile é o nome da primeira subpasta abaixo de `diretorio`
+    (ex: dados/prodes/cerrado/...). Retorna o número de tiles catalogados.
+    """
+    arquivos = listar_rasters(diretorio)
+    if not arquivos:
+        raise ValueError(f"Nenhum GeoTIFF encontrado em {diretorio}.")
+    diretorio_catalogo = os.path.dirname(os.path.abspath(destino))
+    os.makedirs(diretorio_catalogo, exist_ok=True)
+    destino_tmp = destino + '.tmp'
+    if os.path.exists(destino_tmp):
+        os.remove(destino_tmp)
+
+    referencia = None
+    conn = sqlite3.connect(destino_tmp)
+    try:
+        conn.executescript(SQL_CRIAR)
+        for i, arquivo in enumerate(arquivos, start=1):
+            tile = _ler_tile(arquivo)
+            if referencia is None:
+                referencia = tile
+            elif not projecao.mesmo_crs(tile['crs'], referencia['crs']):
+                raise ValueError(f"{arquivo}: CRS {tile['crs']} difere do catálogo ({referencia['crs']}).")
+            elif not np.allclose((tile['transform'].a, tile['transform'].e),
+                                 (referencia['transform'].a, referencia['transform'].e)):
+                raise ValueError(f"{arquivo}: resolução {tile['transform'].a} difere do catálogo ({referencia['transform'].a}).")
+            relativo = os.path.relpath(os.path.abspath(arquivo), diretorio_catalogo)
+            subpasta = os.path.relpath(arquivo, diretorio).split(os.sep)
+            cursor = conn.execute("INSERT INTO tiles (caminho, bioma, largura, altura) VALUES (?, ?, ?, ?)",
+                                  (relativo, subpasta[0] if len(subpasta) > 1 else None, tile['largura'], tile['altura']))
+            min_x, min_y, max_x, max_y = tile['limites_4674']
+            conn.execute("INSERT INTO tiles_rtree VALUES (?, ?, ?, ?, ?)", (cursor.lastrowid, min_x, max_x, min_y, max_y))
+            if progresso:
+                progresso(i, len(arquivos), arquivo)
+
+        transform = referencia['transform']
+        if versao is None:
+            maior_mtime = max(os.stat(arquivo).st_mtime_ns for arquivo in arquivos)
+            versao = f"catalogo:{os.path.basename(os.path.normpath(diretorio))}:{len(arquivos)}:{maior_mtime}"
+        conn.executemany("INSERT INTO metadados VALUES (?, ?)", [
+            ('versao', versao),
+            ('crs', referencia['crs'].to_wkt()),
+            ('origem_x', repr(transform.c)),
+            ('origem_y', repr(transform.f)),
+            ('resolucao_x', repr(transform.a)),
+            ('resolucao_y', repr(-transform.e)),
+            ('total_tiles', str(len(arquivos))),
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(destino_tmp, destino)
+    return len(arquivos)
+
+
+def get_catalogo(caminho):
+    """Catálogo do worker (recarregado se o arquivo foi reconstruído), ou None se não existir.
+
+    Após um fork o catálogo herdado é descartado: conexões SQLite não atravessam processos.
+    """
+    global _catalogo
+    if not caminho or not os.path.exists(caminho):
+        return None
+    stat = os.stat(caminho)
+    chave = (caminho, (stat.st_mtime_ns, stat.st_size), os.getpid())
+    catalogo = _catalogo
+    if catalogo is not None and (catalogo.caminho, catalogo.assinatura, catalogo.pid) == chave:
+        return catalogo
+    with _catalogo_lock:
+        catalogo = _catalogo
+        if catalogo is None or (catalogo.caminho, catalogo.assinatura, catalogo.pid) != chave:
+            catalogo = _catalogo = CatalogoProdes(caminho)
+    return catalogo
+
+
+def recortar(catalogo, geometria_4674):
+    """Recorte PRODES da geometria (EPSG:4674) no mosaico virtual dos tiles que a intersectam.
+
+    Retorna (valores 2D uint8, transform) com nodata fora da geometria, como o
+    mask(crop=True, all_touched=True) de um arquivo único, ou (None, None) se
+    nenhum tile cobre o imóvel.
+    """
+    caminhos = catalogo.tiles_intersectando(geometria_4674.bounds)
+    if not caminhos:
+        return None, None
+    geometria = projecao.reprojetar_geometria(geometria_4674, projecao.SIRGAS2000, catalogo.crs)
+    with ExitStack() as pilha:
+        datasets = [pilha.enter_context(raster.dataset(caminho)) for caminho in caminhos]
+        if len(datasets) == 1:
+            try:
+                valores, transform = mask(datasets[0], [geometria], crop=True, all_touched=True, nodata=NODATA_PRODES)
+            except ValueError as e:
+                if "Input shapes do not overlap raster." in str(e):
+                    return None, None # Só o retângulo envolvente encostava no tile
+                raise
+            return valores[0], transform
+        # Janela alinhada à grade comum: cada tile contribui só com os pixels que caem nela
+        min_x, min_y, max_x, max_y = catalogo.alinhar_limites(geometria.bounds)
+        valores, transform = merge(datasets, bounds=(min_x, min_y, max_x, max_y), res=catalogo.resolucao,
+                                   nodata=NODATA_PRODES, indexes=[1])
+    valores = valores[0]
+    fora = geometry_mask([geometria], out_shape=valores.shape, transform=transform, all_touched=True)
+    valores[fora] = NODATA_PRODES
+    return valores, transform
@@ -0,0 +1,109 @@
+# SeloDeMap/app/colormap.py
+# Colorização vetorizada do raster PRODES e codificação PNG rápida.
+#
+# Em vez de aplicar `utils.prodes_colormap_folium` pixel a pixel (como o
+# ImageOverlay do Folium faz), a paleta de 256 entradas é calculada uma vez
+# e a imagem é gravada como PNG indexado (1 byte por pixel + PLTE/tRNS).
+import base64
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from .cache import CacheLRU
+from .utils import prodes_colormap_folium
+
+# Cores RGBA (0-1) de todos os valores possíveis de um raster uint8
+PRODES_LUT_FLOAT = np.array([prodes_colormap_folium(v) for v in range(256)], dtype=np.float64)
+
+_cache_png = None
+_cache_png_lock = threading.Lock()
+
+
+def _normalizar_paleta(lut_float, presentes):
+    """Reproduz a normalização do `folium.utilities.write_png`.
+
+    O Folium escala cada canal pelo máximo do canal na imagem; fazendo o mesmo
+    sobre os valores presentes o resultado é idêntico ao ImageOverlay original.
+    """
+    maximos = lut_float[presentes].max(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        paleta = lut_float * 255.0 / maximos.reshape((1, 4))
+    paleta[~np.isfinite(paleta)] = 0
+    return paleta.astype(np.uint8)
+
+
+# Paleta fixa (todas as classes presentes): usada quando as cores não podem
+# depender do conteúdo da imagem, como em tiles vizinhos.
+PRODES_LUT_RGBA = _normalizar_paleta(PRODES_LUT_FLOAT, np.ones(256, dtype=bool))
+
+
+def paleta_prodes(valores):
+    """Paleta RGBA uint8 (256x4) equivalente à do Folium para a imagem `valores` (uint8)."""
+    presentes = np.bincount(valores.ravel(), minlength=256) > 0
+    return _normalizar_paleta(PRODES_LUT_FLOAT, presentes)
+
+
+def colorir_prodes(valores, paleta=PRODES_LUT_RGBA):
+    """Converte um array 2D de classes PRODES em RGBA (H, W, 4) com uma indexação."""
+    return paleta[_como_uint8(valores)]
+
+
+def _como_uint8(valores):
+    if valores.dtype == np.uint8:
+        return valores
+    if np.issubdtype(valores.dtype, np.floating):
+        valores = np.nan_to_num(valores, nan=255)
+    # Valores fora de 0-255 não têm cor definida: ficam transparentes (nodata)
+    return np.where((valores >= 0) & (valores <= 255), valores, 255).astype(np.uint8)
+
+
+def _png_chunk(tag, dados):
+    bloco = tag + dados
+    return struct.pack("!I", len(dados)) + bloco + struct.pack("!I", zlib.crc32(bloco) & 0xFFFFFFFF)
+
+
+def encode_png_paleta(valores, paleta, nivel_compressao=6):
+    """Grava um PNG indexado (tipo de cor 3) com a paleta RGBA de 256 entradas."""
+    valores = _como_uint8(valores)
+    altura, largura = valores.shape
+    linhas = np.zeros((altura, largura + 1), dtype=np.uint8) # Byte 0 de cada linha: filtro "None"
+    linhas[:, 1:] = valores
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack("!2I5B", largura, altura, 8, 3, 0, 0, 0)),
+        _png_chunk(b"PLTE", paleta[:, :3].tobytes()),
+        _png_chunk(b"tRNS", paleta[:, 3].tobytes()),
+        _png_chunk(b"IDAT", zlib.compress(linhas.tobytes(), nivel_compressao)),
+        _png_chunk(b"IEND", b""),
+    ])
+
+
+def png_data_url(png_bytes):
+    return "data:image/png;base64," + base64.b64encode(png_bytes).decode('ascii')
+
+
+def get_cache_png(max_itens):
+    global _cache_png
+    if _cache_png is None:
+        with _cache_png_lock:
+            if _cache_png is None:
+                _cache_png = CacheLRU(max_itens)
+    return _cache_png
+
+
+def prodes_overlay_url(valores, versao_dataset, transform, chave_extra=None, max_cache=64):
+    """Data URL PNG do recorte PRODES para o ImageOverlay, com cache por (versão, janela).
+
+    O recorte é mascarado pelo polígono, então `chave_extra` (ex: o código do
+    imóvel) distingue imóveis diferentes que caem na mesma janela.
+    """
+    chave = (versao_dataset, tuple(transform)[:6], valores.shape, chave_extra)
+    cache = get_cache_png(max_cache)
+    url = cache.get(chave)
+    if url is None:
+        valores_uint8 = _como_uint8(valores)
+        url = png_data_url(encode_png_paleta(valores_uint8, paleta_prodes(valores_uint8)))
+        cache.set(chave, url)
+    return url
@@ -0,0 +1,172 @@
+# SeloDeMap/app/comandos.py
+# Comandos de linha de comando (flask --app run <comando>) para preparação de dados.
+import os
+
+import click
+from flask import current_app
+
+from . import car, car_local, catalogo_prodes, estatisticas, prodes_postgis, prodes_vetorial, raster, tiles, utils
+
+
+@click.command('exportar-estados')
+@click.option('--destino', default=None, help="Arquivo de saída (padrão: Config.ESTADOS_FILE).")
+def exportar_estados_command(destino):
+    """Baixa os limites das UFs do WFS do IBGE e grava o snapshot local."""
+    destino = destino or current_app.config['ESTADOS_FILE']
+    estados_gdf = utils.baixar_estados_wfs(current_app.config['ESTADOS_WFS_URL'],
+                                           current_app.config['ESTADOS_WFS_LAYER'])
+    if len(estados_gdf) != 27:
+        click.echo(f"Aviso: esperadas 27 UFs, recebidas {len(estados_gdf)}.")
+    os.makedirs(os.path.dirname(os.path.abspath(destino)), exist_ok=True)
+    driver = 'FlatGeobuf' if destino.endswith('.fgb') else 'GPKG'
+    estados_gdf.to_file(destino, driver=driver)
+    click.echo(f"{len(estados_gdf)} UFs gravadas em {destino}")
+
+
+@click.command('gerar-overviews-prodes')
+@click.option('--arquivo', default=None, help="Raster PRODES (padrão: Config.PRODES_FILE_MS_RECORTE).")
+def gerar_overviews_prodes_command(arquivo):
+    """Constrói a pirâmide de overviews usada pelos tiles PRODES."""
+    arquivo = arquivo or current_app.config['PRODES_FILE_MS_RECORTE']
+    fatores = tiles.gerar_overviews(arquivo)
+    click.echo(f"Overviews {fatores} geradas em {arquivo}")
+
+
+@click.command('converter-prodes-cog')
+@click.option('--origem', default=None, help="Raster PRODES original (padrão: Config.PRODES_FILE_MS_RECORTE).")
+@click.option('--destino', default=None, help="COG de saída (padrão: <origem>_cog.tif).")
+@click.option('--tamanho-bloco', default=512, show_default=True, help="Lado dos blocos internos, em pixels.")
+def converter_prodes_cog_command(origem, destino, tamanho_bloco):
+    """Reescreve o raster PRODES como Cloud-Optimized GeoTIFF (blocos, compressão e overviews)."""
+    origem = origem or current_app.config['PRODES_FILE_MS_RECORTE']
+    destino = destino or os.path.splitext(origem)[0] + '_cog.tif'
+    antes = raster.info_layout(origem)
+    depois = raster.converter_para_cog(origem, destino, tamanho_bloco=tamanho_bloco)
+    click.echo(f"Origem : blocos {antes['blocos']}, compressão {antes['compressao']}, overviews {antes['overviews']}")
+    click.echo(f"Destino: blocos {depois['blocos']}, compressão {depois['compressao']}, overviews {depois['overviews']}")
+    click.echo(f"COG gravado em {destino}. Defina PRODES_FILE={destino} para usá-lo.")
+
+
+@click.command('migrar-car-nacional')
+@click.option('--uf', 'ufs', multiple=True, help="UF(s) a migrar (padrão: todas).")
+def migrar_car_nacional_command(ufs):
+    """Cria a tabela CAR nacional particionada por UF e copia as tabelas imoveis_car_<uf>."""
+    tabela = current_app.config['CAR_TABELA']
+
+    def progresso(sigla_uf, particao, resultado):
+        if resultado is None:
+            click.echo(f"  {sigla_uf}: partição {particao} criada (sem tabela antiga para copiar).")
+        else:
+            copiados, ignorados = resultado
+            click.echo(f"  {sigla_uf}: {copiados} imóveis copiados para {particao}, {ignorados} ignorados.")
+
+    click.echo(f"Tabela nacional: {tabela} (SRID {current_app.config['CAR_SRID']})")
+    car.migrar(tabela, current_app.config['CAR_SRID'], ufs=ufs, progresso=progresso)
+    click.echo("Migração concluída.")
+
+
+@click.command('precomputar-prodes')
+@click.option('--uf', 'ufs', multiple=True, required=True, help="UF(s) a processar (ex: --uf MS --uf MT).")
+@click.option('--workers', default=1, show_default=True, help="Processos de cálculo em paralelo.")
+@click.option('--recalcular', is_flag=True, help="Recalcula imóveis que já têm estatísticas para a versão atual.")
+def precomputar_prodes_command(ufs, workers, recalcular):
+    """Pré-calcula as estatísticas PRODES de todos os imóveis CAR das UFs."""
+    versao = utils.versao_prodes_atual()
+    motor = estatisticas.motor_precomputo()
+    click.echo(f"Versão PRODES: {versao}, motor: {motor}")
+    if motor != current_app.config['PRODES_ENGINE']:
+        click.echo(f"Aviso: o /analisar só usa estatísticas do motor configurado "
+                   f"(PRODES_ENGINE={current_app.config['PRODES_ENGINE']}).", err=True)
+
+    def progresso(processados, gravados, decorrido):
+        click.echo(f"  {processados} imóveis processados, {gravados} gravados ({processados / decorrido:.1f}/s)")
+
+    for uf in ufs:
+        click.echo(f"UF {uf.upper()}:")
+        processados, gravados = estatisticas.precomputar_uf(uf, versao, workers=workers,
+                                                            recalcular=recalcular, progresso=progresso)
+        click.echo(f"UF {uf.upper()} concluída: {gravados}/{processados} imóveis gravados.")
+
+
+@click.command('carregar-prodes-postgis')
+@click.option('--arquivo', default=None, help="Raster PRODES (padrão: Config.PRODES_FILE_MS_RECORTE).")
+@click.option('--versao', default=None, help="Versão gravada com os tiles (padrão: a versão PRODES atual).")
+@click.option('--tamanho-tile', default=256, show_default=True, help="Lado dos tiles gravados, em pixels.")
+def carregar_prodes_postgis_command(arquivo, versao, tamanho_tile):
+    """Carrega o raster PRODES em tiles no PostGIS Raster (motor PRODES_ENGINE=postgis)."""
+    arquivo = arquivo or current_app.config['PRODES_FILE_MS_RECORTE']
+    versao = versao or utils.versao_prodes_atual()
+    tabela = current_app.config['PRODES_RASTER_TABELA']
+    click.echo(f"Carregando {arquivo} em {tabela} (versão {versao})")
+
+    def progresso(linhas, total, gravados):
+        click.echo(f"  {linhas}/{total} linhas do raster, {gravados} tiles gravados")
+
+    gravados = prodes_postgis.carregar_raster(arquivo, tabela, versao, srid=current_app.config['PRODES_RASTER_SRID'],
+                                              tamanho_tile=tamanho_tile, progresso=progresso)
+    click.echo(f"{gravados} tiles gravados. Defina PRODES_ENGINE=postgis para usá-los.")
+
+
+@click.command('catalogar-prodes')
+@click.option('--diretorio', required=True, help="Pasta com os GeoTIFFs PRODES (subpastas por bioma).")
+@click.option('--destino', default=None, help="Catálogo SQLite de saída (padrão: Config.PRODES_CATALOGO).")
+@click.option('--versao', default=None, help="Versão PRODES do catálogo (padrão: derivada dos arquivos).")
+def catalogar_prodes_command(diretorio, destino, versao):
+    """Indexa os tiles PRODES de uma pasta num catálogo com R*Tree das áreas de cobertura."""
+    destino = destino or current_app.config['PRODES_CATALOGO']
+
+    def progresso(indice, total, arquivo):
+        if indice % 100 == 0 or indice == total:
+            click.echo(f"  {indice}/{total} tiles ({os.path.basename(arquivo)})")
+
+    total = catalogo_prodes.construir_catalogo(diretorio, destino, versao=versao, progresso=progresso)
+    click.echo(f"{total} tiles catalogados em {destino}")
+
+
+@click.command('poligonizar-prodes')
+@click.option('--arquivo', default=None, help="Raster PRODES (padrão: Config.PRODES_FILE_MS_RECORTE).")
+@click.option('--destino', default=None, help="GeoParquet de saída (padrão: Config.PRODES_VETORIAL_FILE).")
+@click.option('--versao', default=None, help="Versão gravada com os polígonos (padrão: a versão PRODES atual).")
+def poligonizar_prodes_command(arquivo, destino, versao):
+    """Converte as classes de desmatamento do raster PRODES em polígonos (motor PRODES_ENGINE=vetorial)."""
+    arquivo = arquivo or current_app.config['PRODES_FILE_MS_RECORTE']
+    destino = destino or current_app.config['PRODES_VETORIAL_FILE']
+    versao = versao or utils.versao_prodes_atual()
+    click.echo(f"Poligonizando {arquivo} em {destino} (versão {versao})")
+
+    def progresso(janela, total, poligonos):
+        click.echo(f"  {janela}/{total} janelas do raster, {poligonos} polígonos")
+
+    total = prodes_vetorial.poligonizar(arquivo, destino, versao, progresso=progresso)
+    click.echo(f"{total} polígonos gravados. Defina PRODES_ENGINE=vetorial para usá-los.")
+
+
+@click.command('exportar-car-local')
+@click.option('--uf', 'ufs', multiple=True, help="UF(s) a exportar (padrão: todas).")
+@click.option('--formato', type=click.Choice(sorted(car_local.FORMATOS)), default='parquet', show_default=True,
+              help="GeoParquet (índice em memória, leitura por row group) ou FlatGeobuf (R-tree no arquivo).")
+@click.option('--destino', default=None, help="Pasta de saída (padrão: Config.CAR_LOCAL_DIR).")
+def exportar_car_local_command(ufs, formato, destino):
+    """Exporta as partições CAR do PostGIS para os arquivos por UF do backend CAR_BACKEND=local."""
+    destino = destino or current_app.config['CAR_LOCAL_DIR']
+    for sigla_uf in (ufs or sorted(utils.SIGLAS_UF)):
+        caminho = os.path.join(destino, f"car_{sigla_uf.lower()}{car_local.FORMATOS[formato]}")
+
+        def progresso(total):
+            click.echo(f"  {sigla_uf}: {total} imóveis")
+
+        total = car_local.exportar_uf(sigla_uf, caminho, progresso=progresso)
+        click.echo(f"{sigla_uf}: {total} imóveis gravados em {caminho}")
+    click.echo("Exportação concluída. Defina CAR_BACKEND=local para usar os arquivos.")
+
+
+def init_app(app):
+    app.cli.add_command(exportar_estados_command)
+    app.cli.add_command(gerar_overviews_prodes_command)
+    app.cli.add_command(converter_prodes_cog_command)
+    app.cli.add_command(migrar_car_nacional_command)
+    app.cli.add_command(precomputar_prodes_command)
+    app.cli.add_command(carregar_prodes_postgis_command)
+    app.cli.add_command(catalogar_prodes_command)
+    app.cli.add_command(poligonizar_prodes_command)
+    app.cli.add_command(exportar_car_local_command)
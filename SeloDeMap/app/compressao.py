@@ -0,0 +1,53 @@
+# SeloDeMap/app/compressao.py
+# Compressão das respostas grandes (JSON do /analisar com o map_html, API)
+# conforme o Accept-Encoding do cliente: brotli se o pacote `brotli` estiver
+# instalado e o cliente aceitar, senão gzip. Respostas em streaming (SSE do
+# /analisar/stream, NDJSON dos lotes), arquivos e tiles PNG ficam como estão.
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Opcional: sem o pacote, só gzip
+    brotli = None
+
+from . import metricas
+
+
+def _codificacao(aceitas):
+    """'br', 'gzip' ou None, pela preferência (q) do cliente; empate favorece brotli."""
+    q_br = aceitas['br'] if brotli is not None else 0
+    q_gzip = aceitas['gzip']
+    if not q_br and not q_gzip:
+        return None
+    return 'br' if q_br >= q_gzip else 'gzip'
+
+
+def comprimir(dados, codificacao, config):
+    if codificacao == 'br':
+        return brotli.compress(dados, quality=config['COMPRESSAO_NIVEL_BROTLI'])
+    return gzip.compress(dados, compresslevel=config['COMPRESSAO_NIVEL_GZIP'], mtime=0)
+
+
+def init_app(app):
+    if not app.config['COMPRESSAO_ATIVA']:
+        return
+    tipos = set(app.config['COMPRESSAO_TIPOS'])
+
+    @app.after_request
+    def _comprimir_resposta(resposta):
+        if (resposta.status_code != 200 or resposta.direct_passthrough or resposta.is_streamed
+                or resposta.mimetype not in tipos or 'Content-Encoding' in resposta.headers):
+            return resposta
+        resposta.vary.add('Accept-Encoding')
+        codificacao = _codificacao(request.accept_encodings)
+        if codificacao is None:
+            return resposta
+        dados = resposta.get_data()
+        if len(dados) < app.config['COMPRESSAO_MIN_BYTES']:
+            return resposta
+        with metricas.cronometro('compressao'):
+            resposta.set_data(comprimir(dados, codificacao, app.config))
+        resposta.headers['Content-Encoding'] = codificacao
+        return resposta
@@ -19,11 +19,130 @@ class Config:
         'dbname': POSTGRES_DB
     }
 
+    # Pool de conexões (por worker)
+    DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+    DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+    DB_POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300)) # s até reciclar uma conexão ociosa
+    DB_POOL_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTHCHECK_INTERVAL', 30)) # s ociosa até exigir SELECT 1
+    DB_POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', 10)) # s de espera por uma conexão livre
+    DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+
     # Caminho para a pasta de dados locais (para o PRODES.tif, por exemplo)
     # __file__ é o caminho deste arquivo (config.py)
     # os.path.dirname(__file__) é a pasta 'app'
     # os.path.join(..., '..', 'dados') sobe um nível e entra em 'dados'
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
     DADOS_PATH = os.path.join(BASE_DIR, '..', 'dados')
-    PRODES_FILE_MS_RECORTE = os.path.join(DADOS_PATH, 'prodes_desmatamento.tif') # Nome do seu recorte
+    # Após `flask converter-prodes-cog`, aponte PRODES_FILE para o COG gerado
+    PRODES_FILE_MS_RECORTE = os.environ.get('PRODES_FILE', os.path.join(DADOS_PATH, 'prodes_desmatamento.tif')) # Nome do seu recorte
+
+    # Catálogo de tiles PRODES (vários biomas/UFs) com índice R*Tree, gerado por
+    # `flask --app run catalogar-prodes`. Se o arquivo existir, a análise lê só os tiles
+    # que intersectam o imóvel e PRODES_FILE fica só para a camada de tiles do mapa.
+    PRODES_CATALOGO = os.environ.get('PRODES_CATALOGO', os.path.join(DADOS_PATH, 'prodes', 'catalogo.sqlite'))
+
+    # Versão do PRODES usada nas estatísticas pré-calculadas (ex: 'prodes_cerrado_2023').
+    # Se vazia, a versão é derivada do arquivo (nome, tamanho e data de modificação).
+    PRODES_VERSAO = os.environ.get('PRODES_VERSAO')
+    # Idade máxima de uma entrada de prodes_estatisticas_imovel para ser usada no /analisar
+    PRODES_STATS_MAX_IDADE_DIAS = int(os.environ.get('PRODES_STATS_MAX_IDADE_DIAS', 365))
+
+    # Motor do cálculo PRODES por imóvel: 'rasterio' (recorte do arquivo local no worker),
+    # 'postgis' (histograma no PostGIS Raster, junto com a consulta CAR) ou 'vetorial'
+    # (interseção com os polígonos de desmatamento, áreas exatas). O raster é carregado
+    # com: flask --app run carregar-prodes-postgis. Requer a extensão postgis_raster.
+    PRODES_ENGINE = os.environ.get('PRODES_ENGINE', 'rasterio')
+    PRODES_RASTER_TABELA = os.environ.get('PRODES_RASTER_TABELA', 'prodes_raster')
+    PRODES_RASTER_SRID = int(os.environ.get('PRODES_RASTER_SRID', 4674))
+    # Polígonos do motor 'vetorial' (GeoParquet), gerados com: flask --app run poligonizar-prodes
+    PRODES_VETORIAL_FILE = os.environ.get('PRODES_VETORIAL_FILE', os.path.join(DADOS_PATH, 'prodes', 'prodes_vetorial.parquet'))
+
+    # Quantidade de PNGs de recorte PRODES mantidos em memória por worker
+    PRODES_PNG_CACHE_SIZE = int(os.environ.get('PRODES_PNG_CACHE_SIZE', 64))
+
+    # Camada PRODES no mapa: 'tiles' (endpoint /tiles/prodes/{z}/{x}/{y}.png) ou
+    # 'imagem' (recorte embutido no HTML do mapa como ImageOverlay)
+    PRODES_OVERLAY_MODO = os.environ.get('PRODES_OVERLAY_MODO', 'tiles')
+    PRODES_TILE_CACHE_SIZE = int(os.environ.get('PRODES_TILE_CACHE_SIZE', 2048)) # Tiles em memória por worker
+    PRODES_TILE_CACHE_DIR = os.environ.get('PRODES_TILE_CACHE_DIR') # Cache em disco opcional (compartilhado)
+
+    # Snapshot versionado dos limites das UFs (IBGE), carregado uma vez por worker.
+    # Gere/atualize com: flask --app run exportar-estados
+    ESTADOS_FILE = os.environ.get('ESTADOS_FILE', os.path.join(DADOS_PATH, 'limites_uf_ibge_2022.gpkg'))
+    # WFS do IBGE: fonte do snapshot e fallback quando o arquivo local não existe
+    ESTADOS_WFS_URL = "https://geoservicos.ibge.gov.br/geoserver/CGMAT/wfs"
+    ESTADOS_WFS_LAYER = "CGMAT:pbqg22_02_Estado_LimUF"
+
+    # Tabela CAR nacional particionada por UF (partições <CAR_TABELA>_<uf>) e seu SRID.
+    # Crie/migre a partir das tabelas antigas imoveis_car_<uf> com: flask --app run migrar-car-nacional
+    CAR_TABELA = os.environ.get('CAR_TABELA', 'imoveis_car_br')
+    CAR_SRID = int(os.environ.get('CAR_SRID', 4674))
+    # Transporte compacto: as consultas CAR trazem também a geometria de exibição (mapa/API)
+    # simplificada no PostGIS e reduzida à grade CAR_GEOMETRIA_PRECISAO (graus). O recorte
+    # PRODES continua usando a geometria completa. Requer PostGIS >= 3.1.
+    CAR_GEOMETRIA_COMPACTA = os.environ.get('CAR_GEOMETRIA_COMPACTA', '0') == '1'
+    CAR_GEOMETRIA_PRECISAO = float(os.environ.get('CAR_GEOMETRIA_PRECISAO', 0.000001)) # ~0,1 m
+    CAR_GEOMETRIA_TOLERANCIA_EXIBICAO = float(os.environ.get('CAR_GEOMETRIA_TOLERANCIA_EXIBICAO', 0.00002)) # ~2 m
+    # Backend das consultas CAR (coordenada, código, vizinhos): 'postgis' (CAR_TABELA no banco acima)
+    # ou 'local' (um GeoParquet/FlatGeobuf por UF em CAR_LOCAL_DIR, consultado no próprio processo,
+    # sem depender da VPS). Os arquivos são gerados com: flask --app run exportar-car-local
+    CAR_BACKEND = os.environ.get('CAR_BACKEND', 'postgis')
+    CAR_LOCAL_DIR = os.environ.get('CAR_LOCAL_DIR', os.path.join(DADOS_PATH, 'car'))
+
+    # Cache de resultados de análise (imóvel + PRODES) e de coordenada -> imóvel, por worker.
+    # CACHE_ANALISE_DIR ativa um nível em disco compartilhado entre workers/processos.
+    CACHE_ANALISE_SIZE = int(os.environ.get('CACHE_ANALISE_SIZE', 512))
+    CACHE_COORDENADAS_SIZE = int(os.environ.get('CACHE_COORDENADAS_SIZE', 20000))
+    CACHE_COORDENADAS_GRADE = float(os.environ.get('CACHE_COORDENADAS_GRADE', 0.00001)) # Graus (~1 m)
+    CACHE_ANALISE_DIR = os.environ.get('CACHE_ANALISE_DIR')
+    # Versão da tabela CAR (entra nas chaves do cache). Se vazia, vem da tabela car_versoes
+    # (incrementada por gatilho a cada carga), consultada no máximo a cada CACHE_VERSAO_CAR_TTL segundos.
+    CAR_VERSAO = os.environ.get('CAR_VERSAO')
+    CACHE_VERSAO_CAR_TTL = int(os.environ.get('CACHE_VERSAO_CAR_TTL', 60))
+
+    # /analisar: etapas concorrentes (estado, CAR, PRODES, mapa) num pool de threads
+    # por worker, cada uma com seu prazo em segundos; ao expirar, a etapa vira um aviso.
+    ANALISE_THREADS = int(os.environ.get('ANALISE_THREADS', 16))
+    ANALISE_PRAZO_ESTADO = float(os.environ.get('ANALISE_PRAZO_ESTADO', 10))
+    ANALISE_PRAZO_CAR = float(os.environ.get('ANALISE_PRAZO_CAR', 15))
+    ANALISE_PRAZO_PRODES = float(os.environ.get('ANALISE_PRAZO_PRODES', 30))
+    ANALISE_PRAZO_MAPA = float(os.environ.get('ANALISE_PRAZO_MAPA', 20))
+    ANALISE_PRAZO_VIZINHOS = float(os.environ.get('ANALISE_PRAZO_VIZINHOS', 20))
+
+    # Vizinhos do imóvel (parâmetros vizinhos=N e vizinhos_distancia=<metros> do /analisar e da
+    # API): limites por requisição; distância 0 = só os imóveis que encostam no analisado
+    VIZINHOS_MAX = int(os.environ.get('VIZINHOS_MAX', 20))
+    VIZINHOS_DISTANCIA_MAX_M = float(os.environ.get('VIZINHOS_DISTANCIA_MAX_M', 5000))
+
+    # /api/v1/analise: tolerância padrão (graus) da simplificação da geometria devolvida
+    API_GEOMETRIA_TOLERANCIA = float(os.environ.get('API_GEOMETRIA_TOLERANCIA', 0.00005)) # ~5 m
+
+    # Cabeçalho Server-Timing (duração das etapas/operações) nas respostas; as métricas
+    # Prometheus em /metrics ficam sempre ativas
+    SERVER_TIMING_ATIVO = os.environ.get('SERVER_TIMING_ATIVO', '1') == '1'
+
+    # Compressão (brotli/gzip, conforme o Accept-Encoding) das respostas JSON/HTML a partir de
+    # COMPRESSAO_MIN_BYTES; brotli só com o pacote `brotli` instalado
+    COMPRESSAO_ATIVA = os.environ.get('COMPRESSAO_ATIVA', '1') == '1'
+    COMPRESSAO_MIN_BYTES = int(os.environ.get('COMPRESSAO_MIN_BYTES', 1024))
+    COMPRESSAO_TIPOS = ('application/json', 'text/html')
+    COMPRESSAO_NIVEL_GZIP = int(os.environ.get('COMPRESSAO_NIVEL_GZIP', 6))
+    COMPRESSAO_NIVEL_BROTLI = int(os.environ.get('COMPRESSAO_NIVEL_BROTLI', 5)) # 0-11; acima de ~6 o custo de CPU cresce rápido
+
+    # Servidor de produção (gunicorn -c gunicorn.conf.py run:app): processos pré-criados a
+    # partir de um mestre já aquecido, cada um com SERVIDOR_THREADS threads
+    SERVIDOR_BIND = os.environ.get('SERVIDOR_BIND', '0.0.0.0:5000')
+    SERVIDOR_WORKERS = int(os.environ.get('SERVIDOR_WORKERS', min(os.cpu_count() or 2, 8)))
+    SERVIDOR_THREADS = int(os.environ.get('SERVIDOR_THREADS', 8))
+    SERVIDOR_TIMEOUT = int(os.environ.get('SERVIDOR_TIMEOUT', 120)) # s sem resposta até o worker ser reiniciado
+    SERVIDOR_GRACEFUL_TIMEOUT = int(os.environ.get('SERVIDOR_GRACEFUL_TIMEOUT', 30))
+    SERVIDOR_KEEPALIVE = int(os.environ.get('SERVIDOR_KEEPALIVE', 5))
+    SERVIDOR_MAX_REQUESTS = int(os.environ.get('SERVIDOR_MAX_REQUESTS', 0)) # Reciclagem dos workers (0 = nunca)
+    SERVIDOR_AQUECIMENTO = os.environ.get('SERVIDOR_AQUECIMENTO', '1') == '1' # Aquecer antes do fork e em cada worker
+
+    # Análise em lote (POST /analisar/lote): fila persistente em SQLite
+    LOTE_DB_PATH = os.environ.get('LOTE_DB_PATH', os.path.join(DADOS_PATH, 'lotes.sqlite'))
+    LOTE_WORKERS = int(os.environ.get('LOTE_WORKERS', os.cpu_count() or 2)) # Processos de análise
+    LOTE_MAX_ITENS = int(os.environ.get('LOTE_MAX_ITENS', 50000))
+    LOTE_EXECUTOR_ATIVO = os.environ.get('LOTE_EXECUTOR_ATIVO', '1') == '1' # Só um processo por máquina executa os lotes (trava em <LOTE_DB_PATH>.executor); '0' desativa neste processo
     # Adicione outros caminhos de arquivos de dados se necessário
\ No newline at end of file
@@ -0,0 +1,259 @@
+# SeloDeMap/app/db.py
+# Pool de conexões PostGIS compartilhado pelas threads do worker, com
+# verificação de saúde, reciclagem de conexões ociosas e statements
+# preparados no servidor (PREPARE/EXECUTE) por conexão.
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from flask import current_app
+
+
+class PoolEsgotadoError(psycopg2.OperationalError):
+    """Nenhuma conexão ficou livre dentro do tempo de espera configurado."""
+
+
+class _ConexaoPreparada(psycopg2.extensions.connection):
+    """Conexão que lembra quais statements já foram preparados nela."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+        self.ultimo_uso = time.monotonic()
+
+
+class PoolConexoes:
+    """Pool thread-safe de conexões psycopg2.
+
+    - Conexões ociosas há mais de `idle_timeout` segundos são fechadas e recriadas.
+    - Conexões ociosas há mais de `healthcheck_interval` segundos recebem um
+      `SELECT 1` antes de serem entregues (conexões "quentes" não pagam esse custo).
+    - As conexões usam autocommit: as consultas são somente leitura e assim
+      não há um BEGIN extra por consulta.
+    """
+
+    def __init__(self, conn_info, minconn=1, maxconn=10, idle_timeout=300,
+                 healthcheck_interval=30, wait_timeout=10, connect_timeout=5):
+        self.conn_info = conn_info
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.wait_timeout = wait_timeout
+        self.connect_timeout = connect_timeout
+
+        self._ociosas = []  # Pilha (LIFO): a conexão mais recente é a mais provável de estar viva
+        self._em_uso = 0
+        self._total = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'conexoes_criadas': 0,
+            'conexoes_descartadas': 0,
+            'healthchecks': 0,
+            'aquisicoes': 0,
+            'espera_total_s': 0.0,
+            'espera_max_s': 0.0,
+            'timeouts': 0,
+        }
+
+    def _conectar(self):
+        conn = psycopg2.connect(
+            host=self.conn_info['host'],
+            database=self.conn_info['dbname'],
+            user=self.conn_info['user'],
+            password=self.conn_info['password'],
+            port=self.conn_info['port'],
+            connect_timeout=self.connect_timeout,
+            connection_factory=_ConexaoPreparada,
+        )
+        conn.autocommit = True
+        with self._cond:
+            self._stats['conexoes_criadas'] += 1
+        return conn
+
+    def _fechar(self, conn):
+        with self._cond:
+            self._stats['conexoes_descartadas'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _saudavel(self, conn, agora):
+        if conn.closed:
+            return False
+        if agora - conn.ultimo_uso < self.healthcheck_interval:
+            return True
+        with self._cond:
+            self._stats['healthchecks'] += 1
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def obter(self):
+        inicio = time.monotonic()
+        limite = inicio + self.wait_timeout
+        with self._cond:
+            while True:
+                if self._ociosas:
+                    conn = self._ociosas.pop()
+                    self._em_uso += 1
+                    break
+                if self._total < self.maxconn:
+                    conn = None
+                    self._total += 1
+                    self._em_uso += 1
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolEsgotadoError(f"Pool de conexões esgotado ({self.maxconn} em uso).")
+                self._cond.wait(restante)
+
+        # Conexão, healthcheck e reciclagem fora do lock para não bloquear as outras threads
+        try:
+            agora = time.monotonic()
+            if conn is not None and (agora - conn.ultimo_uso > self.idle_timeout or not self._saudavel(conn, agora)):
+                self._fechar(conn)
+                conn = None
+            if conn is None:
+                conn = self._conectar()
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._em_uso -= 1
+                self._cond.notify()
+            raise
+
+        espera = time.monotonic() - inicio
+        with self._cond:
+            self._stats['aquisicoes'] += 1
+            self._stats['espera_total_s'] += espera
+            self._stats['espera_max_s'] = max(self._stats['espera_max_s'], espera)
+        return conn
+
+    def devolver(self, conn, descartar=False):
+        if not descartar and (conn.closed or
+                              conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+            descartar = True
+        with self._cond:
+            self._em_uso -= 1
+            if descartar:
+                self._total -= 1
+            else:
+                conn.ultimo_uso = time.monotonic()
+                self._ociosas.append(conn)
+            self._cond.notify()
+        if descartar:
+            self._fechar(conn)
+
+    @contextmanager
+    def conexao(self):
+        conn = self.obter()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.devolver(conn, descartar=True)
+            raise
+        except BaseException:
+            self.devolver(conn)
+            raise
+        else:
+            self.devolver(conn)
+
+    def aquecer(self):
+        """Abre conexões até `minconn` ociosas (ex: na inicialização do worker)."""
+        conns = []
+        try:
+            while len(conns) + len(self._ociosas) < self.minconn:
+                conns.append(self.obter())
+        finally:
+            for conn in conns:
+                self.devolver(conn)
+
+    def fechar_todas(self):
+        with self._cond:
+            ociosas, self._ociosas = self._ociosas, []
+            self._total -= len(ociosas)
+        for conn in ociosas:
+            self._fechar(conn)
+
+    def metricas(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'em_uso': self._em_uso,
+                'ociosas': len(self._ociosas),
+                'total': self._total,
+                'max': self.maxconn,
+            })
+        stats['espera_media_s'] = stats['espera_total_s'] / stats['aquisicoes'] if stats['aquisicoes'] else 0.0
+        return stats
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Retorna o pool do processo atual, criando-o a partir da Config na primeira chamada.
+
+    Após um fork o pool herdado é abandonado (sem fechar os sockets do processo pai).
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            cfg = current_app.config
+            _pool = PoolConexoes(
+                cfg['DATABASE_CONNECTION_INFO'],
+                minconn=cfg['DB_POOL_MIN'],
+                maxconn=cfg['DB_POOL_MAX'],
+                idle_timeout=cfg['DB_POOL_IDLE_TIMEOUT'],
+                healthcheck_interval=cfg['DB_POOL_HEALTHCHECK_INTERVAL'],
+                wait_timeout=cfg['DB_POOL_WAIT_TIMEOUT'],
+                connect_timeout=cfg['DB_CONNECT_TIMEOUT'],
+            )
+            _pool_pid = pid
+    return _pool
+
+
+def nova_conexao():
+    """Conexão avulsa, fora do pool (ex: cursores nomeados em comandos longos)."""
+    info = current_app.config['DATABASE_CONNECTION_INFO']
+    return psycopg2.connect(host=info['host'], database=info['dbname'], user=info['user'],
+                            password=info['password'], port=info['port'],
+                            connect_timeout=current_app.config['DB_CONNECT_TIMEOUT'])
+
+
+def conexao():
+    """Atalho: `with db.conexao() as conn:` usando o pool do worker."""
+    return get_pool().conexao()
+
+
+def executar_preparada(cursor, nome, sql, params):
+    """Executa `sql` como statement preparado `nome` na conexão do cursor.
+
+    Na primeira vez em cada conexão o PREPARE vai sozinho e o statement é
+    registrado logo em seguida: o PREPARE não é desfeito por rollback, e um
+    EXECUTE que falhe (ex: erro do GEOS numa geometria inválida) não pode
+    deixar o statement no servidor sem registro - a conexão volta ao pool e
+    o PREPARE seguinte daria DuplicatePreparedStatement. Depois, cada
+    chamada é só o EXECUTE (uma ida e volta ao servidor).
+    `sql` usa parâmetros posicionais $1, $2, ...
+    """
+    conn = cursor.connection
+    if nome not in conn.preparadas:
+        cursor.execute(f"PREPARE {nome} AS {sql};")
+        conn.preparadas.add(nome)
+    marcadores = ', '.join(['%s'] * len(params))
+    cursor.execute(f"EXECUTE {nome} ({marcadores});" if params else f"EXECUTE {nome};", params)
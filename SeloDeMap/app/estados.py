@@ -0,0 +1,117 @@
+# SeloDeMap/app/estados.py
+# Índice local (em memória) dos limites das UFs, usado no lugar da consulta
+# WFS do IBGE a cada requisição. O snapshot dos 27 polígonos é carregado uma
+# única vez por worker a partir de um arquivo GeoPackage/FlatGeobuf em dados/.
+import os
+import threading
+
+import geopandas as gpd
+import shapely
+from shapely import STRtree
+from shapely.geometry import Point
+
+from . import projecao
+
+CRS_ESTADOS = "EPSG:4674"  # CRS nativo dos limites do IBGE (SIRGAS 2000)
+
+# Tolerâncias (graus) das versões simplificadas dos limites, usadas só para
+# exibição no mapa: da mais grossa (Brasil inteiro) à mais fina (imóvel).
+TOLERANCIAS_EXIBICAO = (0.05, 0.01, 0.002, 0.0005, 0.0001)
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+class IndiceEstados:
+    """STRtree de geometrias preparadas das UFs com os atributos do IBGE."""
+
+    def __init__(self, estados_gdf, versao):
+        if estados_gdf.crs is not None and not projecao.mesmo_crs(estados_gdf.crs, CRS_ESTADOS):
+            estados_gdf = estados_gdf.to_crs(CRS_ESTADOS)
+        self.versao = versao
+        self.geometrias = estados_gdf.geometry.to_numpy()
+        shapely.prepare(self.geometrias)  # Acelera os testes de contains repetidos
+        self.atributos = estados_gdf.drop(columns=estados_gdf.geometry.name).to_dict('records')
+        self.arvore = STRtree(self.geometrias)
+        self._posicao_uf = {str(atributos.get('cd_uf', '')): i for i, atributos in enumerate(self.atributos)}
+        self._simplificadas = {}  # {tolerância: array de geometrias}
+        self._simplificadas_lock = threading.Lock()
+
+    def localizar(self, lon, lat):
+        """Retorna (atributos, geometria) da UF que contém o ponto (EPSG:4674) ou None."""
+        ponto = Point(lon, lat)
+        for idx in self.arvore.query(ponto):
+            if self.geometrias[idx].contains(ponto):
+                return self.atributos[idx], self.geometrias[idx]
+        return None
+
+    def geometria_exibicao(self, codigo_uf, tolerancia):
+        """Limite simplificado da UF (código IBGE) para desenho no mapa, ou None.
+
+        Cada nível é calculado uma vez por worker, para todas as UFs juntas.
+        """
+        posicao = self._posicao_uf.get(str(codigo_uf))
+        if posicao is None:
+            return None
+        geometrias = self._simplificadas.get(tolerancia)
+        if geometrias is None:
+            with self._simplificadas_lock:
+                geometrias = self._simplificadas.get(tolerancia)
+                if geometrias is None:
+                    geometrias = simplificar_limites(self.geometrias, tolerancia)
+                    self._simplificadas[tolerancia] = geometrias
+        return geometrias[posicao]
+
+    def __len__(self):
+        return len(self.geometrias)
+
+
+def simplificar_limites(geometrias, tolerancia):
+    """Simplifica os limites preservando a topologia e as divisas em comum entre UFs.
+
+    Com GEOS >= 3.12, coverage_simplify simplifica cada divisa uma única vez
+    (sem frestas nem sobreposições entre estados vizinhos); senão, cada UF é
+    simplificada isoladamente. As coordenadas são arredondadas a uma grade de
+    tolerancia/4, o que encurta o GeoJSON sem mudança visível.
+    """
+    try:
+        simplificadas = shapely.coverage_simplify(geometrias, tolerancia)
+    except (AttributeError, shapely.errors.UnsupportedGEOSVersionError, shapely.errors.GEOSException):
+        simplificadas = shapely.simplify(geometrias, tolerancia, preserve_topology=True)
+    return shapely.set_precision(simplificadas, tolerancia / 4)
+
+
+def tolerancia_para_zoom(zoom):
+    """Maior tolerância de exibição que não passa de um pixel no zoom (tiles de 256 px)."""
+    tamanho_pixel = 360 / (256 * 2 ** zoom)
+    for tolerancia in TOLERANCIAS_EXIBICAO:
+        if tolerancia <= tamanho_pixel:
+            return tolerancia
+    return TOLERANCIAS_EXIBICAO[-1]
+
+
+def carregar_indice(caminho):
+    """Lê o snapshot de limites estaduais e monta o índice espacial."""
+    estados_gdf = gpd.read_file(caminho)
+    if estados_gdf.crs is None:
+        estados_gdf = estados_gdf.set_crs(CRS_ESTADOS)
+    # O nome do arquivo identifica a versão do snapshot (ex: limites_uf_ibge_2022.gpkg)
+    versao = os.path.splitext(os.path.basename(caminho))[0]
+    return IndiceEstados(estados_gdf, versao)
+
+
+def get_indice_estados(caminho):
+    """Retorna o índice do worker, carregando-o na primeira chamada.
+
+    Retorna None se o arquivo de snapshot não existir.
+    """
+    global _indice
+    if _indice is not None:
+        return _indice
+    with _indice_lock:
+        if _indice is None:
+            if not os.path.exists(caminho):
+                return None
+            _indice = carregar_indice(caminho)
+    return _indice
+
@@ -0,0 +1,209 @@
+# SeloDeMap/app/estatisticas.py
+# Estatísticas PRODES pré-calculadas por imóvel (tabela prodes_estatisticas_imovel).
+#
+# O comando `flask precomputar-prodes --uf MS` percorre a partição CAR da UF,
+# calcula as áreas desmatadas por ano e por classe de cada imóvel e grava o
+# resultado com a versão do PRODES e o motor usados. O /analisar lê a tabela
+# quando há entrada para a versão atual e o PRODES_ENGINE configurado e só cai
+# no cálculo ao vivo quando não há: cada motor conta os pixels de um jeito
+# (all_touched no raster, centro do pixel no PostGIS, polígonos no vetorial),
+# e o resultado não pode depender de qual deles pré-calculou a tabela.
+# Com PRODES_ENGINE='postgis', o cálculo da UF é feito inteiro no banco
+# (app/prodes_postgis.py); com os demais motores, pelo raster ('rasterio').
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+from flask import current_app
+
+from . import analise, db, prodes_postgis, utils
+
+TABELA_ESTATISTICAS = "prodes_estatisticas_imovel"
+
+SQL_CRIAR_TABELA = f"""
+CREATE TABLE IF NOT EXISTS {TABELA_ESTATISTICAS} (
+    cod_imovel text NOT NULL,
+    sigla_uf char(2) NOT NULL,
+    versao_prodes text NOT NULL,
+    motor text NOT NULL,             -- PRODES_ENGINE que calculou a entrada
+    desmatamento_ha jsonb NOT NULL,  -- {{ano: ha}}
+    classes_ha jsonb NOT NULL,       -- {{classe PRODES: ha}}
+    aviso text,
+    calculado_em timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (cod_imovel, versao_prodes, motor)
+);
+"""
+
+# Tabelas anteriores à coluna motor: as entradas, de motor desconhecido, são
+# descartadas (serão recalculadas) e o motor passa a fazer parte da chave.
+SQL_MIGRAR_MOTOR = f"""
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = '{TABELA_ESTATISTICAS}' AND column_name = 'motor') THEN
+        DELETE FROM {TABELA_ESTATISTICAS};
+        ALTER TABLE {TABELA_ESTATISTICAS} ADD COLUMN motor text NOT NULL;
+        ALTER TABLE {TABELA_ESTATISTICAS} DROP CONSTRAINT {TABELA_ESTATISTICAS}_pkey;
+        ALTER TABLE {TABELA_ESTATISTICAS} ADD PRIMARY KEY (cod_imovel, versao_prodes, motor);
+    END IF;
+END $$;
+"""
+
+SQL_BUSCAR = f"""
+    SELECT desmatamento_ha, classes_ha, aviso, calculado_em
+    FROM {TABELA_ESTATISTICAS}
+    WHERE cod_imovel = $1::text AND versao_prodes = $2::text AND motor = $3::text
+      AND calculado_em >= now() - make_interval(days => $4::int)
+"""
+
+SQL_GRAVAR = f"""
+    INSERT INTO {TABELA_ESTATISTICAS} (cod_imovel, sigla_uf, versao_prodes, motor, desmatamento_ha, classes_ha, aviso)
+    VALUES %s
+    ON CONFLICT (cod_imovel, versao_prodes, motor) DO UPDATE SET
+        desmatamento_ha = EXCLUDED.desmatamento_ha,
+        classes_ha = EXCLUDED.classes_ha,
+        aviso = EXCLUDED.aviso,
+        calculado_em = now()
+"""
+
+
+def motor_precomputo():
+    """Motor com que `flask precomputar-prodes` calcula as estatísticas no PRODES_ENGINE atual."""
+    return 'postgis' if prodes_postgis.ativo() else 'rasterio'
+
+
+def buscar_estatisticas(cod_imovel, versao_prodes, motor):
+    """Estatísticas pré-calculadas do imóvel para a versão do PRODES e o motor, ou None.
+
+    Erros de banco (ex: tabela ainda não criada) não são fatais: a análise
+    segue pelo cálculo ao vivo.
+    """
+    if not cod_imovel:
+        return None
+    try:
+        with db.conexao() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                db.executar_preparada(cursor, "prodes_estatisticas", SQL_BUSCAR,
+                                      (cod_imovel, versao_prodes, motor,
+                                       current_app.config['PRODES_STATS_MAX_IDADE_DIAS']))
+                registro = cursor.fetchone()
+    except psycopg2.Error as e:
+        current_app.logger.warning(f"Estatísticas PRODES pré-calculadas indisponíveis: {e}")
+        return None
+    if registro is None:
+        return None
+    return {
+        'desmatamento_ha': {int(ano): area for ano, area in registro['desmatamento_ha'].items()},
+        'classes_ha': {int(classe): area for classe, area in registro['classes_ha'].items()},
+        'aviso': registro['aviso'],
+        'calculado_em': registro['calculado_em'],
+    }
+
+
+def calcular_estatisticas(imovel_geometry):
+    """(desmatamento_ha, classes_ha, aviso) de uma geometria CAR (EPSG:4674), pelo raster."""
+    valores, desmatamento_areas_ha, transform, crs, err_prodes = utils.analyze_prodes_recorter(imovel_geometry)
+    classes_ha = {}
+    if valores is not None and valores.size > 0 and transform is not None:
+        classes_ha = utils.prodes_areas_por_classe(valores, utils.prodes_pixel_area_m2(crs, transform))
+    return desmatamento_areas_ha, classes_ha, err_prodes
+
+
+def _calcular_registro(registro):
+    """(cod_imovel, desmatamento_ha, classes_ha, aviso) de um registro (cod_imovel, geometria)."""
+    cod_imovel, geometria = registro
+    if geometria is None:
+        return cod_imovel, None, None, "Erro: geometria WKB inválida."
+    try:
+        desmatamento_ha, classes_ha, aviso = calcular_estatisticas(geometria)
+    except Exception as e:
+        current_app.logger.error(f"Erro ao calcular estatísticas de {cod_imovel}: {e}", exc_info=True)
+        return cod_imovel, None, None, f"Erro: {e}"
+    return cod_imovel, desmatamento_ha, classes_ha, aviso
+
+
+def _calcular_registro_worker(registro):
+    """Versão para os processos do pool (cada um com sua aplicação); recebe (cod_imovel, WKB)."""
+    cod_imovel, geom_wkb = registro
+    with analise.app_do_worker().app_context():
+        return _calcular_registro((cod_imovel, utils.decodificar_wkb([geom_wkb], on_invalid='ignore')[0]))
+
+
+def _gravar(conn, sigla_uf, versao_prodes, resultados):
+    linhas = [
+        (cod_imovel, sigla_uf, versao_prodes, 'rasterio', json.dumps(desmatamento_ha), json.dumps(classes_ha), aviso)
+        for cod_imovel, desmatamento_ha, classes_ha, aviso in resultados
+        if desmatamento_ha is not None # Erros inesperados não são gravados: o imóvel é recalculado na próxima execução
+    ]
+    if linhas:
+        with conn.cursor() as cursor:
+            execute_values(cursor, SQL_GRAVAR, linhas)
+    conn.commit()
+    return len(linhas)
+
+
+def precomputar_uf(sigla_uf, versao_prodes, workers=1, tamanho_lote=200, recalcular=False, progresso=None):
+    """Calcula e grava as estatísticas de todos os imóveis da partição CAR da UF.
+
+    Sem `recalcular`, imóveis que já têm entrada para a versão são pulados,
+    o que permite retomar uma execução interrompida.
+    """
+    table_name = utils.car_table_name(sigla_uf)
+    if not table_name:
+        raise ValueError(f"UF inválida: '{sigla_uf}'.")
+
+    conn_leitura = db.nova_conexao()
+    conn_escrita = db.nova_conexao()
+    pool = None
+    gravados, processados, inicio = 0, 0, time.monotonic()
+    try:
+        with conn_escrita.cursor() as cursor:
+            cursor.execute(SQL_CRIAR_TABELA)
+            cursor.execute(SQL_MIGRAR_MOTOR)
+        conn_escrita.commit()
+
+        if prodes_postgis.ativo(): # Motor PostGIS: a UF inteira num único INSERT ... SELECT no banco
+            gravados = prodes_postgis.precomputar_uf(conn_escrita, table_name, versao_prodes, TABELA_ESTATISTICAS,
+                                                     recalcular=recalcular)
+            if progresso:
+                progresso(gravados, gravados, max(time.monotonic() - inicio, 1e-9))
+            return gravados, gravados
+
+        filtro = "" if recalcular else f"""
+            WHERE NOT EXISTS (SELECT 1 FROM {TABELA_ESTATISTICAS} s
+                              WHERE s.cod_imovel = c.cod_imovel AND s.versao_prodes = %(versao)s
+                                AND s.motor = 'rasterio')"""
+        # Cursor nomeado (server-side): as geometrias chegam em blocos, sem carregar a UF inteira em memória
+        cursor = conn_leitura.cursor(name=f"precomputar_{sigla_uf.lower()}")
+        cursor.itersize = tamanho_lote
+        cursor.execute(f"SELECT c.cod_imovel, ST_AsBinary(c.geom) FROM {table_name} c {filtro};",
+                       {'versao': versao_prodes})
+
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=analise.inicializar_worker)
+        while True:
+            bloco = [(cod_imovel, bytes(geom_wkb)) for cod_imovel, geom_wkb in cursor.fetchmany(tamanho_lote)]
+            if not bloco:
+                break
+            if pool:
+                resultados = list(pool.map(_calcular_registro_worker, bloco,
+                                           chunksize=max(1, len(bloco) // (workers * 4))))
+            else:
+                geometrias = utils.decodificar_wkb([geom_wkb for _, geom_wkb in bloco], on_invalid='ignore') # Bloco inteiro num só from_wkb
+                resultados = [_calcular_registro((cod_imovel, geometria))
+                              for (cod_imovel, _), geometria in zip(bloco, geometrias)]
+            gravados += _gravar(conn_escrita, sigla_uf.upper(), versao_prodes, resultados)
+            processados += len(bloco)
+            if progresso:
+                progresso(processados, gravados, time.monotonic() - inicio)
+        cursor.close()
+    finally:
+        if pool:
+            pool.shutdown()
+        conn_leitura.close()
+        conn_escrita.close()
+    return processados, gravados
@@ -0,0 +1,137 @@
+# SeloDeMap/app/etapas.py
+# Execução concorrente das etapas de uma análise (estado, CAR, PRODES, mapa).
+#
+# Cada etapa declara de quais outras depende; etapas independentes rodam ao
+# mesmo tempo num pool de threads limitado, compartilhado pelas requisições do
+# worker. Cada etapa tem um prazo (contado da submissão ao pool): se estourar,
+# a etapa vira um aviso e as que dependem obrigatoriamente dela são ignoradas,
+# em vez de a resposta inteira ficar presa. A thread de uma etapa expirada não
+# é interrompida; ela termina em segundo plano e o resultado é descartado.
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from flask import current_app
+
+from . import metricas
+
+OK, ERRO, TEMPO_ESGOTADO, IGNORADA = 'ok', 'erro', 'tempo_esgotado', 'ignorada'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class Etapa:
+    """Etapa do pipeline.
+
+    `funcao(entradas)` recebe um dict {nome da dependência: resultado}; para
+    dependências `opcionais` que falharam, o resultado é None. `prazo` em
+    segundos (None = sem prazo).
+    """
+
+    def __init__(self, nome, funcao, dependencias=(), opcionais=(), prazo=None):
+        self.nome = nome
+        self.funcao = funcao
+        self.dependencias = tuple(dependencias)
+        self.opcionais = tuple(opcionais)
+        self.prazo = prazo
+
+
+class ResultadoEtapas:
+    """Resultados, situação e duração de cada etapa, mais os avisos de falhas."""
+
+    def __init__(self):
+        self.resultados = {}
+        self.status = {}
+        self.tempos = {}
+        self.avisos = []
+
+    def ok(self, nome):
+        return self.status.get(nome) == OK
+
+    def get(self, nome, default=None):
+        return self.resultados.get(nome, default)
+
+
+def get_executor(max_threads):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='etapa')
+    return _executor
+
+
+def _rodar(app, funcao, entradas):
+    """(resultado, operações medidas) da etapa; sem contexto de requisição nesta thread, as operações
+    (consulta CAR, PRODES...) vão para o Server-Timing pela thread da requisição."""
+    with app.app_context(), metricas.coletar_server_timing() as operacoes:
+        return funcao(entradas), operacoes
+
+
+def executar(etapas, max_threads=16):
+    """Executa as etapas respeitando dependências e prazos; retorna um ResultadoEtapas."""
+    resultado = ResultadoEtapas()
+    for _ in acompanhar(etapas, resultado, max_threads=max_threads):
+        pass
+    return resultado
+
+
+def acompanhar(etapas, resultado, max_threads=16):
+    """Como executar, mas como gerador: produz o nome de cada etapa assim que ela
+    termina (ok, erro, tempo esgotado ou ignorada), com `resultado` já atualizado.
+
+    Usado pelo /analisar/stream para enviar cada parte da análise sem esperar as demais.
+    """
+    app = current_app._get_current_object()
+    executor = get_executor(max_threads)
+    pendentes = {etapa.nome: etapa for etapa in etapas}
+    em_execucao = {}  # {future: (etapa, instante da submissão)}
+
+    while pendentes or em_execucao:
+        for nome, etapa in list(pendentes.items()):
+            if not all(d in resultado.status for d in etapa.dependencias + etapa.opcionais):
+                continue
+            del pendentes[nome]
+            falhas = [d for d in etapa.dependencias if resultado.status[d] != OK]
+            if falhas:
+                resultado.status[nome] = IGNORADA
+                current_app.logger.info(f"Etapa '{nome}' ignorada: depende de {', '.join(falhas)}.")
+                yield nome
+                continue
+            entradas = {d: resultado.resultados.get(d) for d in etapa.dependencias + etapa.opcionais}
+            em_execucao[executor.submit(_rodar, app, etapa.funcao, entradas)] = (etapa, time.monotonic())
+
+        if not em_execucao:
+            if pendentes:
+                raise ValueError(f"Dependências inexistentes ou circulares entre as etapas: {', '.join(pendentes)}")
+            break
+
+        agora = time.monotonic()
+        limites = [inicio + etapa.prazo - agora for etapa, inicio in em_execucao.values() if etapa.prazo is not None]
+        wait(em_execucao, timeout=max(0, min(limites)) if limites else None, return_when=FIRST_COMPLETED)
+
+        agora = time.monotonic()
+        for future, (etapa, inicio) in list(em_execucao.items()):
+            if future.done():
+                del em_execucao[future]
+                resultado.tempos[etapa.nome] = agora - inicio
+                try:
+                    resultado.resultados[etapa.nome], operacoes = future.result()
+                    resultado.status[etapa.nome] = OK
+                    metricas.incluir_server_timing(operacoes)
+                except Exception as e:
+                    resultado.status[etapa.nome] = ERRO
+                    resultado.avisos.append(f"Etapa '{etapa.nome}' falhou: {e}")
+                    current_app.logger.error(f"Erro na etapa '{etapa.nome}': {e}", exc_info=e)
+                metricas.registrar_etapa(etapa.nome, resultado.tempos[etapa.nome], resultado.status[etapa.nome])
+                yield etapa.nome
+            elif etapa.prazo is not None and agora - inicio >= etapa.prazo:
+                del em_execucao[future]
+                future.cancel() # Só tem efeito se a etapa ainda estiver na fila do pool
+                resultado.tempos[etapa.nome] = agora - inicio
+                resultado.status[etapa.nome] = TEMPO_ESGOTADO
+                resultado.avisos.append(f"Etapa '{etapa.nome}' excedeu o prazo de {etapa.prazo:g}s e foi ignorada.")
+                current_app.logger.warning(f"Etapa '{etapa.nome}' excedeu o prazo de {etapa.prazo:g}s.")
+                metricas.registrar_etapa(etapa.nome, resultado.tempos[etapa.nome], TEMPO_ESGOTADO)
+                yield etapa.nome
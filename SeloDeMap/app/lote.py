@@ -0,0 +1,409 @@
+# SeloDeMap/app/lote.py
+# Análise em lote: fila persistente em SQLite + pool de processos.
+#
+# POST /analisar/lote grava o lote e seus itens no SQLite; uma thread
+# executora no worker Flask reivindica o lote (lease com validade), envia os
+# itens a um ProcessPoolExecutor (analise.analisar_imovel, sem mapa) e grava
+# cada resultado assim que fica pronto. Itens só saem de 'pendente' quando o
+# resultado é gravado, então um lote interrompido é retomado após reinício
+# (quando o lease do executor anterior expira). Cada resultado só é gravado
+# por quem ainda detém o lease, no máximo uma vez por item; um executor que
+# perdeu o lease abandona o lote.
+#
+# Com vários workers (gunicorn), só um processo por máquina executa os lotes:
+# o primeiro que obtém a trava de arquivo <LOTE_DB_PATH>.executor (flock,
+# liberada pelo sistema quando o processo termina). Os demais só enfileiram;
+# o executor verifica a fila a cada INTERVALO_FILA_S e, sem lotes, encerra o
+# pool de processos.
+import csv
+import fcntl
+import io
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from shapely.geometry import shape
+
+from . import analise
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lotes (
+    id TEXT PRIMARY KEY,
+    criado_em REAL NOT NULL,
+    status TEXT NOT NULL,           -- pendente | executando | concluido
+    total INTEGER NOT NULL,
+    concluidos INTEGER NOT NULL DEFAULT 0,
+    lease_dono TEXT,
+    lease_ate REAL
+);
+CREATE TABLE IF NOT EXISTS itens (
+    lote_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    entrada TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pendente',
+    PRIMARY KEY (lote_id, seq)
+);
+CREATE INDEX IF NOT EXISTS itens_status ON itens (lote_id, status);
+CREATE TABLE IF NOT EXISTS resultados (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lote_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    resultado TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS resultados_lote ON resultados (lote_id, id);
+"""
+# Um resultado por item: a gravação de um executor que perdeu o lease (ou a
+# repetição de um item) não duplica linhas. Bancos antigos podem ter
+# duplicatas, removidas (fica a primeira) antes de criar o índice.
+SQL_INDICE_RESULTADOS = """
+DELETE FROM resultados WHERE id NOT IN (SELECT MIN(id) FROM resultados GROUP BY lote_id, seq);
+CREATE UNIQUE INDEX resultados_item ON resultados (lote_id, seq);
+"""
+
+LEASE_SEGUNDOS = 60
+INTERVALO_FILA_S = 2  # Lotes enviados por outro worker são vistos no máximo após este intervalo
+INTERVALO_TRAVA_S = 30  # Processos sem a trava do executor tentam de novo após este intervalo
+COLUNAS_CODIGO = ('car_code', 'cod_imovel', 'codigo_car', 'car')
+COLUNAS_UF = ('uf', 'sigla_uf', 'estado')
+COLUNAS_LAT = ('latitude', 'lat')
+COLUNAS_LON = ('longitude', 'lon', 'lng')
+
+
+class EntradaLoteInvalida(ValueError):
+    """Arquivo de lote em formato não reconhecido ou com linhas inválidas."""
+
+
+# --- Leitura das entradas (CSV / GeoJSON) ---
+def _primeiro(registro, colunas):
+    for coluna in colunas:
+        valor = registro.get(coluna)
+        if valor not in (None, ''):
+            return valor
+    return None
+
+
+def _entrada(registro, referencia):
+    """Normaliza um registro (linha CSV ou properties GeoJSON) para os argumentos de analisar_imovel."""
+    registro = {str(k).strip().lower(): (v.strip() if isinstance(v, str) else v) for k, v in registro.items() if k}
+    entrada = {}
+    car_code = _primeiro(registro, COLUNAS_CODIGO)
+    sigla_uf = _primeiro(registro, COLUNAS_UF)
+    lat, lon = _primeiro(registro, COLUNAS_LAT), _primeiro(registro, COLUNAS_LON)
+    if car_code:
+        entrada['car_code'] = str(car_code)
+    elif lat is not None and lon is not None:
+        try:
+            entrada['lat'], entrada['lon'] = float(str(lat).replace(',', '.')), float(str(lon).replace(',', '.'))
+        except ValueError:
+            raise EntradaLoteInvalida(f"{referencia}: coordenadas inválidas ({lat}, {lon}).")
+        if not (-90 <= entrada['lat'] <= 90) or not (-180 <= entrada['lon'] <= 180):
+            raise EntradaLoteInvalida(f"{referencia}: coordenadas fora dos limites válidos.")
+    else:
+        raise EntradaLoteInvalida(f"{referencia}: informe o código CAR ou latitude/longitude.")
+    if sigla_uf:
+        entrada['sigla_uf'] = str(sigla_uf).upper()
+    return entrada
+
+
+def _ler_csv(texto):
+    try:
+        dialeto = csv.Sniffer().sniff(texto[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialeto = csv.excel
+    leitor = csv.DictReader(io.StringIO(texto), dialect=dialeto)
+    return [_entrada(linha, f"Linha {n}") for n, linha in enumerate(leitor, start=2)]
+
+
+def _ler_geojson(texto):
+    try:
+        dados = json.loads(texto)
+    except json.JSONDecodeError as e:
+        raise EntradaLoteInvalida(f"GeoJSON inválido: {e}")
+    features = dados.get('features') if dados.get('type') == 'FeatureCollection' else [dados]
+    entradas = []
+    for n, feature in enumerate(features, start=1):
+        propriedades = dict(feature.get('properties') or {})
+        if not _primeiro({k.lower(): v for k, v in propriedades.items()}, COLUNAS_CODIGO) and feature.get('geometry'):
+            # Sem código CAR: usa a geometria (ponto, ou um ponto interno do polígono)
+            ponto = shape(feature['geometry']).representative_point()
+            propriedades['lat'], propriedades['lon'] = ponto.y, ponto.x
+        entradas.append(_entrada(propriedades, f"Feature {n}"))
+    return entradas
+
+
+def ler_entradas(conteudo, nome_arquivo='', content_type=''):
+    """Converte o arquivo enviado (CSV ou GeoJSON) em uma lista de entradas."""
+    texto = conteudo.decode('utf-8-sig') if isinstance(conteudo, bytes) else conteudo
+    if not texto.strip():
+        raise EntradaLoteInvalida("Arquivo de lote vazio.")
+    nome = (nome_arquivo or '').lower()
+    if nome.endswith(('.geojson', '.json')) or 'json' in (content_type or '') or texto.lstrip().startswith('{'):
+        entradas = _ler_geojson(texto)
+    else:
+        entradas = _ler_csv(texto)
+    if not entradas:
+        raise EntradaLoteInvalida("Nenhuma entrada encontrada no arquivo de lote.")
+    return entradas
+
+
+# --- Fila persistente (SQLite) ---
+@contextmanager
+def _conectar(db_path):
+    """Conexão SQLite de curta duração: commit ao sair do bloco (rollback em erro) e fechamento."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def inicializar_banco(db_path):
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    with _conectar(db_path) as conn:
+        conn.executescript(SCHEMA)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'resultados_item'").fetchone() is None:
+            conn.executescript(SQL_INDICE_RESULTADOS)
+
+
+def criar_lote(db_path, entradas):
+    inicializar_banco(db_path)
+    lote_id = uuid.uuid4().hex
+    with _conectar(db_path) as conn:
+        conn.execute("INSERT INTO lotes (id, criado_em, status, total) VALUES (?, ?, 'pendente', ?)",
+                     (lote_id, time.time(), len(entradas)))
+        conn.executemany("INSERT INTO itens (lote_id, seq, entrada) VALUES (?, ?, ?)",
+                         ((lote_id, seq, json.dumps(entrada)) for seq, entrada in enumerate(entradas)))
+    return lote_id
+
+
+def obter_lote(db_path, lote_id):
+    if not os.path.exists(db_path):
+        return None
+    with _conectar(db_path) as conn:
+        linha = conn.execute("SELECT id, criado_em, status, total, concluidos FROM lotes WHERE id = ?",
+                             (lote_id,)).fetchone()
+    return dict(linha) if linha else None
+
+
+def stream_resultados(db_path, lote_id, seguir=False, intervalo=1.0):
+    """Gera linhas NDJSON: progresso, um resultado por item concluído e o progresso final.
+
+    Com `seguir=True`, continua aguardando novos resultados até o lote terminar.
+    """
+    ultimo_id = 0
+    lote = obter_lote(db_path, lote_id)
+    yield json.dumps({'tipo': 'progresso', **lote}) + "\n"
+    while True:
+        with _conectar(db_path) as conn:
+            linhas = conn.execute(
+                "SELECT id, seq, resultado FROM resultados WHERE lote_id = ? AND id > ? ORDER BY id LIMIT 1000",
+                (lote_id, ultimo_id)).fetchall()
+        for linha in linhas:
+            ultimo_id = linha['id']
+            yield json.dumps({'tipo': 'resultado', 'seq': linha['seq'], **json.loads(linha['resultado'])}) + "\n"
+        if linhas:
+            continue
+        lote = obter_lote(db_path, lote_id)
+        if not seguir or lote['status'] == 'concluido':
+            break
+        yield json.dumps({'tipo': 'progresso', **lote}) + "\n"
+        time.sleep(intervalo)
+    yield json.dumps({'tipo': 'progresso', **lote}) + "\n"
+
+
+# --- Execução ---
+def _processar_item(entrada):
+    app = analise.app_do_worker()
+    with app.app_context():
+        try:
+            resultado = analise.analisar_imovel(**entrada)
+        except Exception as e:
+            app.logger.error(f"Erro no item de lote {entrada}: {e}", exc_info=True)
+            resultado = {'status': 'erro', 'avisos': [f"Erro inesperado: {e}"]}
+    resultado['entrada'] = entrada
+    return resultado
+
+
+class ExecutorLotes:
+    """Thread que consome a fila de lotes usando um pool de processos."""
+
+    def __init__(self, db_path, workers, logger):
+        self.db_path = db_path
+        self.workers = workers
+        self.logger = logger
+        self.dono = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._acordar = threading.Event()
+        self._pool = None
+        self._thread = threading.Thread(target=self._loop, name='executor-lotes', daemon=True)
+
+    def iniciar(self):
+        inicializar_banco(self.db_path)
+        self._thread.start()
+
+    def acordar(self):
+        self._acordar.set()
+
+    def _get_pool(self):
+        if self._pool is None:
+            # 'spawn': processos novos, sem herdar threads/sockets/handles GDAL do worker web
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=analise.inicializar_worker)
+        return self._pool
+
+    def _reivindicar_lote(self):
+        agora = time.time()
+        with _conectar(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE;")
+            linha = conn.execute(
+                "SELECT id FROM lotes WHERE status != 'concluido' AND (lease_ate IS NULL OR lease_ate < ? OR lease_dono = ?)"
+                " ORDER BY criado_em LIMIT 1", (agora, self.dono)).fetchone()
+            if linha is None:
+                return None
+            conn.execute("UPDATE lotes SET status = 'executando', lease_dono = ?, lease_ate = ? WHERE id = ?",
+                         (self.dono, agora + LEASE_SEGUNDOS, linha['id']))
+        return linha['id']
+
+    def _renovar_lease(self, lote_id):
+        """Estende o lease; False se outro executor assumiu o lote."""
+        with _conectar(self.db_path) as conn:
+            return conn.execute("UPDATE lotes SET lease_ate = ? WHERE id = ? AND lease_dono = ?",
+                                (time.time() + LEASE_SEGUNDOS, lote_id, self.dono)).rowcount == 1
+
+    def _gravar_resultado(self, lote_id, seq, resultado):
+        """Grava o resultado do item se este executor ainda detém o lease; False se o perdeu.
+
+        `concluidos` só avança quando o item sai de 'pendente' nesta gravação.
+        """
+        with _conectar(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE;")
+            if conn.execute("SELECT 1 FROM lotes WHERE id = ? AND lease_dono = ?", (lote_id, self.dono)).fetchone() is None:
+                return False
+            conn.execute("INSERT INTO resultados (lote_id, seq, resultado) VALUES (?, ?, ?)"
+                         " ON CONFLICT (lote_id, seq) DO NOTHING", (lote_id, seq, json.dumps(resultado)))
+            concluido = conn.execute("UPDATE itens SET status = 'concluido' WHERE lote_id = ? AND seq = ? AND status = 'pendente'",
+                                     (lote_id, seq)).rowcount
+            if concluido:
+                conn.execute("UPDATE lotes SET concluidos = concluidos + 1 WHERE id = ?", (lote_id,))
+        return True
+
+    def _abandonar_lote(self, lote_id, em_andamento):
+        for futuro in em_andamento:
+            futuro.cancel()
+        self.logger.warning(f"Lote {lote_id}: lease assumido por outro executor; itens restantes ficam com ele.")
+
+    def _executar_lote(self, lote_id):
+        with _conectar(self.db_path) as conn:
+            pendentes = conn.execute("SELECT seq, entrada FROM itens WHERE lote_id = ? AND status = 'pendente' ORDER BY seq",
+                                     (lote_id,)).fetchall()
+        self.logger.info(f"Lote {lote_id}: {len(pendentes)} itens pendentes.")
+        pool = self._get_pool()
+        fila = iter(pendentes)
+        em_andamento = {}
+        ultimo_lease = time.monotonic()
+        max_em_andamento = self.workers * 4 # Limita a memória: não enfileira o lote inteiro de uma vez
+
+        while True:
+            for linha in fila:
+                futuro = pool.submit(_processar_item, json.loads(linha['entrada']))
+                em_andamento[futuro] = linha['seq']
+                if len(em_andamento) >= max_em_andamento:
+                    break
+            if not em_andamento:
+                break
+            prontos, _ = wait(em_andamento, timeout=LEASE_SEGUNDOS / 3, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                seq = em_andamento.pop(futuro)
+                if not self._gravar_resultado(lote_id, seq, futuro.result()):
+                    self._abandonar_lote(lote_id, em_andamento)
+                    return
+            if time.monotonic() - ultimo_lease > LEASE_SEGUNDOS / 3:
+                if not self._renovar_lease(lote_id):
+                    self._abandonar_lote(lote_id, em_andamento)
+                    return
+                ultimo_lease = time.monotonic()
+
+        with _conectar(self.db_path) as conn:
+            conn.execute("UPDATE lotes SET status = 'concluido', lease_dono = NULL, lease_ate = NULL"
+                         " WHERE id = ? AND lease_dono = ?", (lote_id, self.dono))
+        self.logger.info(f"Lote {lote_id} concluído.")
+
+    def _loop(self):
+        while True:
+            try:
+                lote_id = self._reivindicar_lote()
+                if lote_id is None:
+                    if self._pool is not None: # Fila vazia: libera os processos de análise
+                        self._pool.shutdown()
+                        self._pool = None
+                    self._acordar.wait(INTERVALO_FILA_S)
+                    self._acordar.clear()
+                    continue
+                self._executar_lote(lote_id)
+            except BrokenProcessPool as e:
+                # Um processo morreu (ex: falta de memória): os itens sem resultado seguem pendentes
+                self.logger.error(f"Pool de processos do lote quebrado, recriando: {e}")
+                self._pool = None
+            except Exception as e:
+                self.logger.error(f"Erro no executor de lotes: {e}", exc_info=True)
+                time.sleep(5)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_trava = None  # Arquivo da trava do executor, aberto enquanto o processo viver
+_proxima_tentativa = 0.0
+
+
+def _obter_trava(db_path):
+    """True se este processo passou a ser o executor de lotes da máquina."""
+    global _trava
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    arquivo = open(db_path + '.executor', 'a')
+    try:
+        fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        arquivo.close()
+        return False
+    _trava = arquivo
+    return True
+
+
+def get_executor(app):
+    """Executor do processo, iniciado na primeira chamada (retoma lotes pendentes), ou None
+    se outro processo da máquina já executa os lotes."""
+    global _executor, _proxima_tentativa
+    if _executor is None and time.monotonic() >= _proxima_tentativa:
+        with _executor_lock:
+            if _executor is None and time.monotonic() >= _proxima_tentativa:
+                if _obter_trava(app.config['LOTE_DB_PATH']):
+                    executor = ExecutorLotes(app.config['LOTE_DB_PATH'],
+                                             app.config['LOTE_WORKERS'], app.logger)
+                    executor.iniciar()
+                    _executor = executor
+                else:
+                    _proxima_tentativa = time.monotonic() + INTERVALO_TRAVA_S
+    return _executor
+
+
+def init_app(app):
+    if not app.config['LOTE_EXECUTOR_ATIVO']:
+        return
+
+    @app.before_request
+    def _garantir_executor():
+        # Inicia o executor na primeira requisição: lotes interrompidos por um
+        # reinício voltam a ser processados sem esperar um novo envio. Se o
+        # worker que executava os lotes morrer, outro assume a trava.
+        get_executor(app)
@@ -0,0 +1,131 @@
+# SeloDeMap/app/mapa.py
+# HTML do mapa de resultado (Folium) a partir de um esqueleto em cache.
+#
+# Montar o mapa inteiro a cada /analisar custava mais que o resto da análise:
+# cada TileLayer com URL própria percorre o catálogo de provedores do
+# xyzservices antes de aceitar a URL, e cada elemento compila seu template
+# Jinja. As partes fixas (as quatro camadas base, a legenda PRODES, os
+# JS/CSS do Leaflet) são renderizadas uma vez por processo, com nomes JS
+# fixos. Por requisição, só as camadas do imóvel (marcador, estado, imóvel,
+# PRODES) e o controle de camadas são renderizados e injetados no esqueleto,
+# junto com o setView do centro/zoom da análise.
+#
+# O resultado é o documento HTML completo do Folium, escrito no iframe do
+# index.html com document.write.
+import threading
+
+import folium
+import xyzservices
+
+ID_MAPA = 'selodemap'  # _id fixo: o JS das camadas da requisição referencia a variável do mapa do esqueleto
+CENTRO_PADRAO = (-15.7801, -47.9292, 4)  # Brasília
+
+# (tiles, atribuição, nome no controle de camadas)
+CAMADAS_BASE = (
+    ('openstreetmap', None, 'OpenStreetMap'),
+    ('https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+     'Esri World Imagery', 'Imagem de Satélite'),
+    ('https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}', 'Google Satellite', 'Google Satellite'),
+    ('https://mt1.google.com/vt/lyrs=m&x={x}&y={y}&z={z}', 'Google Maps', 'Google Maps'),
+)
+
+# Legenda PRODES (simplificada)
+LEGENDA_PRODES_HTML = """
+     <div style='position: fixed;
+                bottom: 50px;
+                left: 10px;
+                width: auto;
+                max-width:200px;
+                border:2px solid grey;
+                z-index:9999;
+                background-color:white;
+                opacity:0.85;
+                padding: 10px;
+                font-size:12px;
+                border-radius: 5px;
+                box-shadow: 0 0 15px rgba(0,0,0,0.2);'>
+       <div style='text-align:center; margin-bottom:5px;'><b>Legenda PRODES</b></div>
+       <div style='margin-bottom:3px;'><i style='background: linear-gradient(to right, #FFFF00, #FF0000); display:inline-block; width:30px; height:15px; margin-right:5px;'></i> Desmatamento (2000-2023)</div>
+       <div style='margin-bottom:3px;'><i style='background:#008000; display:inline-block; width:30px; height:15px; margin-right:5px;'></i> Vegetação Nativa</div>
+       <div style='margin-bottom:3px;'><i style='background:#A52A2A; display:inline-block; width:30px; height:15px; margin-right:5px;'></i> Não Floresta</div>
+       <div style='margin-bottom:3px;'><i style='background:#00BFFF; display:inline-block; width:30px; height:15px; margin-right:5px;'></i> Hidrografia</div>
+       <div style='margin-bottom:3px;'><i style='background:#D3D3D3; display:inline-block; width:30px; height:15px; margin-right:5px;'></i> Nuvem/Outros</div>
+     </div>
+    """
+
+_esqueletos = {}  # {legenda_prodes: Esqueleto}
+_esqueletos_lock = threading.Lock()
+
+
+class ControleCamadas(folium.LayerControl):
+    """LayerControl que lista também as camadas base do esqueleto (já renderizadas, fora do mapa da requisição)."""
+
+    def __init__(self, camadas_base, **kwargs):
+        super().__init__(**kwargs)
+        self._camadas_base = camadas_base
+
+    def reset(self):
+        super().reset()
+        self.base_layers.update(self._camadas_base)
+
+
+class Esqueleto:
+    """Documento do mapa sem as camadas da requisição, partido nos pontos de injeção."""
+
+    def __init__(self, legenda_prodes):
+        m = novo_mapa(*CENTRO_PADRAO)
+        self.camadas_base = {} # {nome no controle: variável JS}
+        for i, (tiles, attr, nome) in enumerate(CAMADAS_BASE):
+            camada = folium.TileLayer(tiles, attr=attr, name=nome, control=True)
+            camada._id = f'base{i}'
+            camada.add_to(m)
+            self.camadas_base[camada.layer_name] = camada.get_name()
+        figura = m.get_root()
+        if legenda_prodes:
+            figura.html.add_child(folium.Element(LEGENDA_PRODES_HTML))
+        documento = figura.render()
+        self.nomes_header = set(figura.header._children) # JS/CSS já incluídos
+        fim_head, fim_body, fim_script = documento.rindex('</head>'), documento.rindex('</body>'), documento.rindex('</script>')
+        self.partes = (documento[:fim_head], documento[fim_head:fim_body], documento[fim_body:fim_script], documento[fim_script:])
+
+    def montar(self, header, html, script):
+        inicio, meio_head, meio_body, fim = self.partes
+        return ''.join((inicio, header, meio_head, html, meio_body, script, fim))
+
+
+def get_esqueleto(legenda_prodes):
+    esqueleto = _esqueletos.get(legenda_prodes)
+    if esqueleto is None:
+        with _esqueletos_lock:
+            esqueleto = _esqueletos.get(legenda_prodes)
+            if esqueleto is None:
+                esqueleto = _esqueletos[legenda_prodes] = Esqueleto(legenda_prodes)
+    return esqueleto
+
+
+def novo_mapa(lat, lon, zoom):
+    """Mapa Folium da requisição (sem camadas base), para receber as camadas do imóvel."""
+    m = folium.Map(location=[lat, lon], zoom_start=zoom, tiles=None)
+    m._id = ID_MAPA
+    return m
+
+
+def camada_tiles(url, attr, name, **kwargs):
+    """TileLayer de uma URL própria sem a busca entre os provedores do xyzservices."""
+    return folium.TileLayer(tiles=xyzservices.TileProvider(name=name, url=url, attribution=attr), name=name, **kwargs)
+
+
+def renderizar(m, legenda_prodes=False):
+    """HTML completo do mapa: esqueleto em cache + camadas de `m` + controle de camadas."""
+    esqueleto = get_esqueleto(legenda_prodes)
+    ControleCamadas(esqueleto.camadas_base, collapsed=False).add_to(m)
+    for filho in list(m._children.values()):
+        filho.render()
+    figura = m.get_root()
+    header = ''.join(elemento.render() for nome, elemento in figura.header._children.items()
+                     if nome not in esqueleto.nomes_header)
+    html = ''.join(elemento.render() for elemento in figura.html._children.values())
+    lat, lon = m.location
+    script = f"\n    {m.get_name()}.setView([{lat}, {lon}], {m.options['zoom']});\n" + \
+             ''.join(elemento.render() for elemento in figura.script._children.values())
+    return esqueleto.montar(header, html, script)
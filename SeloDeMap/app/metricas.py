@@ -0,0 +1,229 @@
+# SeloDeMap/app/metricas.py
+# Instrumentação em formato Prometheus (/metrics) e cabeçalho Server-Timing.
+#
+# Histogramas de duração por etapa do /analisar (estado, car, prodes, mapa...),
+# por operação externa ou custosa (WFS do IBGE, consulta PostGIS, máscara do
+# raster, colormap, renderização do mapa) e por endpoint HTTP, mais contadores
+# de erros. Hits de cache e uso do pool do banco são lidos dos próprios
+# objetos no momento da coleta. Registrar uma observação custa um lock e uma
+# busca binária nos limites dos buckets, o suficiente para ficar sempre ligado.
+#
+# As métricas são do processo: com vários workers (gunicorn), cada um expõe as
+# suas e o Prometheus deve coletar os workers individualmente ou somar por
+# instância.
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+
+LIMITES_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _rotulos_texto(nomes, valores, extra=None):
+    pares = list(zip(nomes, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ''
+    itens = []
+    for nome, valor in pares:
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        itens.append(f'{nome}="{valor}"')
+    return '{' + ','.join(itens) + '}'
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores_rotulos, valor=1):
+        with self._lock:
+            self._valores[valores_rotulos] = self._valores.get(valores_rotulos, 0) + valor
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        with self._lock:
+            itens = sorted(self._valores.items())
+        for valores_rotulos, valor in itens:
+            linhas.append(f"{self.nome}{_rotulos_texto(self.rotulos, valores_rotulos)} {_numero(valor)}")
+        return linhas
+
+
+class Histograma:
+    """Histograma cumulativo (buckets `le`) com soma e contagem por combinação de rótulos."""
+
+    def __init__(self, nome, ajuda, rotulos=(), limites=LIMITES_PADRAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.limites = tuple(sorted(limites))
+        self._series = {}  # {valores dos rótulos: [contagens por bucket (+Inf no fim), soma]}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_rotulos):
+        posicao = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(valores_rotulos)
+            if serie is None:
+                serie = self._series[valores_rotulos] = [[0] * (len(self.limites) + 1), 0.0]
+            serie[0][posicao] += 1
+            serie[1] += valor
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            series = sorted((chave, (list(contagens), soma)) for chave, (contagens, soma) in self._series.items())
+        for valores_rotulos, (contagens, soma) in series:
+            acumulado = 0
+            for limite, contagem in zip(self.limites + ('+Inf',), contagens):
+                acumulado += contagem
+                le = limite if limite == '+Inf' else _numero(float(limite))
+                linhas.append(f"{self.nome}_bucket{_rotulos_texto(self.rotulos, valores_rotulos, ('le', le))} {acumulado}")
+            rotulos = _rotulos_texto(self.rotulos, valores_rotulos)
+            linhas.append(f"{self.nome}_sum{rotulos} {_numero(soma)}")
+            linhas.append(f"{self.nome}_count{rotulos} {acumulado}")
+        return linhas
+
+
+DURACAO_ETAPA = Histograma('selodemap_etapa_duracao_segundos',
+                           "Duração das etapas do /analisar.", ('etapa', 'status'))
+DURACAO_OPERACAO = Histograma('selodemap_operacao_duracao_segundos',
+                              "Duração de operações externas ou custosas (WFS, PostGIS, raster, mapa).", ('operacao',))
+DURACAO_HTTP = Histograma('selodemap_http_duracao_segundos',
+                          "Duração das requisições HTTP até o envio dos cabeçalhos.", ('endpoint', 'metodo'))
+REQUISICOES_HTTP = Contador('selodemap_http_requisicoes_total',
+                            "Requisições HTTP por endpoint e status.", ('endpoint', 'metodo', 'status'))
+ERROS = Contador('selodemap_erros_total',
+                 "Erros por origem: etapas que falharam ou expiraram, operações com exceção, respostas 5xx.",
+                 ('origem', 'tipo'))
+
+_METRICAS = (DURACAO_ETAPA, DURACAO_OPERACAO, DURACAO_HTTP, REQUISICOES_HTTP, ERROS)
+
+
+_coleta = threading.local()  # Entradas de Server-Timing de threads sem contexto de requisição (etapas)
+
+
+def _server_timing(nome, duracao):
+    """Acrescenta uma entrada ao Server-Timing da requisição atual (se houver uma nesta thread)
+    ou à coleta da etapa em andamento nesta thread (ver coletar_server_timing)."""
+    if has_request_context():
+        g.setdefault('server_timing', []).append((nome, duracao))
+        return
+    entradas = getattr(_coleta, 'entradas', None)
+    if entradas is not None:
+        entradas.append((nome, duracao))
+
+
+@contextmanager
+def coletar_server_timing():
+    """`with metricas.coletar_server_timing() as entradas:` junta numa lista as operações medidas
+    nesta thread, para a thread da requisição repassá-las com incluir_server_timing."""
+    anteriores, _coleta.entradas = getattr(_coleta, 'entradas', None), []
+    try:
+        yield _coleta.entradas
+    finally:
+        _coleta.entradas = anteriores
+
+
+def incluir_server_timing(entradas):
+    for nome, duracao in entradas:
+        _server_timing(nome, duracao)
+
+
+def registrar_etapa(nome, duracao, status):
+    DURACAO_ETAPA.observar(duracao, nome, status)
+    if status in ('erro', 'tempo_esgotado'):
+        ERROS.inc(f"etapa:{nome}", status)
+    _server_timing(nome, duracao)
+
+
+@contextmanager
+def cronometro(operacao):
+    """`with metricas.cronometro('wfs_ibge'):` mede o bloco e conta exceções."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        ERROS.inc(f"operacao:{operacao}", type(e).__name__)
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        DURACAO_OPERACAO.observar(duracao, operacao)
+        _server_timing(operacao, duracao)
+
+
+def _metricas_externas():
+    """Contadores mantidos pelos próprios caches e pelo pool de conexões, lidos na coleta."""
+    from . import cache_analise, db, tiles
+
+    linhas = ["# HELP selodemap_cache_hits_total Acertos por cache e nível.",
+              "# TYPE selodemap_cache_hits_total counter"]
+    falhas = ["# HELP selodemap_cache_misses_total Falhas por cache e nível.",
+              "# TYPE selodemap_cache_misses_total counter"]
+    caches = cache_analise.metricas()
+    cache_tiles = tiles.get_cache_tiles(current_app.config['PRODES_TILE_CACHE_SIZE'])
+    caches['tiles'] = {'memoria': {'hits': cache_tiles.hits, 'misses': cache_tiles.misses}}
+    for nome, niveis in sorted(caches.items()):
+        for nivel, valores in sorted(niveis.items()):
+            rotulos = _rotulos_texto(('cache', 'nivel'), (nome, nivel))
+            linhas.append(f"selodemap_cache_hits_total{rotulos} {valores['hits']}")
+            falhas.append(f"selodemap_cache_misses_total{rotulos} {valores['misses']}")
+    linhas += falhas
+
+    pool = db.get_pool().metricas()
+    for chave, nome, tipo, ajuda in (
+            ('em_uso', 'selodemap_db_pool_em_uso', 'gauge', "Conexões do pool em uso."),
+            ('ociosas', 'selodemap_db_pool_ociosas', 'gauge', "Conexões ociosas no pool."),
+            ('total', 'selodemap_db_pool_conexoes', 'gauge', "Conexões abertas pelo pool."),
+            ('max', 'selodemap_db_pool_max', 'gauge', "Limite de conexões do pool."),
+            ('aquisicoes', 'selodemap_db_pool_aquisicoes_total', 'counter', "Conexões entregues pelo pool."),
+            ('timeouts', 'selodemap_db_pool_timeouts_total', 'counter', "Esperas por conexão que esgotaram o prazo."),
+            ('espera_total_s', 'selodemap_db_pool_espera_segundos_total', 'counter', "Tempo total de espera por conexão."),
+            ('conexoes_criadas', 'selodemap_db_pool_conexoes_criadas_total', 'counter', "Conexões abertas."),
+            ('conexoes_descartadas', 'selodemap_db_pool_conexoes_descartadas_total', 'counter', "Conexões fechadas.")):
+        linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}", f"{nome} {_numero(pool[chave])}"]
+    return linhas
+
+
+def exportar():
+    """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+    linhas = []
+    for metrica in _METRICAS:
+        linhas += metrica.exportar()
+    try:
+        linhas += _metricas_externas()
+    except Exception as e:
+        current_app.logger.warning(f"Métricas de cache/pool indisponíveis: {e}")
+    return '\n'.join(linhas) + '\n'
+
+
+def init_app(app):
+    @app.before_request
+    def _iniciar_cronometro():
+        g.inicio_requisicao = time.perf_counter()
+
+    @app.after_request
+    def _registrar_requisicao(resposta):
+        inicio = g.pop('inicio_requisicao', None)
+        if inicio is None:
+            return resposta
+        duracao = time.perf_counter() - inicio
+        endpoint = request.endpoint or 'nao_encontrado'
+        DURACAO_HTTP.observar(duracao, endpoint, request.method)
+        REQUISICOES_HTTP.inc(endpoint, request.method, str(resposta.status_code))
+        if resposta.status_code >= 500:
+            ERROS.inc(f"http:{endpoint}", str(resposta.status_code))
+        if app.config['SERVER_TIMING_ATIVO']:
+            entradas = g.pop('server_timing', []) + [('total', duracao)]
+            resposta.headers['Server-Timing'] = ', '.join(f"{nome};dur={t * 1000:.1f}" for nome, t in entradas)
+        return resposta
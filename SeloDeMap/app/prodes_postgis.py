@@ -0,0 +1,244 @@
+# SeloDeMap/app/prodes_postgis.py
+# Motor PRODES no PostGIS Raster (Config.PRODES_ENGINE = 'postgis').
+#
+# `flask carregar-prodes-postgis` grava o raster PRODES em tiles (linhas do
+# tipo raster, uma versão do PRODES por carga) com índice GiST na envoltória
+# de cada tile. A contagem de pixels por classe do imóvel (ST_Clip +
+# ST_ValueCount sobre os tiles que o tocam) vem como uma coluna a mais da
+# própria consulta que busca o imóvel CAR, então o worker recebe só um
+# histograma {classe: pixels} em vez de geometria + pixels do raster. O
+# pré-cálculo por UF vira um único INSERT ... SELECT sobre a partição.
+#
+# O ST_Clip considera os pixels cujo centro cai no polígono, enquanto o
+# recorte do rasterio usa all_touched: as áreas podem diferir nas bordas do
+# imóvel. Camadas que precisam dos pixels (ImageOverlay) continuam no rasterio.
+import struct
+import threading
+
+import numpy as np
+import psycopg2
+import rasterio
+from psycopg2 import sql
+from flask import current_app
+from psycopg2.extras import RealDictCursor, execute_values
+from rasterio.crs import CRS
+from rasterio.windows import Window
+
+from . import db, utils
+
+PIXTYPE_8BUI = 4
+FLAG_TEM_NODATA = 0x40
+
+# Histograma {valor: pixels} da geometria `{geom}` (expressão SQL) nos tiles da
+# versão `{versao}`. A geometria é transformada para o SRID fixo do raster -
+# nunca a coluna rast - para o índice GiST em ST_ConvexHull(rast) ser usado.
+SQL_HISTOGRAMA = """(
+        SELECT json_object_agg(h.valor, h.pixels)
+        FROM (
+            SELECT vc.value::int AS valor, sum(vc.count)::bigint AS pixels
+            FROM {tabela_raster} r,
+                 LATERAL ST_ValueCount(ST_Clip(r.rast, 1, ST_Transform({geom}, {srid}), true), 1, true) AS vc
+            WHERE r.versao = {versao}
+              AND ST_ConvexHull(r.rast) && ST_Transform({geom}, {srid})
+              AND ST_Intersects(r.rast, ST_Transform({geom}, {srid}))
+            GROUP BY vc.value
+        ) h
+    )"""
+
+SQL_HISTOGRAMA_POR_CODIGO = """
+    SELECT {histograma} AS prodes_histograma
+    FROM {table_name}
+    WHERE cod_imovel = $1::text AND sigla_uf = $2::text
+"""
+
+SQL_METADADOS = """
+    SELECT ST_SRID(rast) AS srid, ST_ScaleX(rast) AS escala_x, ST_ScaleY(rast) AS escala_y
+    FROM {tabela_raster} WHERE versao = $1::text LIMIT 1
+"""
+
+# Pré-cálculo de uma UF inteira: histograma de cada imóvel e conversão para
+# áreas (ha) por ano (valores 1-23 -> 2001-2023) e por classe, direto na tabela.
+SQL_PRECOMPUTAR_UF = """
+    INSERT INTO {tabela_estatisticas} (cod_imovel, sigla_uf, versao_prodes, motor, desmatamento_ha, classes_ha, aviso)
+    SELECT c.cod_imovel, c.sigla_uf, %(versao)s, 'postgis',
+           COALESCE(jsonb_object_agg(2000 + h.valor, h.pixels * %(area_pixel_ha)s)
+                    FILTER (WHERE h.valor BETWEEN 1 AND 23 AND h.pixels * %(area_pixel_ha)s > 0.001), '{{}}'),
+           COALESCE(jsonb_object_agg(h.valor, h.pixels * %(area_pixel_ha)s) FILTER (WHERE h.valor IS NOT NULL), '{{}}'),
+           CASE WHEN count(h.valor) = 0 THEN 'Imóvel fora da área do raster PRODES.' END
+    FROM {table_name} c
+    LEFT JOIN LATERAL (
+        SELECT vc.value::int AS valor, sum(vc.count)::bigint AS pixels
+        FROM {tabela_raster} r,
+             LATERAL ST_ValueCount(ST_Clip(r.rast, 1, ST_Transform(c.geom, {srid}), true), 1, true) AS vc
+        WHERE r.versao = %(versao)s
+          AND ST_ConvexHull(r.rast) && ST_Transform(c.geom, {srid})
+          AND ST_Intersects(r.rast, ST_Transform(c.geom, {srid}))
+        GROUP BY vc.value
+    ) h ON true
+    {filtro}
+    GROUP BY c.cod_imovel, c.sigla_uf
+    ON CONFLICT (cod_imovel, versao_prodes, motor) DO UPDATE SET
+        desmatamento_ha = EXCLUDED.desmatamento_ha,
+        classes_ha = EXCLUDED.classes_ha,
+        aviso = EXCLUDED.aviso,
+        calculado_em = now()
+"""
+
+_metadados = {}  # {(tabela, versão): área do pixel em m²}
+_metadados_lock = threading.Lock()
+
+
+def ativo():
+    return current_app.config['PRODES_ENGINE'] == 'postgis'
+
+
+def histograma_sql(geom, marcador_versao):
+    """Subconsulta do histograma para a geometria `geom`, com a versão no parâmetro `marcador_versao` (ex: '$3::text')."""
+    config = current_app.config
+    return SQL_HISTOGRAMA.format(tabela_raster=config['PRODES_RASTER_TABELA'], geom=geom,
+                                 srid=int(config['PRODES_RASTER_SRID']), versao=marcador_versao)
+
+
+def contagens(histograma_json):
+    """{valor: pixels} a partir do json_object_agg (chaves em texto; None = imóvel fora do raster)."""
+    return {int(valor): int(pixels) for valor, pixels in (histograma_json or {}).items()}
+
+
+def area_pixel_m2(versao):
+    """Área do pixel do raster carregado para a versão (m²), consultada uma vez por worker."""
+    tabela = current_app.config['PRODES_RASTER_TABELA']
+    chave = (tabela, versao)
+    if chave not in _metadados:
+        with db.conexao() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                db.executar_preparada(cursor, "prodes_raster_metadados", SQL_METADADOS.format(tabela_raster=tabela), (versao,))
+                registro = cursor.fetchone()
+        if registro is None:
+            raise LookupError(f"Raster PRODES da versão '{versao}' não carregado em '{tabela}' (flask carregar-prodes-postgis).")
+        area = utils.prodes_pixel_area_m2(CRS.from_epsg(registro['srid']),
+                                          (registro['escala_x'], 0, 0, 0, registro['escala_y']))
+        with _metadados_lock:
+            _metadados[chave] = area
+    return _metadados[chave]
+
+
+def resultado_de_contagens(pixels_por_valor, versao):
+    """Dict PRODES (mesmo formato de analise.prodes_imovel, sem pixels) a partir do histograma."""
+    valores, pixels = list(pixels_por_valor), list(pixels_por_valor.values())
+    area_pixel = area_pixel_m2(versao)
+    aviso = None if pixels_por_valor else "Imóvel fora da área do raster PRODES."
+    return {
+        'valores': None,
+        'desmatamento_ha': utils.prodes_areas_por_ano_de_contagens(valores, pixels, area_pixel),
+        'transform': None,
+        'crs': None,
+        'na_area': bool(pixels_por_valor),
+        'aviso': aviso,
+    }
+
+
+def histograma_imovel(cod_imovel, sigla_uf, versao):
+    """Histograma do imóvel por código (quando o registro CAR veio do cache, sem o histograma)."""
+    table_name = utils.car_table_name()
+    consulta = SQL_HISTOGRAMA_POR_CODIGO.format(histograma=histograma_sql('geom', '$3::text'), table_name=table_name)
+    with db.conexao() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            db.executar_preparada(cursor, "prodes_histograma_codigo", consulta, (cod_imovel, sigla_uf, versao))
+            registro = cursor.fetchone()
+    return contagens(registro['prodes_histograma']) if registro else None
+
+
+def prodes_imovel(imovel_car_data, versao):
+    """Resultado PRODES pelo motor PostGIS, ou None se não puder ser calculado (cai no rasterio)."""
+    pixels_por_valor = imovel_car_data.get('prodes_contagens')
+    try:
+        if pixels_por_valor is None:
+            pixels_por_valor = histograma_imovel(imovel_car_data['cod_imovel'], imovel_car_data['sigla_uf'], versao)
+            if pixels_por_valor is None:
+                return None
+        return resultado_de_contagens(pixels_por_valor, versao)
+    except (psycopg2.Error, LookupError) as e:
+        current_app.logger.warning(f"Motor PRODES PostGIS indisponível, usando o raster local: {e}")
+        return None
+
+
+def precomputar_uf(conn, table_name, versao, tabela_estatisticas, recalcular=False):
+    """Grava as estatísticas de todos os imóveis da partição num único INSERT ... SELECT; retorna o nº de linhas."""
+    config = current_app.config
+    filtro = "" if recalcular else f"""
+        WHERE NOT EXISTS (SELECT 1 FROM {tabela_estatisticas} s
+                          WHERE s.cod_imovel = c.cod_imovel AND s.versao_prodes = %(versao)s
+                            AND s.motor = 'postgis')"""
+    consulta = SQL_PRECOMPUTAR_UF.format(tabela_estatisticas=tabela_estatisticas, table_name=table_name,
+                                         tabela_raster=config['PRODES_RASTER_TABELA'],
+                                         srid=int(config['PRODES_RASTER_SRID']), filtro=filtro)
+    with conn.cursor() as cursor:
+        cursor.execute(consulta, {'versao': versao, 'area_pixel_ha': area_pixel_m2(versao) / 10000})
+        gravados = cursor.rowcount
+    conn.commit()
+    return gravados
+
+
+def wkb_raster(valores, transform, srid, nodata):
+    """WKB de raster PostGIS (1 banda 8BUI, little endian) de uma matriz uint8."""
+    altura, largura = valores.shape
+    cabecalho = struct.pack('<BHHddddddiHH', 1, 0, 1, transform.a, transform.e, transform.c, transform.f,
+                            transform.b, transform.d, int(srid), largura, altura)
+    banda = struct.pack('<BB', PIXTYPE_8BUI | FLAG_TEM_NODATA, int(nodata))
+    return cabecalho + banda + np.ascontiguousarray(valores, dtype=np.uint8).tobytes()
+
+
+def _ddl_tabela(tabela):
+    nome = sql.Identifier(tabela)
+    return sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {nome} (
+            rid bigserial PRIMARY KEY,
+            versao text NOT NULL,
+            rast raster NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS {idx_rast} ON {nome} USING gist (ST_ConvexHull(rast));
+        CREATE INDEX IF NOT EXISTS {idx_versao} ON {nome} (versao);
+    """).format(nome=nome, idx_rast=sql.Identifier(f"{tabela}_rast_gist"),
+                idx_versao=sql.Identifier(f"{tabela}_versao_idx"))
+
+
+def carregar_raster(caminho, tabela, versao, srid=None, tamanho_tile=256, progresso=None):
+    """Grava o raster PRODES em tiles na tabela (substituindo a carga anterior da mesma versão).
+
+    Tiles só com nodata são pulados. Retorna o número de tiles gravados.
+    """
+    conn = db.nova_conexao()
+    gravados = 0
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(_ddl_tabela(tabela))
+            cursor.execute(sql.SQL("DELETE FROM {nome} WHERE versao = %s").format(nome=sql.Identifier(tabela)), (versao,))
+            with rasterio.open(caminho) as src:
+                epsg = src.crs.to_epsg()
+                if srid and epsg != int(srid):
+                    raise ValueError(f"O raster está em EPSG:{epsg}, mas PRODES_RASTER_SRID é {srid}.")
+                srid = epsg
+                nodata = 255 if src.nodata is None else int(src.nodata)
+                for linha in range(0, src.height, tamanho_tile):
+                    lote = []
+                    for coluna in range(0, src.width, tamanho_tile):
+                        janela = Window(coluna, linha, min(tamanho_tile, src.width - coluna),
+                                        min(tamanho_tile, src.height - linha))
+                        valores = src.read(1, window=janela)
+                        if np.all(valores == nodata):
+                            continue
+                        lote.append((versao, wkb_raster(valores, src.window_transform(janela), srid, nodata).hex()))
+                    if lote:
+                        execute_values(cursor, sql.SQL("INSERT INTO {nome} (versao, rast) VALUES %s").format(
+                            nome=sql.Identifier(tabela)).as_string(conn), lote, template="(%s, %s::raster)")
+                        gravados += len(lote)
+                    if progresso:
+                        progresso(min(linha + tamanho_tile, src.height), src.height, gravados)
+            cursor.execute(sql.SQL("ANALYZE {nome}").format(nome=sql.Identifier(tabela)))
+        conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return gravados
@@ -0,0 +1,186 @@
+# SeloDeMap/app/prodes_vetorial.py
+# Motor PRODES vetorial (Config.PRODES_ENGINE = 'vetorial').
+#
+# O recorte do raster (mask com all_touched=True) conta como inteiro todo
+# pixel que encosta na borda do imóvel e usa uma área fixa de 900 m² por
+# pixel em rasters geográficos. Aqui as classes de desmatamento (1..23) são
+# convertidas em polígonos uma vez por versão do PRODES
+# (`flask --app run poligonizar-prodes`) e gravadas em GeoParquet, com o ano e
+# a área de cada polígono. Cada processo carrega o arquivo num STRtree (no
+# mestre do gunicorn, antes do fork); a área desmatada do imóvel por ano é a
+# soma das áreas das interseções com os polígonos que o tocam.
+#
+# As áreas são calculadas na projeção Albers equivalente do IBGE sobre o
+# elipsoide GRS80: uma projeção equivalente preserva a área no elipsoide, e a
+# diferença entre arestas retas e geodésicas é desprezível em arestas do
+# tamanho de um pixel. Polígonos inteiros dentro do imóvel usam a área gravada
+# na construção; só os da borda passam pela interseção.
+import json
+import os
+import threading
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+import shapely
+from flask import current_app
+from pyproj import CRS
+from rasterio import features
+from rasterio.windows import Window
+from shapely import STRtree
+from shapely.geometry import box, shape
+
+from . import metricas, projecao, utils
+
+# Albers equivalente do IBGE (SIRGAS 2000 / Brazil Albers), sem depender de um código EPSG/ESRI
+CRS_AREA = CRS.from_proj4("+proj=aea +lat_0=-12 +lon_0=-54 +lat_1=-2 +lat_2=-22 +x_0=5000000 +y_0=10000000 +ellps=GRS80 +units=m +no_defs")
+TAMANHO_JANELA = 2048  # Lado (pixels) das janelas lidas na poligonização
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def ativo():
+    return current_app.config['PRODES_ENGINE'] == 'vetorial'
+
+
+def areas_m2(geometrias_4674):
+    """Área (m²) de cada geometria em EPSG:4674, na projeção equivalente CRS_AREA (vetorizado)."""
+    return shapely.area(projecao.reprojetar_geometria(geometrias_4674, projecao.SIRGAS2000, CRS_AREA))
+
+
+# --- Construção ---
+def _poligonos_janela(src, janela):
+    """(geometrias no CRS do raster, anos) das manchas de desmatamento da janela."""
+    valores = src.read(1, window=janela)
+    desmatado = (valores >= 1) & (valores <= 23)
+    if not desmatado.any():
+        return [], []
+    geometrias, anos = [], []
+    for geojson, valor in features.shapes(valores, mask=desmatado, transform=src.window_transform(janela)):
+        geometrias.append(shape(geojson))
+        anos.append(utils.get_prodes_year_from_value(valor))
+    return geometrias, anos
+
+
+def poligonizar(caminho_raster, destino, versao, tamanho_janela=TAMANHO_JANELA, progresso=None):
+    """Grava em `destino` (GeoParquet, substituído de forma atômica) os polígonos de desmatamento do raster.
+
+    O raster é lido em janelas; manchas cortadas pela borda de uma janela
+    viram polígonos separados, o que não altera as somas de área. Retorna o
+    número de polígonos gravados.
+    """
+    from .carteira import SaidaGeoParquet
+    os.makedirs(os.path.dirname(os.path.abspath(destino)), exist_ok=True)
+    total = 0
+    with rasterio.open(caminho_raster) as src:
+        janelas = [Window(coluna, linha, min(tamanho_janela, src.width - coluna), min(tamanho_janela, src.height - linha))
+                   for linha in range(0, src.height, tamanho_janela) for coluna in range(0, src.width, tamanho_janela)]
+        saida = SaidaGeoParquet(destino, metadados={
+            'versao': versao,
+            'raster': os.path.basename(caminho_raster),
+            'limites_4674': list(projecao.reprojetar_limites(src.bounds, src.crs, projecao.SIRGAS2000)),
+        })
+        try:
+            for i, janela in enumerate(janelas, start=1):
+                geometrias, anos = _poligonos_janela(src, janela)
+                if geometrias or (total == 0 and i == len(janelas)): # Sem nenhum polígono: grava o arquivo vazio
+                    geometrias = projecao.reprojetar_geometria(np.array(geometrias, dtype=object), src.crs, projecao.SIRGAS2000)
+                    saida.escrever(gpd.GeoDataFrame({'ano': np.array(anos, dtype=np.int16), 'area_m2': areas_m2(geometrias)},
+                                                    geometry=gpd.GeoSeries(geometrias, crs=projecao.SIRGAS2000)))
+                    total += len(geometrias)
+                if progresso:
+                    progresso(i, len(janelas), total)
+        except BaseException:
+            saida.descartar()
+            raise
+    saida.fechar() # Grava num arquivo temporário e o renomeia para `destino`
+    return total
+
+
+# --- Consulta ---
+class IndicePoligonosProdes:
+    """STRtree dos polígonos de desmatamento de uma versão do PRODES (EPSG:4674)."""
+
+    def __init__(self, caminho):
+        import pyarrow.parquet as pq
+        self.caminho = caminho
+        stat = os.stat(caminho)
+        self.assinatura = (stat.st_mtime_ns, stat.st_size)
+        tabela = pq.read_table(caminho)
+        metadados = json.loads(tabela.schema.metadata[b'selodemap'])
+        coluna = json.loads(tabela.schema.metadata[b'geo'])['primary_column']
+        self.versao = metadados['versao']
+        self.limites = box(*metadados['limites_4674'])
+        self.anos = tabela.column('ano').to_numpy()
+        self.areas_m2 = tabela.column('area_m2').to_numpy()
+        self.geometrias = shapely.from_wkb(tabela.column(coluna).to_numpy(zero_copy_only=False))
+        self.arvore = STRtree(self.geometrias)
+
+    def desmatamento_m2(self, geometria_4674):
+        """{ano: área desmatada (m²)} dentro da geometria (EPSG:4674)."""
+        shapely.prepare(geometria_4674) # Os testes contra cada polígono candidato reaproveitam a geometria preparada
+        indices = self.arvore.query(geometria_4674, predicate='intersects')
+        if indices.size == 0:
+            return {}
+        areas = self.areas_m2[indices].copy()
+        borda = ~shapely.contains_properly(geometria_4674, self.geometrias[indices])
+        if borda.any():
+            areas[borda] = areas_m2(shapely.intersection(self.geometrias[indices[borda]], geometria_4674))
+        anos = self.anos[indices]
+        return {int(ano): float(area) for ano, area in zip(*_somar_por_ano(anos, areas)) if area > 0}
+
+    def __len__(self):
+        return len(self.geometrias)
+
+
+def _somar_por_ano(anos, areas):
+    unicos, posicoes = np.unique(anos, return_inverse=True)
+    return unicos, np.bincount(posicoes, weights=areas)
+
+
+def get_indice(caminho):
+    """Índice do processo (recarregado se o arquivo foi reconstruído), ou None se não existir."""
+    global _indice
+    if not caminho or not os.path.exists(caminho):
+        return None
+    stat = os.stat(caminho)
+    chave = (caminho, (stat.st_mtime_ns, stat.st_size))
+    indice = _indice
+    if indice is not None and (indice.caminho, indice.assinatura) == chave:
+        return indice
+    with _indice_lock:
+        indice = _indice
+        if indice is None or (indice.caminho, indice.assinatura) != chave:
+            indice = _indice = IndicePoligonosProdes(caminho)
+    return indice
+
+
+def prodes_imovel(imovel_car_data, versao):
+    """Resultado PRODES pelo motor vetorial, ou None se não puder ser calculado (cai no rasterio)."""
+    caminho = current_app.config['PRODES_VETORIAL_FILE']
+    indice = get_indice(caminho)
+    if indice is None:
+        current_app.logger.warning(f"Motor PRODES vetorial sem índice ({caminho}), usando o raster local.")
+        return None
+    if indice.versao != versao:
+        current_app.logger.warning(f"Índice PRODES vetorial da versão '{indice.versao}' (atual: '{versao}'), usando o raster local. "
+                                   "Reconstrua com: flask --app run poligonizar-prodes")
+        return None
+    geometria = imovel_car_data.get('geometry')
+    if not geometria or not geometria.is_valid:
+        return None # O caminho do raster devolve o aviso de geometria inválida
+    na_area = geometria.intersects(indice.limites)
+    desmatamento_ha = {}
+    if na_area:
+        with metricas.cronometro('prodes_vetorial'):
+            desmatamento_m2 = indice.desmatamento_m2(geometria)
+        desmatamento_ha = {ano: area / 10000 for ano, area in desmatamento_m2.items() if area / 10000 > 0.001}
+    return {
+        'valores': None,
+        'desmatamento_ha': desmatamento_ha,
+        'transform': None,
+        'crs': None,
+        'na_area': na_area,
+        'aviso': None if na_area else "Imóvel fora da área do raster PRODES.",
+    }
@@ -0,0 +1,80 @@
+# SeloDeMap/app/projecao.py
+# Reprojeção de geometrias Shapely, pontos e bounds sem GeoDataFrames.
+#
+# Criar um GeoDataFrame de uma linha só para chamar to_crs reconstrói os
+# objetos CRS e o pipeline PROJ a cada chamada. Aqui os Transformers ficam num
+# cache do processo, por par (origem, destino), e as coordenadas de uma
+# geometria são transformadas de uma vez (vetorizado) com shapely.transform.
+# Transformers do pyproj >= 3.1 podem ser usados por várias threads.
+import os
+import threading
+
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+
+WGS84 = "EPSG:4326"
+SIRGAS2000 = "EPSG:4674"  # CRS do CAR e dos limites do IBGE
+
+_transformers = {}  # {(origem, destino): Transformer ou None se os CRS são equivalentes}
+_transformers_lock = threading.Lock()
+_transformers_pid = os.getpid()
+
+
+def _chave_crs(crs):
+    """Chave hashable para CRS em texto ('EPSG:4674'), pyproj ou rasterio."""
+    if isinstance(crs, str):
+        return crs.upper()
+    if hasattr(crs, 'to_wkt'):
+        return crs.to_wkt()
+    return str(crs)
+
+
+def get_transformer(origem, destino):
+    """Transformer (x=lon, y=lat) de `origem` para `destino`, ou None se os CRS são equivalentes."""
+    global _transformers, _transformers_pid
+    chave = (_chave_crs(origem), _chave_crs(destino))
+    if _transformers_pid == os.getpid():
+        try:
+            return _transformers[chave]
+        except KeyError:
+            pass
+    with _transformers_lock:
+        if _transformers_pid != os.getpid():
+            # Processo filho de um fork: contextos PROJ (e o proj.db aberto) herdados não são reutilizados
+            _transformers, _transformers_pid = {}, os.getpid()
+        if chave not in _transformers:
+            crs_origem, crs_destino = CRS.from_user_input(chave[0]), CRS.from_user_input(chave[1])
+            _transformers[chave] = None if crs_origem == crs_destino else \
+                Transformer.from_crs(crs_origem, crs_destino, always_xy=True)
+        return _transformers[chave]
+
+
+def mesmo_crs(origem, destino):
+    return get_transformer(origem, destino) is None
+
+
+def reprojetar_ponto(x, y, origem, destino):
+    transformer = get_transformer(origem, destino)
+    return (x, y) if transformer is None else transformer.transform(x, y)
+
+
+def reprojetar_geometria(geometria, origem, destino):
+    """Reprojeta uma geometria (ou array de geometrias) Shapely; todas as coordenadas numa chamada ao PROJ."""
+    transformer = get_transformer(origem, destino)
+    if transformer is None:
+        return geometria
+
+    def _transformar(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack((x, y))
+
+    return shapely.transform(geometria, _transformar)
+
+
+def reprojetar_limites(limites, origem, destino, pontos_densificacao=21):
+    """(minx, miny, maxx, maxy) reprojetado, densificando as bordas como rasterio.warp.transform_bounds."""
+    transformer = get_transformer(origem, destino)
+    if transformer is None:
+        return tuple(limites)
+    return transformer.transform_bounds(*limites, densify_pts=pontos_densificacao)
@@ -0,0 +1,129 @@
+# SeloDeMap/app/raster.py
+# Acesso ao raster PRODES: handles de dataset reaproveitados entre requisições
+# e conversão para Cloud-Optimized GeoTIFF (COG).
+#
+# Abrir o arquivo a cada requisição custa abertura, leitura do cabeçalho e
+# das tabelas de blocos. Aqui os datasets ficam abertos por worker; como um
+# dataset rasterio não deve ser usado por duas threads ao mesmo tempo, cada
+# requisição pega um handle emprestado e o devolve ao final.
+import os
+import threading
+from contextlib import contextmanager
+
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+MAX_HANDLES_OCIOSOS = 8  # Por (arquivo, overview): ~ número de threads do worker
+
+
+class _HandlesDataset:
+    """Handles ociosos de um (arquivo, overview), invalidados quando o arquivo muda."""
+
+    def __init__(self):
+        self.ociosos = []
+        self.versao = None
+
+
+_handles = {}
+_handles_lock = threading.Lock()
+_handles_pid = os.getpid()
+
+
+def _versao_arquivo(caminho):
+    stat = os.stat(caminho)
+    return stat.st_mtime_ns, stat.st_size
+
+
+@contextmanager
+def dataset(caminho, overview_level=None):
+    """Empresta um dataset aberto de `caminho` (ou de uma overview) para esta thread.
+
+    Uso: `with raster.dataset(path) as src: ...` - o handle volta ao pool ao sair.
+    """
+    global _handles, _handles_pid
+    versao = _versao_arquivo(caminho)
+    chave = (caminho, overview_level)
+    src = None
+    with _handles_lock:
+        if _handles_pid != os.getpid():
+            # Processo filho de um fork: handles GDAL herdados não são reutilizados
+            _handles, _handles_pid = {}, os.getpid()
+        grupo = _handles.setdefault(chave, _HandlesDataset())
+        if grupo.versao != versao:
+            # Arquivo substituído: os handles antigos são descartados
+            antigos, grupo.ociosos, grupo.versao = grupo.ociosos, [], versao
+        else:
+            antigos = []
+            if grupo.ociosos:
+                src = grupo.ociosos.pop()
+    for antigo in antigos:
+        antigo.close()
+    if src is None:
+        kwargs = {'overview_level': overview_level} if overview_level is not None else {}
+        src = rasterio.open(caminho, **kwargs)
+
+    try:
+        yield src
+    finally:
+        with _handles_lock:
+            grupo = _handles.get(chave)
+            devolver = grupo is not None and grupo.versao == versao and len(grupo.ociosos) < MAX_HANDLES_OCIOSOS
+            if devolver:
+                grupo.ociosos.append(src)
+        if not devolver:
+            src.close()
+
+
+def aquecer(caminho):
+    """Abre (e devolve ao pool) um handle do arquivo, lendo cabeçalho e overviews antecipadamente."""
+    with dataset(caminho) as src:
+        src.overviews(1)
+
+
+def info_layout(caminho):
+    """Resumo da organização interna do arquivo (blocos, compressão, overviews)."""
+    with rasterio.open(caminho) as src:
+        return {
+            'tamanho': (src.width, src.height),
+            'blocos': src.block_shapes[0],
+            'tiled': src.profile.get('tiled', False),
+            'compressao': src.compression.value if src.compression else None,
+            'overviews': src.overviews(1),
+        }
+
+
+def converter_para_cog(origem, destino, tamanho_bloco=512, compressao='DEFLATE'):
+    """Reescreve o raster PRODES como COG: blocos internos, compressão e overviews.
+
+    Overviews com vizinho mais próximo, pois os valores são classes.
+    """
+    if os.path.abspath(origem) == os.path.abspath(destino):
+        raise ValueError("Origem e destino do COG devem ser arquivos diferentes.")
+    os.makedirs(os.path.dirname(os.path.abspath(destino)), exist_ok=True)
+    destino_tmp = destino + '.tmp'
+    if _tem_driver('COG'):
+        rasterio.shutil.copy(
+            origem, destino_tmp, driver='COG',
+            BLOCKSIZE=tamanho_bloco, COMPRESS=compressao, PREDICTOR='NO',
+            RESAMPLING='NEAREST', OVERVIEW_RESAMPLING='NEAREST', BIGTIFF='IF_SAFER',
+        )
+    else:
+        # GDAL < 3.1 (sem driver COG): GTiff em blocos + overviews internas
+        with rasterio.open(origem) as src:
+            perfil = src.profile.copy()
+            perfil.update(driver='GTiff', tiled=True, blockxsize=tamanho_bloco, blockysize=tamanho_bloco,
+                          compress=compressao.lower(), bigtiff='IF_SAFER')
+            with rasterio.open(destino_tmp, 'w', **perfil) as dst:
+                for _, janela in src.block_windows(1):
+                    dst.write(src.read(window=janela), window=janela)
+                fatores = [f for f in (2, 4, 8, 16, 32, 64) if min(src.width, src.height) / f >= tamanho_bloco / 4]
+                dst.build_overviews(fatores or [2], Resampling.nearest)
+                dst.update_tags(ns='rio_overview', resampling='nearest')
+    os.replace(destino_tmp, destino)
+    return info_layout(destino)
+
+
+def _tem_driver(nome):
+    with rasterio.Env() as env:
+        return nome in env.drivers()
@@ -1,153 +1,82 @@
 # app/routes.py
-from flask import render_template, request, jsonify, current_app
+from flask import render_template, request, jsonify, current_app, Response, abort, stream_with_context
 from . import utils # Importa as funções de utils.py
-from shapely.geometry import mapping # Para converter geometria Shapely para formato GeoJSON
-import geopandas as gpd # Para manipulação de geometrias e CRS
+from . import analise, aquecimento, cache_analise, catalogo_prodes, colormap, db, etapas, lote, mapa, metricas, projecao, tiles, vizinhos
 import folium
-from folium import plugins
-import numpy as np
 import json # Para lidar com GeoJSON
 
 # Função auxiliar para renderizar mapa Folium como HTML string
-def render_map_html(m):
-    """Converte um objeto de mapa Folium para sua representação HTML."""
-    return m._repr_html_()
+def render_map_html(m, legenda_prodes=False):
+    """HTML do mapa Folium (esqueleto em cache + camadas da requisição + controle de camadas)."""
+    with metricas.cronometro('render_mapa'):
+        return mapa.renderizar(m, legenda_prodes)
 
 @current_app.route('/')
 def index():
     """Rota principal que renderiza a página inicial (index.html)."""
     return render_template('index.html')
 
-@current_app.route('/analisar', methods=['POST'])
-def analisar_propriedade():
-    """
-    Rota principal para análise. Recebe dados do formulário, processa
-    e retorna um JSON com o HTML do mapa e outras informações.
-    """
-    data_form = request.form
-    input_type = data_form.get('inputType')
-    current_app.logger.info(f"Requisição de análise recebida. Tipo: {input_type}, Dados: {data_form}")
+@current_app.route('/status/db')
+def status_db():
+    """Métricas do pool de conexões do worker (tempo de espera, conexões em uso...)."""
+    return jsonify(db.get_pool().metricas())
 
-    lat, lon, car_code_input = None, None, None
-    imovel_car_data, estado_data = None, None
-    map_center_lat, map_center_lon = None, None
-    error_message_pipeline = [] # Lista para acumular erros/avisos
+@current_app.route('/status/pronto')
+def status_pronto():
+    """Prontidão do worker: 200 depois do aquecimento (app/aquecimento.py), 503 antes."""
+    situacao = aquecimento.situacao()
+    return jsonify(situacao), 200 if situacao['pronto'] else 503
 
-    # 1. Obter Estado e Imóvel CAR com base na entrada
-    # ----------------------------------------------------
-    if input_type == 'coords' or input_type == 'mapselect':
-        try:
-            # Converter explicitamente para float e garantir precisão
-            lat = float(data_form.get('latitude'))
-            lon = float(data_form.get('longitude'))
-            
-            # Validar limites das coordenadas
-            if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
-                return jsonify({"error": "Coordenadas fora dos limites válidos."}), 400
-                
-            map_center_lat, map_center_lon = lat, lon
-            current_app.logger.info(f"Coordenadas processadas: Lat={lat}, Lon={lon}")
-        except (TypeError, ValueError) as e:
-            current_app.logger.error(f"Erro ao processar coordenadas: {e}")
-            return jsonify({"error": "Coordenadas inválidas fornecidas."}), 400
-        
-        estado_data, err_est = utils.get_estado_from_coords(lat, lon)
-        if err_est:
-            error_message_pipeline.append(f"Estado: {err_est}")
-            # Mesmo sem estado, podemos tentar seguir se tivermos o imóvel de outra forma
-            # ou podemos parar aqui dependendo da lógica desejada.
-            # Por enquanto, vamos registrar e continuar se possível.
-            current_app.logger.warning(f"Erro ao obter estado por coords: {err_est}")
-        
-        if estado_data and estado_data.get('sigla_uf'):
-            imovel_car_data, err_car = utils.get_imovel_car_from_coords(lat, lon, estado_data['sigla_uf'])
-            if err_car:
-                error_message_pipeline.append(f"Imóvel CAR: {err_car}")
-                current_app.logger.warning(f"Erro ao obter CAR por coords: {err_car}")
-        else:
-            # Não foi possível determinar a UF para buscar o CAR
-            msg = "Não foi possível determinar a UF para buscar o imóvel CAR por coordenadas."
-            error_message_pipeline.append(msg)
-            current_app.logger.warning(msg)
-
-    elif input_type == 'car_code':
-        car_code_input = data_form.get('car_code')
-        estado_sigla_form = data_form.get('estado_sigla_car', 'MS') # Default para MS ou o estado selecionado
+@current_app.route('/status/cache')
+def status_cache():
+    """Hits/misses dos caches do worker (resultados de análise, coordenadas, tiles)."""
+    caches = cache_analise.metricas()
+    cache_tiles = tiles.get_cache_tiles(current_app.config['PRODES_TILE_CACHE_SIZE'])
+    caches['tiles'] = {'memoria': {'itens': len(cache_tiles), 'hits': cache_tiles.hits, 'misses': cache_tiles.misses}}
+    return jsonify(caches)
 
-        if not car_code_input:
-            return jsonify({"error": "Código CAR não fornecido."}), 400
-        
-        imovel_car_data, err_car = utils.get_imovel_car_from_code(car_code_input, estado_sigla_form)
-        if err_car:
-            return jsonify({"error": f"Imóvel CAR: {err_car}"}), 500 # Erro crítico se o CAR não for encontrado
-        if not imovel_car_data:
-             return jsonify({"error": f"Código CAR '{car_code_input}' não encontrado para UF '{estado_sigla_form}'."}), 404
-
-        # Se o CAR foi encontrado, pegar o centroide para o mapa e tentar obter o estado
-        if imovel_car_data.get('geometry'):
-            centroid = imovel_car_data['geometry'].centroid
-            map_center_lat, map_center_lon = centroid.y, centroid.x
-            
-            estado_data, err_est = utils.get_estado_from_coords(map_center_lat, map_center_lon)
-            if err_est:
-                error_message_pipeline.append(f"Estado (via centroide CAR): {err_est}")
-                current_app.logger.warning(f"Erro ao obter estado pelo centroide do CAR: {err_est}")
-        else:
-            # Se não tem geometria, não podemos centralizar o mapa ou obter estado por geo.
-            # O front-end precisará de um fallback.
-            error_message_pipeline.append("Imóvel CAR encontrado, mas sem geometria para definir centro do mapa.")
+@current_app.route('/metrics')
+def metrics():
+    """Métricas do worker no formato do Prometheus (etapas, operações, HTTP, erros, caches, pool)."""
+    return Response(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
+@current_app.route('/tiles/prodes/<int:z>/<int:x>/<int:y>.png')
+def tile_prodes(z, x, y):
+    """Tile XYZ (Web Mercator) do raster PRODES colorido com a paleta PRODES."""
+    if not tiles.tile_valido(z, x, y):
+        abort(404)
+    # Mesma fonte do recorte: o catálogo de tiles, se existir, ou o arquivo único
+    fonte = catalogo_prodes.get_catalogo(current_app.config['PRODES_CATALOGO'])
+    if fonte is not None:
+        versao = fonte.versao
     else:
-        return jsonify({"error": "Tipo de entrada inválido."}), 400
+        fonte = current_app.config['PRODES_FILE_MS_RECORTE']
+        try:
+            versao = utils.prodes_dataset_version(fonte)
+        except OSError:
+            abort(404)
+    png = tiles.obter_tile(fonte, versao, z, x, y,
+                           max_cache=current_app.config['PRODES_TILE_CACHE_SIZE'],
+                           dir_cache=current_app.config['PRODES_TILE_CACHE_DIR'])
+    resposta = Response(png, mimetype='image/png')
+    resposta.headers['Cache-Control'] = 'public, max-age=86400'
+    return resposta
 
+def _centro_mapa(input_type, lat, lon, imovel_car_data):
+    """(lat, lon, zoom) iniciais do mapa conforme a entrada e o imóvel encontrado."""
+    if input_type in ('coords', 'mapselect'):
+        return lat, lon, 14  # Zoom mais próximo para coordenada específica
+    if imovel_car_data and imovel_car_data.get('geometry'):
+        centroid = imovel_car_data['geometry'].centroid
+        return centroid.y, centroid.x, 12
     # Se não conseguimos definir um centro para o mapa, usar um padrão (ex: centro do Brasil)
-    if map_center_lat is None or map_center_lon is None:
-        map_center_lat, map_center_lon = -15.7801, -47.9292 # Brasília
-        zoom_inicial = 4
-        if not imovel_car_data: # Se nem o CAR foi achado, é um erro mais sério.
-             return jsonify({"error": "Não foi possível processar a requisição. Verifique os dados de entrada.", "details": error_message_pipeline}), 400
-    else:
-        # Ajustar zoom baseado no tipo de entrada e se encontrou imóvel
-        if input_type in ['coords', 'mapselect']:
-            zoom_inicial = 14  # Zoom mais próximo para coordenada específica
-        else:
-            zoom_inicial = 12 if imovel_car_data else 8  # Zoom para CAR ou área geral
-
-    # 2. Preparar dados para o mapa Folium
-    # -------------------------------------
-    m = folium.Map(
-        location=[map_center_lat, map_center_lon],
-        zoom_start=zoom_inicial,
-        tiles=None  # Inicializa sem tiles para adicionar múltiplas camadas
-    )
-
-    # Adicionar diferentes camadas base
-    folium.TileLayer(
-        'openstreetmap',
-        name='OpenStreetMap',
-        control=True
-    ).add_to(m)
-
-    folium.TileLayer(
-        'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-        attr='Esri World Imagery',
-        name='Imagem de Satélite',
-        control=True
-    ).add_to(m)
-
-    folium.TileLayer(
-        'https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}',
-        attr='Google Satellite',
-        name='Google Satellite',
-        control=True
-    ).add_to(m)
-
-    folium.TileLayer(
-        'https://mt1.google.com/vt/lyrs=m&x={x}&y={y}&z={z}',
-        attr='Google Maps',
-        name='Google Maps',
-        control=True
-    ).add_to(m)
+    return -15.7801, -47.9292, 4 # Brasília
+
+def _montar_mapa_base(input_type, lat, lon, imovel_car_data, estado_data):
+    """Mapa Folium com as camadas base, o marcador, o estado e o imóvel (sem PRODES)."""
+    map_center_lat, map_center_lon, zoom_inicial = _centro_mapa(input_type, lat, lon, imovel_car_data)
+    # Camadas base, legenda e JS/CSS do Leaflet vêm do esqueleto em cache (app/mapa.py)
+    m = mapa.novo_mapa(map_center_lat, map_center_lon, zoom_inicial)
 
     # Adicionar marcador do ponto de interesse/centroide
     if lat and lon and (input_type == 'coords' or input_type == 'mapselect'):
@@ -159,7 +88,7 @@ def analisar_propriedade():
             popup=popup_texto,
             icon=folium.Icon(color="red", icon="info-sign")
         ).add_to(m)
-    elif map_center_lat and map_center_lon and input_type == 'car_code':
+    elif imovel_car_data and input_type == 'car_code':
         popup_texto = f"Centroide do Imóvel<br>CAR: {imovel_car_data['cod_imovel']}"
         folium.Marker(
             [map_center_lat, map_center_lon],
@@ -169,77 +98,87 @@ def analisar_propriedade():
 
     # Adicionar camada do Estado (se disponível)
     if estado_data and estado_data.get('geometry'):
+        # Limite simplificado conforme o zoom: só o contorno é desenhado
         folium.GeoJson(
-            estado_data['geometry'].__geo_interface__,
+            utils.geometria_estado_exibicao(estado_data, zoom_inicial).__geo_interface__,
             name=f"Estado: {estado_data.get('nome_uf', 'N/D')}",
             style_function=lambda x: {"color": "blue", "weight": 1.5, "fillOpacity": 0.1, "fillColor": "lightblue"}
         ).add_to(m)
 
     # Adicionar camada do Imóvel CAR (se disponível)
     if imovel_car_data and imovel_car_data.get('geometry'):
-        imovel_geom_shapely = imovel_car_data['geometry']
-        imovel_gdf = gpd.GeoDataFrame([{'id':1, 'geometry': imovel_geom_shapely}], crs="EPSG:4674")
-        imovel_gdf_4326 = imovel_gdf.to_crs("EPSG:4326")
-        
+        imovel_geom_4326 = projecao.reprojetar_geometria(utils.geometria_exibicao(imovel_car_data), projecao.SIRGAS2000, projecao.WGS84)
         folium.GeoJson(
-            imovel_gdf_4326.geometry.iloc[0].__geo_interface__,
+            imovel_geom_4326.__geo_interface__,
             name=f"Imóvel CAR: {imovel_car_data.get('cod_imovel', 'N/D')}",
             style_function=lambda x: {"color": "yellow", "weight": 2.5, "fillOpacity": 0.2, "fillColor": "yellow"}
         ).add_to(m)
+    return m
 
-    # 3. Análise PRODES (se o imóvel CAR foi encontrado)
-    # -------------------------------------------------
-    desmatamento_data_display, desmatamento_areas_ha, prodes_transform, prodes_crs, err_prodes = None, {}, None, None, None
-    if imovel_car_data and imovel_car_data.get('geometry'):
-        desmatamento_data_display, desmatamento_areas_ha, prodes_transform, prodes_crs, err_prodes = \
-            utils.analyze_prodes_recorter(imovel_car_data['geometry'])
-        
-        if err_prodes:
-            error_message_pipeline.append(f"PRODES: {err_prodes}")
-            current_app.logger.warning(f"Erro/Aviso na análise PRODES: {err_prodes}")
-
-        if desmatamento_data_display is not None and desmatamento_data_display.size > 0 and prodes_transform is not None:
-            # Obter os bounds do raster recortado NO CRS DO RASTER
-            height_raster, width_raster = desmatamento_data_display.shape[-2:] # Últimas duas dimensões são altura e largura
-
-            # Cantos do raster no seu CRS original (prodes_crs)
-            ul_raster_x, ul_raster_y = prodes_transform * (0, 0)
-            lr_raster_x, lr_raster_y = prodes_transform * (width_raster, height_raster)
-
-            # Criar um GeoDataFrame para a bounding box do raster e reprojetar para EPSG:4326 para o Folium
-            from shapely.geometry import box
-            raster_bbox_geom_original_crs = box(ul_raster_x, lr_raster_y, lr_raster_x, ul_raster_y) # minx, miny, maxx, maxy
-            raster_bbox_gdf = gpd.GeoDataFrame([{'id':1, 'geometry': raster_bbox_geom_original_crs}], crs=prodes_crs)
-            raster_bbox_gdf_4326 = raster_bbox_gdf.to_crs("EPSG:4326")
-            
-            # Bounds para ImageOverlay: [[min_lat, min_lon], [max_lat, max_lon]]
-            # total_bounds retorna (minx, miny, maxx, maxy) que é (min_lon, min_lat, max_lon, max_lat) para EPSG:4326
-            bounds_4326 = raster_bbox_gdf_4326.total_bounds
-            image_overlay_bounds = [[bounds_4326[1], bounds_4326[0]], [bounds_4326[3], bounds_4326[2]]]
-            
-            # Garantir que desmatamento_data_display é float32 ou uint8 e não tem NaNs problemáticos
-            # Se o nodata do PRODES (ex: 255) foi usado no mask, ele estará no array.
-            # O colormap precisa lidar com esse valor de nodata.
-            # Se houver NaNs reais, ImageOverlay pode falhar.
-            if np.issubdtype(desmatamento_data_display.dtype, np.floating) and np.isnan(desmatamento_data_display).any():
-                current_app.logger.info("Substituindo NaNs no raster PRODES por 0 para ImageOverlay.")
-                desmatamento_data_display = np.nan_to_num(desmatamento_data_display, nan=0) # Substitui NaN por 0 (ou outro valor de nodata que seu colormap trate)
-            
-            # ImageOverlay espera uma matriz 2D (altura, largura) ou 3D (altura, largura, bandas)
-            # Nosso desmatamento_data_display já é 2D (vindo da banda 0 do mask)
-            if desmatamento_data_display.ndim == 2:
-                 folium.raster_layers.ImageOverlay(
-                    image=desmatamento_data_display.astype(np.float32), # Assegurar tipo compatível
-                    bounds=image_overlay_bounds,
-                    opacity=0.7,
-                    colormap=utils.prodes_colormap_folium, # Sua função de colormap
-                    name="Desmatamento PRODES (Recorte)"
-                ).add_to(m)
-            else:
-                current_app.logger.warning(f"Raster PRODES para ImageOverlay não é 2D. Shape: {desmatamento_data_display.shape}")
-
-
-    # Tabela de áreas desmatadas PRODES
+def _adicionar_camada_prodes(m, prodes, imovel_car_data, tiles_url):
+    """Camada PRODES (tiles ou ImageOverlay do recorte), se há pixels PRODES no imóvel.
+
+    Retorna True se o mapa deve exibir a legenda PRODES.
+    """
+    if not prodes or not prodes['na_area']:
+        return False
+    desmatamento_data_display, prodes_transform, prodes_crs = prodes['valores'], prodes['transform'], prodes['crs']
+    if desmatamento_data_display is None:
+        # Bounds do imóvel (EPSG:4674, indistinguível de EPSG:4326 na escala do mapa)
+        min_lon, min_lat, max_lon, max_lat = imovel_car_data['geometry'].bounds
+        image_overlay_bounds = [[min_lat, min_lon], [max_lat, max_lon]]
+    else:
+        # Obter os bounds do raster recortado NO CRS DO RASTER
+        height_raster, width_raster = desmatamento_data_display.shape[-2:] # Últimas duas dimensões são altura e largura
+
+        # Cantos do raster no seu CRS original (prodes_crs)
+        ul_raster_x, ul_raster_y = prodes_transform * (0, 0)
+        lr_raster_x, lr_raster_y = prodes_transform * (width_raster, height_raster)
+
+        # Reprojetar a bounding box do raster (minx, miny, maxx, maxy) para EPSG:4326 para o Folium
+        bounds_4326 = projecao.reprojetar_limites((ul_raster_x, lr_raster_y, lr_raster_x, ul_raster_y), prodes_crs, projecao.WGS84)
+
+        # Bounds para ImageOverlay: [[min_lat, min_lon], [max_lat, max_lon]]
+        image_overlay_bounds = [[bounds_4326[1], bounds_4326[0]], [bounds_4326[3], bounds_4326[2]]]
+
+    if current_app.config['PRODES_OVERLAY_MODO'] == 'tiles':
+        # Camada de tiles servida por /tiles/prodes: o HTML do mapa não carrega
+        # pixels e imóveis vizinhos reaproveitam os mesmos tiles em cache.
+        mapa.camada_tiles(
+            tiles_url,
+            'PRODES/INPE',
+            "Desmatamento PRODES",
+            overlay=True,
+            control=True,
+            opacity=0.7,
+            bounds=image_overlay_bounds, # Só pede tiles na região do imóvel
+        ).add_to(m)
+    # ImageOverlay espera uma matriz 2D (altura, largura) ou 3D (altura, largura, bandas)
+    # Nosso desmatamento_data_display já é 2D (vindo da banda 0 do mask)
+    elif desmatamento_data_display.ndim == 2:
+        # PNG indexado gerado com a paleta PRODES pré-calculada (evita o colormap
+        # pixel a pixel do Folium); NaNs/nodata ficam transparentes.
+        with metricas.cronometro('colormap'):
+            overlay_url = colormap.prodes_overlay_url(
+                desmatamento_data_display,
+                utils.versao_prodes_atual(),
+                prodes_transform,
+                chave_extra=imovel_car_data.get('cod_imovel'),
+                max_cache=current_app.config['PRODES_PNG_CACHE_SIZE'],
+            )
+        folium.raster_layers.ImageOverlay(
+            image=overlay_url,
+            bounds=image_overlay_bounds,
+            opacity=0.7,
+            name="Desmatamento PRODES (Recorte)"
+        ).add_to(m)
+    else:
+        current_app.logger.warning(f"Raster PRODES para ImageOverlay não é 2D. Shape: {desmatamento_data_display.shape}")
+
+    return True # Legenda PRODES (mapa.LEGENDA_PRODES_HTML)
+
+def _tabela_desmatamento_html(desmatamento_areas_ha):
+    """Tabela de áreas desmatadas PRODES por ano."""
     tabela_desmatamento_html = "<p>Análise PRODES não disponível ou nenhum desmatamento detectado no recorte.</p>"
     if desmatamento_areas_ha:
         tabela_desmatamento_html = """
@@ -250,48 +189,364 @@ def analisar_propriedade():
         for year, area in sorted(desmatamento_areas_ha.items()):
             tabela_desmatamento_html += f"<tr><td style='padding:2px;'>{year}</td><td style='padding:2px;'>{area:.2f}</td></tr>"
         tabela_desmatamento_html += "</tbody></table></div>"
-    
-    # Legenda PRODES (simplificada)
-    legend_html_prodes = """
-     <div style='position: fixed; 
-                bottom: 50px; 
-                left: 10px; 
-                width: auto; 
-                max-width:200px;
-                border:2px solid grey; 
-                z-index:9999; 
-                background-color:white; 
-                opacity:0.85; 
-                padding: 10px;
-                font-size:12px;
-                border-radius: 5px;
-                box-shadow: 0 0 15px rgba(0,0,0,0.2);'>
-       <div style='text-align:center; margin-bottom:5px;'><b>Legenda PRODES</b></div>
-       <div style='margin-bottom:3px;'><i style='background: linear-gradient(to right, #FFFF00, #FF0000); display:inline-block; width:30px; height:15px; margin-right:5px;'></i> Desmatamento (2000-2023)</div>
-       <div style='margin-bottom:3px;'><i style='background:#008000; display:inline-block; width:30px; height:15px; margin-right:5px;'></i> Vegetação Nativa</div>
-       <div style='margin-bottom:3px;'><i style='background:#A52A2A; display:inline-block; width:30px; height:15px; margin-right:5px;'></i> Não Floresta</div>
-       <div style='margin-bottom:3px;'><i style='background:#00BFFF; display:inline-block; width:30px; height:15px; margin-right:5px;'></i> Hidrografia</div>
-       <div style='margin-bottom:3px;'><i style='background:#D3D3D3; display:inline-block; width:30px; height:15px; margin-right:5px;'></i> Nuvem/Outros</div>
-     </div>
+    return tabela_desmatamento_html
+
+def _parametros_vizinhos(params):
+    """(quantidade, distância em m) dos vizinhos pedidos em `vizinhos`/`vizinhos_distancia`, ou erro 400."""
+    config = current_app.config
+    try:
+        quantidade = int(params.get('vizinhos') or 0)
+        distancia_m = float(params.get('vizinhos_distancia') or 0)
+    except (TypeError, ValueError):
+        return None, None, ({"error": "vizinhos e vizinhos_distancia devem ser numéricos."}, 400)
+    if not 0 <= quantidade <= config['VIZINHOS_MAX']:
+        return None, None, ({"error": f"vizinhos deve estar entre 0 e {config['VIZINHOS_MAX']}."}, 400)
+    if not 0 <= distancia_m <= config['VIZINHOS_DISTANCIA_MAX_M']:
+        return None, None, ({"error": f"vizinhos_distancia deve estar entre 0 e {config['VIZINHOS_DISTANCIA_MAX_M']:g} m."}, 400)
+    return quantidade, distancia_m, None
+
+def _preparar_analise(data_form):
+    """Valida a entrada do /analisar e monta as etapas da análise.
+
+    Retorna (contexto, lista de etapas, None) ou (None, None, (erro JSON, status HTTP)).
+    """
+    input_type = data_form.get('inputType')
+    current_app.logger.info(f"Requisição de análise recebida. Tipo: {input_type}, Dados: {data_form}")
+    config = current_app.config
+    tiles_url = request.script_root + '/tiles/prodes/{z}/{x}/{y}.png'
+    lat, lon, car_code_input = None, None, None
+    quantidade_vizinhos, distancia_vizinhos_m, erro = _parametros_vizinhos(data_form)
+    if erro:
+        return None, None, erro
+
+    # 1. Validar a entrada e definir as etapas de Estado e Imóvel CAR
+    # ----------------------------------------------------------------
+    if input_type == 'coords' or input_type == 'mapselect':
+        try:
+            # Converter explicitamente para float e garantir precisão
+            lat = float(data_form.get('latitude'))
+            lon = float(data_form.get('longitude'))
+            
+            # Validar limites das coordenadas
+            if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+                return None, None, ({"error": "Coordenadas fora dos limites válidos."}, 400)
+                
+            current_app.logger.info(f"Coordenadas processadas: Lat={lat}, Lon={lon}")
+        except (TypeError, ValueError) as e:
+            current_app.logger.error(f"Erro ao processar coordenadas: {e}")
+            return None, None, ({"error": "Coordenadas inválidas fornecidas."}, 400)
+
+        def etapa_estado(_):
+            return utils.get_estado_from_coords(lat, lon)
+
+        def etapa_car(_):
+            # Busca na tabela CAR nacional: não depende da UF, roda junto com a etapa 'estado'
+            return analise.buscar_imovel_por_coords(lat, lon)
+
+        etapas_entrada = [
+            etapas.Etapa('estado', etapa_estado, prazo=config['ANALISE_PRAZO_ESTADO']),
+            etapas.Etapa('car', etapa_car, prazo=config['ANALISE_PRAZO_CAR']),
+        ]
+
+    elif input_type == 'car_code':
+        car_code_input = (data_form.get('car_code') or '').strip()
+
+        if not car_code_input:
+            return None, None, ({"error": "Código CAR não fornecido."}, 400)
+        if not utils.sigla_uf_from_car_code(car_code_input): # A UF (partição CAR) vem do prefixo do código
+            return None, None, ({"error": f"Código CAR '{car_code_input}' inválido: deve começar pela sigla da UF (ex: MS-...)."}, 400)
+
+        def etapa_car(_):
+            return analise.buscar_imovel_por_codigo(car_code_input)
+
+        def etapa_estado(entradas):
+            # Estado pelo centroide do imóvel (em paralelo com o PRODES)
+            imovel_car_data = entradas['car'][0]
+            if not imovel_car_data or not imovel_car_data.get('geometry'):
+                return None, None
+            centroid = imovel_car_data['geometry'].centroid
+            return utils.get_estado_from_coords(centroid.y, centroid.x)
+
+        etapas_entrada = [
+            etapas.Etapa('car', etapa_car, prazo=config['ANALISE_PRAZO_CAR']),
+            etapas.Etapa('estado', etapa_estado, dependencias=('car',), prazo=config['ANALISE_PRAZO_ESTADO']),
+        ]
+
+    else:
+        return None, None, ({"error": "Tipo de entrada inválido."}, 400)
+
+    # 2. Etapas PRODES e mapa: a base do mapa é montada enquanto o PRODES é calculado
+    # --------------------------------------------------------------------------------
+    def etapa_prodes(entradas):
+        imovel_car_data = entradas['car'][0]
+        if not imovel_car_data or not imovel_car_data.get('geometry'):
+            return None
+        # Com a camada em tiles os pixels do recorte não são necessários: cache ou tabela pré-calculada bastam
+        return analise.prodes_imovel(imovel_car_data, precisa_pixels=config['PRODES_OVERLAY_MODO'] != 'tiles')
+
+    def etapa_mapa_base(entradas):
+        imovel_car_data = entradas['car'][0] if entradas['car'] else None
+        estado_data = entradas['estado'][0] if entradas['estado'] else None
+        return _montar_mapa_base(input_type, lat, lon, imovel_car_data, estado_data)
+
+    def etapa_mapa(entradas):
+        m = entradas['mapa_base']
+        imovel_car_data = entradas['car'][0] if entradas['car'] else None
+        legenda_prodes = _adicionar_camada_prodes(m, entradas['prodes'], imovel_car_data, tiles_url)
+        return render_map_html(m, legenda_prodes)
+
+    # 3. Vizinhos (opcional): uma consulta KNN e uma leitura PRODES para o grupo, em paralelo com o mapa
+    # ----------------------------------------------------------------------------------------------------
+    def etapa_vizinhos(entradas):
+        imovel_car_data = entradas['car'][0]
+        if not imovel_car_data or not imovel_car_data.get('geometry'):
+            return [], None
+        return vizinhos.analisar_vizinhos(imovel_car_data, quantidade_vizinhos, distancia_vizinhos_m)
+
+    etapas_vizinhos = []
+    if quantidade_vizinhos:
+        etapas_vizinhos.append(etapas.Etapa('vizinhos', etapa_vizinhos, dependencias=('car',),
+                                            prazo=config['ANALISE_PRAZO_VIZINHOS']))
+
+    contexto = {'input_type': input_type, 'lat': lat, 'lon': lon, 'car_code': car_code_input,
+                'vizinhos': bool(quantidade_vizinhos)}
+    return contexto, etapas_entrada + etapas_vizinhos + [
+        etapas.Etapa('prodes', etapa_prodes, dependencias=('car',), prazo=config['ANALISE_PRAZO_PRODES']),
+        etapas.Etapa('mapa_base', etapa_mapa_base, opcionais=('car', 'estado'), prazo=config['ANALISE_PRAZO_MAPA']),
+        etapas.Etapa('mapa', etapa_mapa, dependencias=('mapa_base',), opcionais=('car', 'prodes'),
+                     prazo=config['ANALISE_PRAZO_MAPA']),
+    ], None
+
+def _consolidar_analise(contexto, execucao):
+    """Resultado JSON do /analisar a partir das etapas executadas.
+
+    Retorna (resultado, None) ou (None, (erro JSON, status HTTP)).
     """
-    if desmatamento_data_display is not None and desmatamento_data_display.size > 0:
-        m.get_root().html.add_child(folium.Element(legend_html_prodes))
+    input_type, lat, lon = contexto['input_type'], contexto['lat'], contexto['lon']
+    error_message_pipeline = [] # Lista para acumular erros/avisos
+    imovel_car_data, err_car = execucao.get('car') or (None, None)
+    estado_data, err_est = execucao.get('estado') or (None, None)
+
+    if input_type == 'car_code':
+        if not execucao.ok('car'):
+            return None, ({"error": "Imóvel CAR: a consulta não foi concluída.", "details": execucao.avisos}, 504)
+        if err_car:
+            return None, ({"error": f"Imóvel CAR: {err_car}"}, 500) # Erro crítico se o CAR não for encontrado
+        if not imovel_car_data:
+             return None, ({"error": f"Código CAR '{contexto['car_code']}' não encontrado."}, 404)
+        if not imovel_car_data.get('geometry'):
+            # Se não tem geometria, não podemos centralizar o mapa ou obter estado por geo.
+            # O front-end precisará de um fallback.
+            error_message_pipeline.append("Imóvel CAR encontrado, mas sem geometria para definir centro do mapa.")
+        if err_est:
+            error_message_pipeline.append(f"Estado (via centroide CAR): {err_est}")
+            current_app.logger.warning(f"Erro ao obter estado pelo centroide do CAR: {err_est}")
+    else:
+        if err_est:
+            error_message_pipeline.append(f"Estado: {err_est}")
+            current_app.logger.warning(f"Erro ao obter estado por coords: {err_est}")
+        if err_car:
+            error_message_pipeline.append(f"Imóvel CAR: {err_car}")
+            current_app.logger.warning(f"Erro ao obter CAR por coords: {err_car}")
+    error_message_pipeline.extend(execucao.avisos)
 
-    # Adicionar Controle de Camadas
-    folium.LayerControl(collapsed=False).add_to(m)
-    map_html_content = render_map_html(m)
+    prodes = execucao.get('prodes')
+    desmatamento_areas_ha = prodes['desmatamento_ha'] if prodes else {}
+    if prodes and prodes['aviso']:
+        error_message_pipeline.append(f"PRODES: {prodes['aviso']}")
+        current_app.logger.warning(f"Erro/Aviso na análise PRODES: {prodes['aviso']}")
+
+    vizinhos_imovel, err_vizinhos = execucao.get('vizinhos') or (None, None)
+    if err_vizinhos:
+        error_message_pipeline.append(f"Vizinhos: {err_vizinhos}")
+
+    map_center_lat, map_center_lon, _ = _centro_mapa(input_type, lat, lon, imovel_car_data)
 
     # Montar o resultado JSON
-    resultado_final = {
-        "map_html": map_html_content,
+    resultado = {
+        "map_html": execucao.get('mapa'),
         "cod_imovel_encontrado": imovel_car_data.get('cod_imovel') if imovel_car_data else "N/D",
         "nome_uf_encontrado": estado_data.get('nome_uf') if estado_data else "N/D",
         "sigla_uf_encontrada": estado_data.get('sigla_uf') if estado_data else "N/D",
         "centro_mapa": {"lat": map_center_lat, "lon": map_center_lon},
-        "tabela_desmatamento_html": tabela_desmatamento_html,
+        "tabela_desmatamento_html": _tabela_desmatamento_html(desmatamento_areas_ha),
         "prodes_disponivel": bool(desmatamento_areas_ha),
         "avisos_erros": error_message_pipeline if error_message_pipeline else None
     }
-    
+    if contexto['vizinhos']:
+        resultado["vizinhos"] = vizinhos_imovel
+    return resultado, None
+
+@current_app.route('/analisar', methods=['POST'])
+def analisar_propriedade():
+    """
+    Rota principal para análise. Recebe dados do formulário, processa
+    e retorna um JSON com o HTML do mapa e outras informações.
+
+    As etapas (estado, imóvel CAR, PRODES, mapa) rodam em paralelo quando
+    independentes, cada uma com seu prazo; uma etapa que falha ou expira
+    vira um aviso em 'avisos_erros' (ver app/etapas.py).
+    """
+    contexto, etapas_analise, erro = _preparar_analise(request.form)
+    if erro:
+        return jsonify(erro[0]), erro[1]
+
+    execucao = etapas.executar(etapas_analise, max_threads=current_app.config['ANALISE_THREADS'])
+    current_app.logger.info("Tempos das etapas (s): " + ", ".join(f"{nome}={t:.3f}" for nome, t in execucao.tempos.items()))
+
+    # 3. Consolidar resultados e avisos
+    # ---------------------------------
+    resultado_final, erro = _consolidar_analise(contexto, execucao)
+    if erro:
+        return jsonify(erro[0]), erro[1]
     current_app.logger.info(f"Análise concluída. Enviando resposta.")
-    return jsonify(resultado_final)
\ No newline at end of file
+    return jsonify(resultado_final)
+
+def _evento_sse(evento, dados):
+    """Mensagem Server-Sent Events com `dados` em JSON."""
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False, default=str)}\n\n"
+
+def _dados_evento_etapa(nome, execucao, contexto):
+    """(evento, dados) a enviar quando a etapa `nome` termina, ou None se ela não gera evento."""
+    if nome == 'estado':
+        estado_data, err_est = execucao.get('estado') or (None, None)
+        return 'estado', {
+            "nome_uf_encontrado": estado_data.get('nome_uf') if estado_data else "N/D",
+            "sigla_uf_encontrada": estado_data.get('sigla_uf') if estado_data else "N/D",
+            "aviso": err_est,
+        }
+    if nome == 'car':
+        imovel_car_data, err_car = execucao.get('car') or (None, None)
+        dados = {"cod_imovel_encontrado": imovel_car_data.get('cod_imovel') if imovel_car_data else "N/D",
+                 "geometria": None, "aviso": err_car}
+        if imovel_car_data and imovel_car_data.get('geometry'):
+            dados["municipio"] = imovel_car_data.get('municipio')
+            dados["geometria"] = analise.geometria_geojson(utils.geometria_exibicao(imovel_car_data),
+                                                           tolerancia=current_app.config['API_GEOMETRIA_TOLERANCIA'])
+        map_center_lat, map_center_lon, zoom = _centro_mapa(contexto['input_type'], contexto['lat'], contexto['lon'],
+                                                            imovel_car_data)
+        dados["centro_mapa"] = {"lat": map_center_lat, "lon": map_center_lon, "zoom": zoom}
+        return 'imovel', dados
+    if nome == 'prodes':
+        prodes = execucao.get('prodes')
+        desmatamento_areas_ha = prodes['desmatamento_ha'] if prodes else {}
+        return 'prodes', {
+            "desmatamento_ha": desmatamento_areas_ha,
+            "tabela_desmatamento_html": _tabela_desmatamento_html(desmatamento_areas_ha),
+            "prodes_disponivel": bool(desmatamento_areas_ha),
+            "aviso": prodes['aviso'] if prodes else None,
+        }
+    if nome == 'mapa':
+        return 'mapa', {"map_html": execucao.get('mapa')}
+    if nome == 'vizinhos':
+        vizinhos_imovel, err_vizinhos = execucao.get('vizinhos') or (None, None)
+        return 'vizinhos', {"vizinhos": vizinhos_imovel, "aviso": err_vizinhos}
+    return None
+
+@current_app.route('/analisar/stream', methods=['POST'])
+def analisar_propriedade_stream():
+    """
+    Variante do /analisar em Server-Sent Events: as mesmas etapas, mas cada
+    parte é enviada assim que fica pronta - 'estado', 'imovel' (com a
+    geometria em GeoJSON), 'prodes' (tabela de desmatamento), 'mapa' (HTML
+    Folium) e, com vizinhos=N, 'vizinhos' - e 'fim' traz o resultado consolidado do /analisar, sem o mapa
+    (ou 'erro', com o mesmo JSON e status que o /analisar devolveria).
+    """
+    contexto, etapas_analise, erro = _preparar_analise(request.form)
+    if erro:
+        return jsonify(erro[0]), erro[1]
+
+    def gerar():
+        execucao = etapas.ResultadoEtapas()
+        for nome in etapas.acompanhar(etapas_analise, execucao, max_threads=current_app.config['ANALISE_THREADS']):
+            evento = _dados_evento_etapa(nome, execucao, contexto)
+            if evento is not None:
+                yield _evento_sse(*evento)
+        current_app.logger.info("Tempos das etapas (s): " + ", ".join(f"{nome}={t:.3f}" for nome, t in execucao.tempos.items()))
+        resultado_final, erro = _consolidar_analise(contexto, execucao)
+        if erro:
+            yield _evento_sse('erro', dict(erro[0], status=erro[1]))
+            return
+        resultado_final.pop('map_html') # Já enviado no evento 'mapa'
+        yield _evento_sse('fim', resultado_final)
+
+    resposta = Response(stream_with_context(gerar()), mimetype='text/event-stream')
+    resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.headers['X-Accel-Buffering'] = 'no' # Sem buffer no nginx: cada evento sai na hora
+    return resposta
+
+
+@current_app.route('/api/v1/analise', methods=['GET', 'POST'])
+def api_analise():
+    """
+    Análise sem mapa para clientes de API: código CAR, UF, desmatamento PRODES
+    por ano e, com geometria=1, a geometria simplificada do imóvel em GeoJSON.
+    Parâmetros (query string, formulário ou JSON): car_code | lat + lon, uf,
+    geometria, tolerancia (graus), vizinhos (N) e vizinhos_distancia (m).
+    """
+    params = request.get_json(silent=True) or request.values
+    car_code = (params.get('car_code') or params.get('cod_imovel') or '').strip() or None
+    sigla_uf = (params.get('uf') or '').strip().upper() or None
+    incluir_geometria = str(params.get('geometria', '')).lower() in ('1', 'true', 'sim')
+    lat, lon = None, None
+    try:
+        tolerancia = float(params.get('tolerancia', current_app.config['API_GEOMETRIA_TOLERANCIA']))
+        if not car_code:
+            lat, lon = float(params.get('lat')), float(params.get('lon'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Informe car_code ou lat/lon numéricos (e tolerancia numérica)."}), 400
+    if lat is not None and (not (-90 <= lat <= 90) or not (-180 <= lon <= 180)):
+        return jsonify({"error": "Coordenadas fora dos limites válidos."}), 400
+    if tolerancia < 0:
+        return jsonify({"error": "Tolerância de simplificação deve ser positiva."}), 400
+    quantidade_vizinhos, distancia_vizinhos_m, erro = _parametros_vizinhos(params)
+    if erro:
+        return jsonify(erro[0]), erro[1]
+
+    resultado = analise.analisar_imovel(car_code=car_code, sigla_uf=sigla_uf, lat=lat, lon=lon,
+                                        incluir_geometria=incluir_geometria, tolerancia=tolerancia,
+                                        vizinhos=quantidade_vizinhos, distancia_vizinhos_m=distancia_vizinhos_m)
+    if resultado['cod_imovel'] is None:
+        return jsonify(resultado), 404
+    resultado['tiles_prodes'] = request.script_root + '/tiles/prodes/{z}/{x}/{y}.png'
+    return jsonify(resultado)
+
+@current_app.route('/analisar/lote', methods=['POST'])
+def analisar_lote():
+    """
+    Recebe um CSV/GeoJSON de códigos CAR ou coordenadas (campo 'arquivo' ou
+    corpo da requisição) e enfileira a análise em lote, sem mapas.
+    """
+    arquivo = request.files.get('arquivo')
+    if arquivo:
+        conteudo, nome_arquivo = arquivo.read(), arquivo.filename
+    else:
+        conteudo, nome_arquivo = request.get_data(), ''
+    try:
+        entradas = lote.ler_entradas(conteudo, nome_arquivo, request.content_type)
+    except (lote.EntradaLoteInvalida, UnicodeDecodeError) as e:
+        return jsonify({"error": f"Arquivo de lote inválido: {e}"}), 400
+    if len(entradas) > current_app.config['LOTE_MAX_ITENS']:
+        return jsonify({"error": f"Lote excede o limite de {current_app.config['LOTE_MAX_ITENS']} itens."}), 400
+
+    db_path = current_app.config['LOTE_DB_PATH']
+    job_id = lote.criar_lote(db_path, entradas)
+    executor = lote.get_executor(current_app._get_current_object()) if current_app.config['LOTE_EXECUTOR_ATIVO'] else None
+    if executor is not None: # Em outro processo, o executor vê o lote na próxima verificação da fila
+        executor.acordar()
+    current_app.logger.info(f"Lote {job_id} criado com {len(entradas)} itens.")
+    return jsonify({
+        "job_id": job_id,
+        "total": len(entradas),
+        "resultados_url": request.script_root + f"/analisar/lote/{job_id}",
+    }), 202
+
+@current_app.route('/analisar/lote/<job_id>')
+def resultado_lote(job_id):
+    """Progresso e resultados do lote em NDJSON (?seguir=1 acompanha até o fim)."""
+    db_path = current_app.config['LOTE_DB_PATH']
+    if lote.obter_lote(db_path, job_id) is None:
+        return jsonify({"error": f"Lote '{job_id}' não encontrado."}), 404
+    seguir = request.args.get('seguir') in ('1', 'true', 'sim')
+    return Response(stream_with_context(lote.stream_resultados(db_path, job_id, seguir=seguir)),
+                    mimetype='application/x-ndjson')
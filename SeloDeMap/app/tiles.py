@@ -0,0 +1,156 @@
+# SeloDeMap/app/tiles.py
+# Tiles XYZ (Web Mercator) do raster PRODES, com cache LRU em memória e cache
+# opcional em disco. Cada tile lê apenas a janela necessária do arquivo (ou
+# da overview de resolução mais próxima) e é reprojetado para EPSG:3857.
+# Com o catálogo de tiles PRODES, o R*Tree indica os rasters que cobrem o tile
+# e cada um é reprojetado sobre o mesmo destino (mosaico, como no recorte).
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.warp import reproject, transform_bounds
+
+from . import catalogo_prodes, colormap, metricas, projecao, raster
+from .cache import CacheLRU
+
+TAMANHO_TILE = 256
+ORIGEM_MERCATOR = 20037508.342789244  # Metade da circunferência da Terra em EPSG:3857
+NODATA_PRODES = 255
+
+_cache_tiles = None
+_cache_tiles_lock = threading.Lock()
+
+
+def limites_tile_3857(z, x, y):
+    """(minx, miny, maxx, maxy) do tile XYZ em metros Web Mercator."""
+    tamanho = 2 * ORIGEM_MERCATOR / (2 ** z)
+    minx = -ORIGEM_MERCATOR + x * tamanho
+    maxy = ORIGEM_MERCATOR - y * tamanho
+    return minx, maxy - tamanho, minx + tamanho, maxy
+
+
+def tile_valido(z, x, y):
+    return 0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _escolher_overview(src, resolucao_tile):
+    """Índice da overview mais grossa que ainda é mais fina que o tile (None = resolução cheia)."""
+    resolucao_base = abs(src.transform.a)
+    escolhida = None
+    for i, fator in enumerate(src.overviews(1)):
+        if resolucao_base * fator <= resolucao_tile:
+            escolhida = i
+    return escolhida
+
+
+def _desenhar(caminho, limites, destino):
+    """Reprojeta no tile `destino` (EPSG:3857) a parte do raster que o cobre, sem apagar
+    o que outros rasters do mosaico já desenharam (os pixels nodata não são escritos)."""
+    with raster.dataset(caminho) as src:
+        # Descarta rápido rasters fora do tile
+        minx, miny, maxx, maxy = transform_bounds("EPSG:3857", src.crs, *limites)
+        esq, baixo, dir_, topo = src.bounds
+        if maxx <= esq or minx >= dir_ or maxy <= baixo or miny >= topo:
+            return
+        overview = _escolher_overview(src, (maxx - minx) / TAMANHO_TILE)
+
+    with raster.dataset(caminho, overview) as src:
+        reproject(
+            source=rasterio.band(src, 1),
+            destination=destino,
+            src_nodata=src.nodata if src.nodata is not None else NODATA_PRODES,
+            dst_transform=from_bounds(*limites, TAMANHO_TILE, TAMANHO_TILE),
+            dst_crs="EPSG:3857",
+            dst_nodata=NODATA_PRODES,
+            init_dest_nodata=False,
+            resampling=Resampling.nearest,  # Classes categóricas: nada de interpolação
+        )
+
+
+def renderizar_tile(fonte, z, x, y):
+    """Renderiza o tile como PNG indexado com a paleta PRODES fixa.
+
+    `fonte` é o caminho do raster PRODES ou um CatalogoProdes.
+    """
+    limites = limites_tile_3857(z, x, y)
+    if isinstance(fonte, catalogo_prodes.CatalogoProdes):
+        caminhos = fonte.tiles_intersectando(projecao.reprojetar_limites(limites, "EPSG:3857", projecao.SIRGAS2000))
+    else:
+        caminhos = [fonte]
+    destino = np.full((TAMANHO_TILE, TAMANHO_TILE), NODATA_PRODES, dtype=np.uint8)
+    for caminho in caminhos:
+        _desenhar(caminho, limites, destino)
+    if np.all(destino == NODATA_PRODES):
+        return None
+    return colormap.encode_png_paleta(destino, colormap.PRODES_LUT_RGBA)
+
+
+_TILE_VAZIO = None
+
+
+def tile_vazio():
+    """PNG 1x1 transparente devolvido para tiles sem dados."""
+    global _TILE_VAZIO
+    if _TILE_VAZIO is None:
+        _TILE_VAZIO = colormap.encode_png_paleta(
+            np.full((1, 1), NODATA_PRODES, dtype=np.uint8), colormap.PRODES_LUT_RGBA)
+    return _TILE_VAZIO
+
+
+def _caminho_disco(dir_cache, versao, z, x, y):
+    pasta_versao = hashlib.sha1(versao.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(dir_cache, pasta_versao, str(z), str(x), f"{y}.png")
+
+
+def _gravar_atomico(caminho, dados):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(dados)
+    os.replace(tmp, caminho)
+
+
+def get_cache_tiles(max_itens):
+    global _cache_tiles
+    if _cache_tiles is None:
+        with _cache_tiles_lock:
+            if _cache_tiles is None:
+                _cache_tiles = CacheLRU(max_itens)
+    return _cache_tiles
+
+
+def obter_tile(fonte, versao, z, x, y, max_cache=2048, dir_cache=None):
+    """PNG do tile (z, x, y) da `fonte` (arquivo ou catálogo) na `versao`: memória -> disco -> renderização."""
+    cache = get_cache_tiles(max_cache)
+    chave = (versao, z, x, y)
+    png = cache.get(chave)
+    if png is not None:
+        return png
+
+    arquivo = _caminho_disco(dir_cache, versao, z, x, y) if dir_cache else None
+    if arquivo and os.path.exists(arquivo):
+        with open(arquivo, 'rb') as f:
+            png = f.read()
+    else:
+        with metricas.cronometro('tile_render'):
+            png = renderizar_tile(fonte, z, x, y) or tile_vazio()
+        if arquivo:
+            _gravar_atomico(arquivo, png)
+    cache.set(chave, png)
+    return png
+
+
+def gerar_overviews(caminho, fatores=(2, 4, 8, 16, 32, 64)):
+    """Constrói a pirâmide de overviews (vizinho mais próximo, dados categóricos)."""
+    with rasterio.open(caminho, 'r+') as dst:
+        menor_lado = min(dst.width, dst.height)
+        fatores = [f for f in fatores if menor_lado / f >= TAMANHO_TILE / 4] or [2]
+        dst.build_overviews(fatores, Resampling.nearest)
+        dst.update_tags(ns='rio_overview', resampling='nearest')
+    return fatores
+
@@ -6,11 +6,12 @@ from shapely.geometry import Point
 from flask import current_app
 import geopandas as gpd
 from owslib.wfs import WebFeatureService
-import rasterio
 from rasterio.mask import mask
 import numpy as np
 import os
 
+from . import car_local, catalogo_prodes, db, estados, metricas, prodes_postgis, projecao, raster
+
 # Mapeamento de código IBGE da UF para Sigla
 IBGE_UF_CODE_TO_SIGLA = {
     '11': 'RO', '12': 'AC', '13': 'AM', '14': 'RR', '15': 'PA', '16': 'AP', '17': 'TO',
@@ -20,196 +21,431 @@ IBGE_UF_CODE_TO_SIGLA = {
     '50': 'MS', '51': 'MT', '52': 'GO', '53': 'DF'
 }
 
-# --- Funções de Conexão com Banco de Dados ---
-def get_db_connection():
-    db_info = current_app.config['DATABASE_CONNECTION_INFO']
-    conn = psycopg2.connect(
-        host=db_info['host'],
-        database=db_info['dbname'],
-        user=db_info['user'],
-        password=db_info['password'],
-        port=db_info['port']
-    )
-    return conn
+# --- Funções de Consulta de Estados (índice local / WFS do IBGE) ---
+def _montar_estado_info(atributos, geometria):
+    codigo_uf_ibge = str(atributos.get('cd_uf', '')) # Garantir que é string
+    sigla_uf_mapeada = IBGE_UF_CODE_TO_SIGLA.get(codigo_uf_ibge)
+
+    if not sigla_uf_mapeada:
+        current_app.logger.warning(f"Código UF IBGE '{codigo_uf_ibge}' não encontrado no mapeamento.")
+        return None, f"Mapeamento para sigla da UF não encontrado para o código IBGE '{codigo_uf_ibge}'."
+
+    estado_info = {
+        'gid_ibge': atributos.get('id', None),
+        'sigla_uf': sigla_uf_mapeada,
+        'codigo_ibge_uf': codigo_uf_ibge,
+        'nome_uf': atributos.get('nm_uf', None),
+        'geometry': geometria # Geometria Shapely em EPSG:4674
+    }
+    return estado_info, None
 
-# --- Funções de Consulta ao IBGE (WFS) ---
 def get_estado_from_coords(lat, lon):
+    """Identifica a UF que contém a coordenada (EPSG:4326).
+
+    Usa o snapshot local dos limites estaduais (Config.ESTADOS_FILE) e só
+    recorre ao WFS do IBGE quando o arquivo não está disponível.
+    """
+    try:
+        indice = estados.get_indice_estados(current_app.config['ESTADOS_FILE'])
+    except Exception as e:
+        current_app.logger.error(f"Erro ao carregar snapshot local de UFs: {e}", exc_info=True)
+        indice = None
+    if indice is None:
+        current_app.logger.warning("Snapshot local de UFs não encontrado; consultando WFS do IBGE.")
+        return _get_estado_from_wfs(lat, lon)
+
+    lon_4674, lat_4674 = projecao.reprojetar_ponto(lon, lat, projecao.WGS84, estados.CRS_ESTADOS)
+    encontrado = indice.localizar(lon_4674, lat_4674)
+    if encontrado is None:
+        return None, "Coordenada fora dos limites dos estados brasileiros."
+    atributos, geometria = encontrado
+    return _montar_estado_info(atributos, geometria)
+
+def geometria_estado_exibicao(estado_data, zoom):
+    """Limite da UF simplificado para o zoom do mapa; a análise usa estado_data['geometry'] completa."""
+    tolerancia = estados.tolerancia_para_zoom(zoom)
+    try:
+        indice = estados.get_indice_estados(current_app.config['ESTADOS_FILE'])
+    except Exception:
+        indice = None
+    geometria = indice.geometria_exibicao(estado_data.get('codigo_ibge_uf'), tolerancia) if indice else None
+    if geometria is None: # Estado vindo do WFS (sem snapshot local)
+        geometria = estados.simplificar_limites(estado_data['geometry'], tolerancia)
+    return geometria
+
+def _get_estado_from_wfs(lat, lon):
     ponto = Point(lon, lat)
-    wfs_url = "https://geoservicos.ibge.gov.br/geoserver/CGMAT/wfs"
-    layer_estado = "CGMAT:pbqg22_02_Estado_LimUF"
+    wfs_url = current_app.config['ESTADOS_WFS_URL']
+    layer_estado = current_app.config['ESTADOS_WFS_LAYER']
 
     try:
-        wfs = WebFeatureService(wfs_url, version='1.1.0')
         bbox_estado = (lon - 0.5, lat - 0.5, lon + 0.5, lat + 0.5)
         # Solicitar no CRS nativo do WFS (EPSG:4674)
-        response_estado = wfs.getfeature(typename=layer_estado, bbox=bbox_estado, outputFormat='application/json', srsname='urn:ogc:def:crs:EPSG::4674')
-        
-        estados_gdf = gpd.read_file(response_estado) # Estará em EPSG:4674
+        with metricas.cronometro('wfs_ibge'):
+            wfs = WebFeatureService(wfs_url, version='1.1.0')
+            response_estado = wfs.getfeature(typename=layer_estado, bbox=bbox_estado, outputFormat='application/json', srsname='urn:ogc:def:crs:EPSG::4674')
+            estados_gdf = gpd.read_file(response_estado) # Estará em EPSG:4674
         if estados_gdf.empty:
             return None, "Nenhum estado encontrado na área da coordenada (WFS IBGE)."
 
-        ponto_gdf_4326 = gpd.GeoDataFrame([{'geometry': ponto}], crs="EPSG:4326")
-        ponto_gdf_4674 = ponto_gdf_4326.to_crs(estados_gdf.crs) # Reprojeta ponto para CRS dos estados
-        ponto_reprojetado = ponto_gdf_4674.geometry.iloc[0]
+        ponto_reprojetado = projecao.reprojetar_geometria(ponto, projecao.WGS84, estados_gdf.crs) # Ponto no CRS dos estados
 
         estado_filtrado_gdf = estados_gdf[estados_gdf.contains(ponto_reprojetado)]
         if estado_filtrado_gdf.empty:
             return None, "Coordenada fora dos limites dos estados brasileiros (WFS IBGE)."
 
         estado_series = estado_filtrado_gdf.iloc[0]
-        codigo_uf_ibge = str(estado_series.get('cd_uf', '')) # Garantir que é string
-        sigla_uf_mapeada = IBGE_UF_CODE_TO_SIGLA.get(codigo_uf_ibge)
-
-        if not sigla_uf_mapeada:
-            current_app.logger.warning(f"Código UF IBGE '{codigo_uf_ibge}' não encontrado no mapeamento.")
-            return None, f"Mapeamento para sigla da UF não encontrado para o código IBGE '{codigo_uf_ibge}'."
-
-        estado_info = {
-            'gid_ibge': estado_series.get('id', None),
-            'sigla_uf': sigla_uf_mapeada,
-            'codigo_ibge_uf': codigo_uf_ibge,
-            'nome_uf': estado_series.get('nm_uf', None),
-            'geometry': estado_series.geometry # Geometria Shapely em EPSG:4674
-        }
-        return estado_info, None
+        return _montar_estado_info(estado_series, estado_series.geometry)
     except Exception as e:
         current_app.logger.error(f"Erro ao consultar WFS do IBGE para estados: {e}", exc_info=True)
         return None, f"Erro ao conectar ou consultar serviço do IBGE para estados: {str(e)}"
 
+def baixar_estados_wfs(wfs_url, layer_estado):
+    """Baixa todos os limites estaduais do WFS do IBGE (usado para gerar o snapshot local)."""
+    wfs = WebFeatureService(wfs_url, version='1.1.0')
+    response = wfs.getfeature(typename=layer_estado, outputFormat='application/json', srsname='urn:ogc:def:crs:EPSG::4674')
+    estados_gdf = gpd.read_file(response)
+    if estados_gdf.crs is None:
+        estados_gdf = estados_gdf.set_crs(estados.CRS_ESTADOS)
+    return estados_gdf
+
 # --- Funções de Consulta ao CAR (PostGIS) ---
-def _process_car_record(imovel_record, conn, table_name):
-    """Função auxiliar para processar um registro de imóvel do banco."""
-    geom_wkb_data = imovel_record['geom_wkb']
-
-    # Log detalhado do tipo e valor de geom_wkb_data
-    temp_cursor = conn.cursor()
-    temp_cursor.execute("SHOW bytea_output;")
-    bytea_output_setting = temp_cursor.fetchone()[0]
-    temp_cursor.close()
-    current_app.logger.info(f"PostgreSQL bytea_output setting: {bytea_output_setting}")
-    current_app.logger.info(f"Tipo original de geom_wkb_data: {type(geom_wkb_data)}")
-
-    log_value_str = ""
-    if isinstance(geom_wkb_data, (bytes, bytearray, memoryview)):
-        log_value_str = geom_wkb_data[:100].hex() if hasattr(geom_wkb_data, 'hex') else str(geom_wkb_data[:100])
-    else:
-        log_value_str = str(geom_wkb_data)[:200]
-    current_app.logger.info(f"Valor de geom_wkb_data (início, hex se bytes, ou str): {log_value_str}")
+SIGLAS_UF = frozenset(IBGE_UF_CODE_TO_SIGLA.values())
 
-    geom_bytes = None
-    if isinstance(geom_wkb_data, str):
-        try:
-            geom_bytes = bytes.fromhex(geom_wkb_data)
-            current_app.logger.info("geom_wkb_data foi TRATADO como string hex e decodificado para bytes.")
-        except ValueError as ve_hex:
-            current_app.logger.error(f"Falha ao decodificar geom_wkb_data de string hex: {ve_hex}. Valor: {geom_wkb_data[:200]}")
-            return None, f"Formato WKB inválido (string não hexadecimal): {str(ve_hex)}"
-    elif isinstance(geom_wkb_data, memoryview):
-        geom_bytes = geom_wkb_data.tobytes()
-        current_app.logger.info("geom_wkb_data era memoryview e foi convertido para bytes.")
-    elif isinstance(geom_wkb_data, (bytes, bytearray)):
-        geom_bytes = bytes(geom_wkb_data) # Garante que é um objeto bytes imutável
-        current_app.logger.info("geom_wkb_data JÁ ERA bytes/bytearray e foi assegurado como bytes.")
-    else:
-        current_app.logger.error(f"Tipo inesperado para geom_wkb_data: {type(geom_wkb_data)}")
-        return None, f"Tipo de dados WKB inesperado: {type(geom_wkb_data)}"
+# Tabela CAR nacional particionada por UF (Config.CAR_TABELA, ver app/car.py).
+# Consultas preparadas no servidor; ST_AsBinary devolve bytea, que o psycopg2
+# entrega como memoryview sem conversões adicionais. O ponto é transformado
+# para o SRID fixo da tabela - nunca a coluna geom - para o índice GiST ser usado.
+# Imóveis do CAR se sobrepõem: entre os que contêm o ponto vale o de menor id,
+# para o resultado não depender do plano (e coincidir com o backend local);
+# as colunas calculadas (WKB, exibição, histograma) só para a linha escolhida.
+SQL_CAR_POR_COORDS = """
+    SELECT id, cod_imovel, sigla_uf, municipio, area, ST_AsBinary(geom) AS geom_wkb{geom_exibicao}
+    FROM (
+        SELECT id, cod_imovel, sigla_uf, municipio, area, geom
+        FROM {table_name}
+        WHERE ST_Contains(geom, ST_Transform(ST_SetSRID(ST_MakePoint($1::float8, $2::float8), 4326), {srid}))
+        ORDER BY id
+        LIMIT 1
+    ) c
+"""
+# O filtro por sigla_uf (prefixo do código) restringe a busca a uma partição
+SQL_CAR_POR_CODIGO = """
+    SELECT id, cod_imovel, sigla_uf, municipio, area, ST_AsBinary(geom) AS geom_wkb{geom_exibicao}
+    FROM {table_name}
+    WHERE cod_imovel = $1::text AND sigla_uf = $2::text
+"""
+# Transporte compacto (Config.CAR_GEOMETRIA_COMPACTA): junto com a geometria
+# completa, usada no recorte PRODES, o PostGIS devolve a variante de exibição
+# (mapa, API) já simplificada e reduzida à grade de precisão, com bem menos
+# vértices e dígitos. ST_ReducePrecision (PostGIS >= 3.1) mantém a geometria válida.
+SQL_CAR_GEOM_EXIBICAO = """,
+    ST_AsBinary(ST_ReducePrecision(ST_SimplifyPreserveTopology(geom, {tolerancia}), {precisao})) AS geom_exibicao_wkb"""
+MSG_CAR_NAO_ENCONTRADO_COORDS = "Nenhum imóvel CAR encontrado para a coordenada."
+# Vizinhos na partição da UF: ST_DWithin (índice GiST) limita a distância e o
+# operador KNN <-> ordena pelo índice (empates pelo id, por ordenação incremental);
+# só as `$4` primeiras linhas são lidas. Para o planner usar o índice no ORDER BY,
+# o outro lado do <-> tem de ser constante durante a varredura: a geometria de
+# referência entra como subconsulta escalar (InitPlan, avaliada uma vez), e não
+# como coluna de uma junção.
+# A distância do ST_DWithin é em graus (SRID geográfico); distancia_m, em metros,
+# é calculada no elipsoide só para as linhas devolvidas.
+SQL_CAR_VIZINHOS = """
+    WITH referencia AS (
+        SELECT geom FROM {table_name} WHERE cod_imovel = $1::text AND sigla_uf = $2::text
+    )
+    SELECT c.id, c.cod_imovel, c.sigla_uf, c.municipio, c.area, ST_AsBinary(c.geom) AS geom_wkb,
+           ST_Distance(c.geom::geography, (SELECT geom FROM referencia)::geography) AS distancia_m{colunas}
+    FROM {table_name} c
+    WHERE c.sigla_uf = $2::text AND c.cod_imovel <> $1::text
+      AND ST_DWithin(c.geom, (SELECT geom FROM referencia), $3::float8)
+    ORDER BY c.geom <-> (SELECT geom FROM referencia), c.id
+    LIMIT $4::int
+"""
+METROS_POR_GRAU = 111320 # No equador; a distância do ST_DWithin é aproximada
+
+def sigla_uf_from_car_code(cod_car):
+    """UF do imóvel pelo prefixo do código CAR (ex: 'MS-5001102-...' -> 'MS')."""
+    if not cod_car:
+        return None
+    prefixo = cod_car.strip()[:2].upper()
+    return prefixo if prefixo in SIGLAS_UF else None
+
+def car_table_name(sigla_uf=None):
+    """Tabela CAR nacional ou, com a UF, sua partição; a sigla é validada pois entra no SQL por formatação."""
+    tabela = current_app.config['CAR_TABELA']
+    if sigla_uf is None:
+        return tabela
+    sigla = sigla_uf.upper()
+    if sigla not in SIGLAS_UF:
+        return None
+    return f"{tabela}_{sigla.lower()}"
+
+def _geom_bytes(geom_wkb_data):
+    if isinstance(geom_wkb_data, (memoryview, bytes, bytearray)): # bytea do psycopg2 chega como memoryview
+        return bytes(geom_wkb_data)
+    if isinstance(geom_wkb_data, str): # bytea em texto hex (ex: driver/adaptador diferente)
+        return bytes.fromhex(geom_wkb_data[2:] if geom_wkb_data.startswith('\\x') else geom_wkb_data)
+    raise TypeError(f"Tipo de dados WKB inesperado: {type(geom_wkb_data)}")
+
+def decodificar_wkb(valores_wkb, on_invalid='raise'):
+    """Array de geometrias Shapely a partir de vários WKB (bytea), numa única chamada vetorizada ao GEOS.
+
+    Com on_invalid='ignore', WKB inválidos viram None em vez de derrubar o bloco inteiro.
+    """
+    return from_wkb(np.array([_geom_bytes(valor) for valor in valores_wkb], dtype=object), on_invalid=on_invalid)
+
+def _geom_exibicao_sql():
+    """Coluna extra do SELECT do CAR com a variante de exibição, ou '' sem o transporte compacto."""
+    config = current_app.config
+    if not config['CAR_GEOMETRIA_COMPACTA']:
+        return ''
+    return SQL_CAR_GEOM_EXIBICAO.format(tolerancia=float(config['CAR_GEOMETRIA_TOLERANCIA_EXIBICAO']),
+                                        precisao=float(config['CAR_GEOMETRIA_PRECISAO']))
+
+def geometria_exibicao(imovel_car_data):
+    """Geometria do imóvel para desenho (variante compacta, se veio do banco; senão a completa)."""
+    geometria = imovel_car_data.get('geometria_exibicao')
+    return geometria if geometria is not None else imovel_car_data.get('geometry')
 
-    if geom_bytes:
+def _process_car_record(imovel_record, conn, table_name):
+    """Função auxiliar para processar um registro de imóvel do banco."""
+    colunas = ['geom_wkb'] + (['geom_exibicao_wkb'] if imovel_record.get('geom_exibicao_wkb') is not None else [])
+    try:
+        valores_wkb = [imovel_record[coluna] for coluna in colunas]
+        geometrias = decodificar_wkb(valores_wkb) # Completa e de exibição num só from_wkb
+        geom_shapely = geometrias[0]
+    except (TypeError, ValueError) as e:
+        current_app.logger.error(f"Falha ao converter geometria do imóvel (ID: {imovel_record['id']}): {e}")
+        return None, f"Formato WKB inválido: {str(e)}"
+    except Exception as e_shapely:
+        current_app.logger.error(f"Erro no from_wkb(): {e_shapely}", exc_info=True)
+        current_app.logger.debug(f"Bytes (hex) que causaram o erro no from_wkb (início): {_geom_bytes(valores_wkb[0])[:50].hex()}")
+        if conn is None: # Backend CAR local: sem banco para perguntar o motivo
+            return None, f"Erro ao parsear geometria WKB: {str(e_shapely)}"
         try:
-            current_app.logger.info(f"Tentando from_wkb() com bytes (início, hex): {geom_bytes[:50].hex()}")
-            geom_shapely = from_wkb(geom_bytes)
-            current_app.logger.info("from_wkb() bem-sucedido!")
-            
-            imovel_data = {
-                'gid_car': imovel_record['id'],
-                'cod_imovel': imovel_record['cod_imovel'],
-                'municipio': imovel_record.get('municipio'),
-                'area_ha_car': imovel_record.get('area'),
-                'geometry': geom_shapely
-            }
-            return imovel_data, None
-        except Exception as e_shapely:
-            current_app.logger.error(f"Erro no from_wkb(): {e_shapely}", exc_info=True)
-            hex_bytes_inicio = geom_bytes[:50].hex()
-            current_app.logger.error(f"Bytes (hex) que causaram o erro no from_wkb (início dos primeiros 50 bytes): {hex_bytes_inicio}")
-            try:
-                reason_cursor = conn.cursor()
-                reason_cursor.execute(f"SELECT ST_IsValidReason(geom) FROM {table_name} WHERE id = %s;", (imovel_record['id'],))
+            with conn.cursor() as reason_cursor:
+                reason_cursor.execute(f"SELECT ST_IsValidReason(geom) FROM {table_name} WHERE cod_imovel = %s AND sigla_uf = %s;",
+                                      (imovel_record['cod_imovel'], imovel_record['sigla_uf']))
                 validity_reason = reason_cursor.fetchone()[0]
-                reason_cursor.close()
-                current_app.logger.error(f"Razão da validade da geometria (ID: {imovel_record['id']}): {validity_reason}")
-            except Exception as e_validity:
-                current_app.logger.error(f"Erro ao verificar validade da geometria: {e_validity}")
-            return None, f"Erro ao parsear geometria WKB: {str(e_shapely)}"
-    else:
-        current_app.logger.error("geom_bytes está None após processamento.")
-        return None, "Falha interna ao processar dados da geometria."
+            current_app.logger.error(f"Razão da validade da geometria (ID: {imovel_record['id']}): {validity_reason}")
+        except Exception as e_validity:
+            current_app.logger.error(f"Erro ao verificar validade da geometria: {e_validity}")
+        return None, f"Erro ao parsear geometria WKB: {str(e_shapely)}"
 
+    imovel_data = {
+        'gid_car': imovel_record['id'],
+        'cod_imovel': imovel_record['cod_imovel'],
+        'sigla_uf': imovel_record['sigla_uf'],
+        'municipio': imovel_record.get('municipio'),
+        'area_ha_car': imovel_record.get('area'),
+        'geometry': geom_shapely, # Precisão total: é a usada no recorte PRODES
+        'geometria_exibicao': geometrias[1] if len(geometrias) > 1 else None,
+    }
+    if 'prodes_histograma' in imovel_record: # Motor PRODES no PostGIS: {classe: pixels} já calculado
+        imovel_data['prodes_contagens'] = prodes_postgis.contagens(imovel_record['prodes_histograma'])
+    return imovel_data, None
 
-def get_imovel_car_from_coords(lat, lon, sigla_uf):
-    if not sigla_uf:
-        return None, "Sigla da UF não fornecida para buscar imóvel CAR."
-    table_name = f"imoveis_car_{sigla_uf.lower()}"
-    conn = None
+def _buscar_imovel_car_local(tipo, params, msg_nao_encontrado):
+    """Como _buscar_imovel_car, nos arquivos por UF do backend local (app/car_local.py)."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        # Usar ST_AsEWKB para incluir SRID, e selecionar mais colunas
-        query = f"""
-            SELECT id, cod_imovel, municipio, area, ST_AsBinary(geom) as geom_wkb
-            FROM {table_name}
-            WHERE ST_Contains(geom, ST_Transform(ST_SetSRID(ST_MakePoint(%s, %s), 4326), ST_SRID(geom)));
-        """ # ST_SRID(geom) para usar o SRID da coluna geom dinamicamente
-        cursor.execute(query, (lon, lat))
-        imovel_record = cursor.fetchone()
-        if imovel_record:
-            return _process_car_record(imovel_record, conn, table_name)
-        else:
-            return None, f"Nenhum imóvel CAR encontrado para a coordenada na tabela {table_name}."
+        with metricas.cronometro('car_local'):
+            imovel_record = car_local.buscar_registro(tipo, params)
+    except car_local.ArquivoCarAusente as e:
+        current_app.logger.error(str(e))
+        return None, str(e)
+    except (OSError, ValueError, RuntimeError) as e: # Arquivo ilegível: erros do pyarrow (ValueError/OSError) e do GDAL (RuntimeError)
+        current_app.logger.error(f"Erro no CAR local ({tipo}): {e}", exc_info=True)
+        return None, f"Erro na leitura do CAR local ({tipo}): {str(e)}"
+    if imovel_record:
+        return _process_car_record(imovel_record, None, None)
+    return None, msg_nao_encontrado
+
+def _buscar_imovel_car(tipo, sql_template, params, msg_nao_encontrado):
+    """Executa a consulta preparada `tipo` na tabela CAR nacional usando uma conexão do pool."""
+    if car_local.ativo():
+        return _buscar_imovel_car_local(tipo, params, msg_nao_encontrado)
+    table_name = car_table_name()
+    try:
+        with metricas.cronometro('postgis_car'), db.conexao() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                geom_exibicao = _geom_exibicao_sql()
+                nome = f"car_{tipo}" + ("_compacta" if geom_exibicao else "")
+                if prodes_postgis.ativo(): # Histograma PRODES do imóvel na mesma ida ao banco
+                    geom_exibicao += ",\n    " + prodes_postgis.histograma_sql('geom', f"${len(params) + 1}::text") + " AS prodes_histograma"
+                    nome += "_prodes"
+                    params = tuple(params) + (versao_prodes_atual(),)
+                db.executar_preparada(cursor, nome,
+                                      sql_template.format(table_name=table_name, srid=int(current_app.config['CAR_SRID']),
+                                                          geom_exibicao=geom_exibicao),
+                                      params)
+                imovel_record = cursor.fetchone()
+                if imovel_record:
+                    return _process_car_record(imovel_record, conn, table_name)
+                return None, msg_nao_encontrado
     except psycopg2.Error as e:
         if e.pgcode == '42P01':
              current_app.logger.error(f"Tabela CAR '{table_name}' não encontrada: {e}")
-             return None, f"Dados CAR para a UF '{sigla_uf}' não disponíveis ou tabela não encontrada."
-        current_app.logger.error(f"Erro DB (coords): {e}", exc_info=True)
-        return None, f"Erro no banco de dados (coords): {str(e)}"
-    finally:
-        if conn:
-            conn.close()
-
-def get_imovel_car_from_code(cod_car, sigla_uf):
+             return None, f"Tabela CAR '{table_name}' não encontrada (crie-a com `flask migrar-car-nacional`)."
+        current_app.logger.error(f"Erro DB ({tipo}): {e}", exc_info=True)
+        return None, f"Erro no banco de dados ({tipo}): {str(e)}"
+
+def car_nao_encontrado_coords(err_car):
+    """True se o erro de get_imovel_car_from_coords é 'nenhum imóvel' (e não falha de banco)."""
+    return err_car == MSG_CAR_NAO_ENCONTRADO_COORDS
+
+def get_imovel_car_from_coords(lat, lon):
+    """Imóvel CAR que contém a coordenada (EPSG:4326), em qualquer UF."""
+    return _buscar_imovel_car('coords', SQL_CAR_POR_COORDS, (lon, lat), MSG_CAR_NAO_ENCONTRADO_COORDS)
+
+def get_imovel_car_from_code(cod_car):
+    """Imóvel CAR pelo código; a UF (partição) vem do prefixo do código."""
+    sigla_uf = sigla_uf_from_car_code(cod_car)
     if not sigla_uf:
-        return None, "Sigla da UF não fornecida para buscar imóvel CAR."
-    table_name = f"imoveis_car_{sigla_uf.lower()}"
-    conn = None
+        return None, f"Não foi possível determinar a UF do código CAR '{cod_car}'."
+    return _buscar_imovel_car('code', SQL_CAR_POR_CODIGO, (cod_car.strip(), sigla_uf),
+                              f"Código CAR '{cod_car}' não encontrado.")
+
+def get_imoveis_car_vizinhos(imovel_car_data, quantidade, distancia_m=0):
+    """Até `quantidade` imóveis CAR da mesma UF a até `distancia_m` metros do imóvel (0 = que encostam),
+    do mais próximo ao mais distante, numa única consulta. Retorna (lista de imóveis, erro).
+
+    Cada imóvel tem os campos de get_imovel_car_from_code e 'distancia_m'; no
+    motor PRODES 'postgis', também o histograma ('prodes_contagens').
+    """
+    sigla_uf = imovel_car_data['sigla_uf']
+    table_name = car_table_name(sigla_uf)
+    if table_name is None:
+        return [], f"UF '{sigla_uf}' inválida."
+    params = (imovel_car_data['cod_imovel'], sigla_uf, distancia_m / METROS_POR_GRAU, int(quantidade))
+    if car_local.ativo():
+        return _vizinhos_local(params)
+    nome, colunas = f"car_vizinhos_{sigla_uf.lower()}", "" # Um statement por partição
+    if prodes_postgis.ativo(): # Histograma PRODES de cada vizinho na mesma consulta
+        colunas = ",\n    " + prodes_postgis.histograma_sql('c.geom', "$5::text") + " AS prodes_histograma"
+        nome += "_prodes"
+        params += (versao_prodes_atual(),)
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        # Usar ST_AsEWKB e selecionar mais colunas
-        query = f"""
-            SELECT id, cod_imovel, municipio, area, ST_AsBinary(geom) as geom_wkb
-            FROM {table_name}
-            WHERE cod_imovel = %s;
-        """
-        cursor.execute(query, (cod_car,))
-        imovel_record = cursor.fetchone()
-        if imovel_record:
-            return _process_car_record(imovel_record, conn, table_name)
-        else:
-            return None, f"Código CAR '{cod_car}' não encontrado na tabela {table_name}."
+        with metricas.cronometro('postgis_vizinhos'), db.conexao() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                db.executar_preparada(cursor, nome, SQL_CAR_VIZINHOS.format(table_name=table_name, colunas=colunas), params)
+                return _processar_vizinhos(cursor.fetchall(), conn, table_name), None
     except psycopg2.Error as e:
-        if e.pgcode == '42P01':
-             current_app.logger.error(f"Tabela CAR '{table_name}' não encontrada: {e}")
-             return None, f"Dados CAR para a UF '{sigla_uf}' não disponíveis ou tabela não encontrada."
-        current_app.logger.error(f"Erro DB (code): {e}", exc_info=True)
-        return None, f"Erro no banco de dados (code): {str(e)}"
-    finally:
-        if conn:
-            conn.close()
+        current_app.logger.error(f"Erro DB (vizinhos): {e}", exc_info=True)
+        return [], f"Erro no banco de dados (vizinhos): {str(e)}"
+
+def _vizinhos_local(params):
+    try:
+        with metricas.cronometro('car_local_vizinhos'):
+            registros = car_local.registros_vizinhos(*params)
+    except car_local.ArquivoCarAusente as e:
+        return [], str(e)
+    except (OSError, ValueError, RuntimeError) as e:
+        current_app.logger.error(f"Erro no CAR local (vizinhos): {e}", exc_info=True)
+        return [], f"Erro na leitura do CAR local (vizinhos): {str(e)}"
+    return _processar_vizinhos(registros, None, None), None
+
+def _processar_vizinhos(registros, conn, table_name):
+    vizinhos = []
+    for registro in registros:
+        imovel, err = _process_car_record(registro, conn, table_name)
+        if imovel is None:
+            current_app.logger.warning(f"Vizinho {registro['cod_imovel']} ignorado: {err}")
+            continue
+        imovel['distancia_m'] = float(registro['distancia_m'])
+        vizinhos.append(imovel)
+    return vizinhos
 
 
 # --- Funções de Análise PRODES (usando arquivo local por enquanto) ---
+def prodes_dataset_version(prodes_filepath):
+    """Identificador da versão do arquivo PRODES (muda quando o arquivo é substituído)."""
+    stat = os.stat(prodes_filepath)
+    return f"{os.path.basename(prodes_filepath)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def versao_prodes_atual():
+    """Versão do PRODES em uso: Config.PRODES_VERSAO, a do catálogo de tiles ou a identificação do arquivo."""
+    if current_app.config.get('PRODES_VERSAO'):
+        return current_app.config['PRODES_VERSAO']
+    catalogo = catalogo_prodes.get_catalogo(current_app.config['PRODES_CATALOGO'])
+    if catalogo is not None:
+        return catalogo.versao
+    return prodes_dataset_version(current_app.config['PRODES_FILE_MS_RECORTE'])
+
+def prodes_pixel_area_m2(crs, transform):
+    """Área de um pixel PRODES em m²."""
+    if crs is not None and not crs.is_geographic: # Se CRS for projetado, calcular área do pixel
+        return transform[0] * abs(transform[4])
+    return 900 # Aproximação para PRODES (pixels de 30m x 30m)
+
+def get_prodes_year_from_value(value):
+    value = int(value)  # Converte para int Python padrão
+    if 1 <= value <= 23:
+        return 2000 + value
+    return None
+
+def _contagem_classes(desmatamento_values_2d):
+    # Converte para array int padrão do Python antes de processar
+    values_array = desmatamento_values_2d[desmatamento_values_2d != 255].astype(np.int32)
+    return np.unique(values_array, return_counts=True)
+
+def prodes_areas_por_ano_de_contagens(unique_values, counts, pixel_area_m2):
+    """Área desmatada (ha) por ano a partir da contagem de pixels de cada valor PRODES."""
+    desmatamento_areas_ha = {}
+    for value, count in zip(unique_values, counts):
+        year = get_prodes_year_from_value(value)
+        if year and pixel_area_m2 > 0:
+            area_ha = (float(count) * pixel_area_m2) / 10000  # Converte explicitamente para float
+            if area_ha > 0.001:
+                desmatamento_areas_ha[year] = desmatamento_areas_ha.get(year, 0) + area_ha
+    return desmatamento_areas_ha
+
+def prodes_areas_por_classe_de_contagens(unique_values, counts, pixel_area_m2):
+    return {int(value): (float(count) * pixel_area_m2) / 10000 for value, count in zip(unique_values, counts)}
+
+def prodes_areas_por_ano(desmatamento_values_2d, pixel_area_m2):
+    """Área desmatada (ha) por ano a partir dos valores PRODES recortados."""
+    return prodes_areas_por_ano_de_contagens(*_contagem_classes(desmatamento_values_2d), pixel_area_m2)
+
+def prodes_areas_por_classe(desmatamento_values_2d, pixel_area_m2):
+    """Área (ha) de cada classe PRODES presente no recorte (exceto nodata)."""
+    return prodes_areas_por_classe_de_contagens(*_contagem_classes(desmatamento_values_2d), pixel_area_m2)
+
+def _analyze_prodes_catalogo(catalogo, imovel_geometry_shapely):
+    """analyze_prodes_recorter pelo catálogo de tiles: lê só os tiles que intersectam o imóvel."""
+    try:
+        with metricas.cronometro('prodes_recorte'):
+            desmatamento_values_2d, out_transform = catalogo_prodes.recortar(catalogo, imovel_geometry_shapely)
+        if desmatamento_values_2d is None:
+            current_app.logger.info("Imóvel CAR fora dos tiles do catálogo PRODES.")
+            return np.array([[]]), {}, None, catalogo.crs, "Imóvel fora da área do raster PRODES de recorte."
+        if desmatamento_values_2d.size == 0 or np.all(desmatamento_values_2d == 255):
+            return np.array([[]]), {}, out_transform, catalogo.crs, "Nenhuma área PRODES válida no recorte."
+        pixel_area_m2 = prodes_pixel_area_m2(catalogo.crs, out_transform)
+        desmatamento_areas_ha = prodes_areas_por_ano(desmatamento_values_2d, pixel_area_m2)
+        return desmatamento_values_2d, desmatamento_areas_ha, out_transform, catalogo.crs, None
+    except Exception as e:
+        current_app.logger.error(f"Erro na análise PRODES (catálogo): {e}", exc_info=True)
+        return None, {}, None, None, f"Erro ao processar imagem PRODES: {str(e)}"
+
+def recortar_prodes(src_prodes, imovel_geometry_shapely):
+    """Recorte do imóvel (EPSG:4674) num dataset PRODES aberto: (valores 2D, transform) com nodata
+    fora do imóvel, ou (None, None) se o imóvel está fora do raster. Não depende do contexto Flask.
+    """
+    geometria_para_mascara = [projecao.reprojetar_geometria(imovel_geometry_shapely, projecao.SIRGAS2000, src_prodes.crs)]
+    try:
+        out_image, out_transform = mask(src_prodes, geometria_para_mascara, crop=True, all_touched=True, nodata=255)
+    except ValueError as ve:
+        if "Input shapes do not overlap raster." in str(ve):
+            return None, None
+        raise
+    return out_image[0], out_transform
+
 def analyze_prodes_recorter(imovel_geometry_shapely):
     prodes_filepath = current_app.config['PRODES_FILE_MS_RECORTE']
+    catalogo = catalogo_prodes.get_catalogo(current_app.config['PRODES_CATALOGO'])
+    if catalogo is not None and imovel_geometry_shapely and imovel_geometry_shapely.is_valid:
+        return _analyze_prodes_catalogo(catalogo, imovel_geometry_shapely)
     if not os.path.exists(prodes_filepath):
         current_app.logger.error(f"Arquivo PRODES de recorte não encontrado: {prodes_filepath}")
         return None, {}, None, None, f"Arquivo PRODES de recorte não encontrado."
@@ -217,51 +453,18 @@ def analyze_prodes_recorter(imovel_geometry_shapely):
         return None, {}, None, None, "Geometria do imóvel inválida para análise PRODES."
 
     try:
-        with rasterio.open(prodes_filepath) as src_prodes:
+        # Handle reaproveitado entre requisições; o mask lê só os blocos da janela do imóvel
+        with metricas.cronometro('prodes_recorte'), raster.dataset(prodes_filepath) as src_prodes:
             # Sabemos que os dados do CAR estão em EPSG:4674
-            imovel_gdf = gpd.GeoDataFrame([{'id': 1, 'geometry': imovel_geometry_shapely}], crs="EPSG:4674")
-            
-            if imovel_gdf.crs != src_prodes.crs:
-                current_app.logger.info(f"Reprojetando geometria do imóvel de {imovel_gdf.crs} para CRS do PRODES {src_prodes.crs}")
-                imovel_gdf_reproj = imovel_gdf.to_crs(src_prodes.crs)
-            else:
-                imovel_gdf_reproj = imovel_gdf
-            
-            geometria_para_mascara = [geom for geom in imovel_gdf_reproj.geometry]
-            try:
-                out_image, out_transform = mask(src_prodes, geometria_para_mascara, crop=True, all_touched=True, nodata=255)
-            except ValueError as ve:
-                 if "Input shapes do not overlap raster." in str(ve):
-                     current_app.logger.info("Imóvel CAR fora da área do raster PRODES de recorte.")
-                     return np.array([[]]), {}, None, src_prodes.crs, "Imóvel fora da área do raster PRODES de recorte."
-                 else: raise ve
-            if out_image.size == 0 or np.all(out_image == 255):
+            desmatamento_values_2d, out_transform = recortar_prodes(src_prodes, imovel_geometry_shapely)
+            if desmatamento_values_2d is None:
+                current_app.logger.info("Imóvel CAR fora da área do raster PRODES de recorte.")
+                return np.array([[]]), {}, None, src_prodes.crs, "Imóvel fora da área do raster PRODES de recorte."
+            if desmatamento_values_2d.size == 0 or np.all(desmatamento_values_2d == 255):
                 return np.array([[]]), {}, out_transform, src_prodes.crs, "Nenhuma área PRODES válida no recorte."
 
-            desmatamento_values_2d = out_image[0]
-            pixel_area_m2 = 900 # Aproximação para PRODES (pixels de 30m x 30m)
-            if not src_prodes.crs.is_geographic: # Se CRS for projetado, calcular área do pixel
-                pixel_size_x = out_transform[0]
-                pixel_size_y = abs(out_transform[4])
-                pixel_area_m2 = pixel_size_x * pixel_size_y
-            
-            desmatamento_areas_ha = {}
-            def get_prodes_year_from_value(value):
-                value = int(value)  # Converte para int Python padrão
-                if 1 <= value <= 23:
-                    return 2000 + value
-                return None
-
-            # Converte para array int padrão do Python antes de processar
-            values_array = desmatamento_values_2d[desmatamento_values_2d != 255].astype(np.int32)
-            unique_values, counts = np.unique(values_array, return_counts=True)
-            
-            for value, count in zip(unique_values, counts):
-                year = get_prodes_year_from_value(value)
-                if year and pixel_area_m2 > 0:
-                    area_ha = (float(count) * pixel_area_m2) / 10000  # Converte explicitamente para float
-                    if area_ha > 0.001:
-                        desmatamento_areas_ha[year] = desmatamento_areas_ha.get(year, 0) + area_ha
+            pixel_area_m2 = prodes_pixel_area_m2(src_prodes.crs, out_transform)
+            desmatamento_areas_ha = prodes_areas_por_ano(desmatamento_values_2d, pixel_area_m2)
             
             return desmatamento_values_2d, desmatamento_areas_ha, out_transform, src_prodes.crs, None
     except Exception as e:
@@ -0,0 +1,186 @@
+# SeloDeMap/app/vizinhos.py
+# Imóveis CAR vizinhos do imóvel analisado (opção `vizinhos=N` do /analisar e
+# da API), com o desmatamento PRODES por ano de cada um.
+#
+# Os vizinhos vêm de uma única consulta na partição da UF
+# (utils.get_imoveis_car_vizinhos: ST_DWithin + ordenação KNN pelo índice).
+# O PRODES do grupo é lido de uma vez: uma janela do raster (ou do mosaico do
+# catálogo) cobrindo o retângulo envolvente de todos os vizinhos, e cada
+# imóvel é mascarado (all_touched, como o mask do recorte individual) no seu
+# trecho dessa janela - em vez de N recortes, cada um com sua leitura.
+# Vizinhos já no cache de resultados, com histograma do PostGIS ou no motor
+# vetorial não entram na leitura; os calculados vão para o cache, de modo que
+# a análise seguinte de um vizinho não volta ao banco nem ao raster.
+import os
+from contextlib import ExitStack
+
+import numpy as np
+import shapely
+from flask import current_app
+from rasterio.features import geometry_mask
+from rasterio.merge import merge
+from rasterio.windows import Window
+
+from . import analise, cache_analise, catalogo_prodes, metricas, prodes_postgis, prodes_vetorial, projecao, raster, utils
+
+NODATA_PRODES = 255
+
+
+def _prodes(desmatamento_ha, na_area, aviso):
+    """Dict PRODES no formato de analise.prodes_imovel, sem os pixels."""
+    return {'valores': None, 'desmatamento_ha': desmatamento_ha, 'transform': None, 'crs': None,
+            'na_area': na_area, 'aviso': aviso}
+
+
+def _janelas(geometrias, transform, altura, largura):
+    """(linha, coluna, altura, largura) de cada geometria numa grade, ou None se fora dela.
+
+    Mesma janela do geometry_window do rasterio (usado pelo mask com crop),
+    calculada de uma vez a partir dos retângulos envolventes: numa grade sem
+    rotação a transformação é monótona em cada eixo, então transformar só os
+    cantos dá os mesmos extremos que transformar todos os vértices.
+    """
+    limites = shapely.bounds(geometrias)
+    colunas_a, linhas_a = ~transform * (limites[:, 0], limites[:, 3])
+    colunas_b, linhas_b = ~transform * (limites[:, 2], limites[:, 1])
+    coluna_ini = np.clip(np.floor(np.minimum(colunas_a, colunas_b)), 0, largura).astype(int)
+    coluna_fim = np.clip(np.ceil(np.maximum(colunas_a, colunas_b)), 0, largura).astype(int)
+    linha_ini = np.clip(np.floor(np.minimum(linhas_a, linhas_b)), 0, altura).astype(int)
+    linha_fim = np.clip(np.ceil(np.maximum(linhas_a, linhas_b)), 0, altura).astype(int)
+    return [(l0, c0, l1 - l0, c1 - c0) if l1 > l0 and c1 > c0 else None
+            for l0, l1, c0, c1 in zip(linha_ini.tolist(), linha_fim.tolist(), coluna_ini.tolist(), coluna_fim.tolist())]
+
+
+def _ler_grupo_arquivo(caminho, geometrias):
+    """Janela do raster com todas as geometrias (no CRS do raster): (valores, transform, crs, geometrias, janelas).
+
+    `janelas` traz, para cada geometria, o seu trecho na janela lida - a mesma
+    janela do mask(crop=True) - ou None se ela está fora do raster.
+    """
+    with raster.dataset(caminho) as src:
+        geometrias = projecao.reprojetar_geometria(geometrias, projecao.SIRGAS2000, src.crs)
+        janelas = _janelas(geometrias, src.transform, src.height, src.width)
+        validas = [janela for janela in janelas if janela is not None]
+        if not validas:
+            return None, None, src.crs, geometrias, janelas
+        linha, coluna = min(j[0] for j in validas), min(j[1] for j in validas)
+        grupo = Window(coluna, linha, max(j[1] + j[3] for j in validas) - coluna, max(j[0] + j[2] for j in validas) - linha)
+        valores = src.read(1, window=grupo)
+        transform = src.window_transform(grupo)
+    janelas = [None if janela is None else (janela[0] - linha, janela[1] - coluna, janela[2], janela[3]) for janela in janelas]
+    return valores, transform, src.crs, geometrias, janelas
+
+
+def _ler_grupo_catalogo(catalogo, geometrias_4674):
+    """Como _ler_grupo_arquivo, no mosaico dos tiles do catálogo que cobrem o grupo."""
+    geometrias = projecao.reprojetar_geometria(geometrias_4674, projecao.SIRGAS2000, catalogo.crs)
+    caminhos = catalogo.tiles_intersectando(tuple(shapely.total_bounds(geometrias_4674)))
+    if not caminhos:
+        return None, None, catalogo.crs, geometrias, [None] * len(geometrias)
+    with ExitStack() as pilha:
+        datasets = [pilha.enter_context(raster.dataset(caminho)) for caminho in caminhos]
+        valores, transform = merge(datasets, bounds=catalogo.alinhar_limites(tuple(shapely.total_bounds(geometrias))),
+                                   res=catalogo.resolucao, nodata=NODATA_PRODES, indexes=[1])
+    valores = valores[0]
+    return valores, transform, catalogo.crs, geometrias, _janelas(geometrias, transform, *valores.shape)
+
+
+def prodes_grupo(geometrias_4674):
+    """PRODES de várias geometrias (EPSG:4674) com uma única leitura do raster.
+
+    Retorna uma lista de (dict PRODES sem pixels, ok); ok=False indica falha
+    (arquivo ausente, geometria inválida), que não deve ir para o cache.
+    """
+    geometrias_4674 = np.asarray(geometrias_4674, dtype=object)
+    resultados = [None] * len(geometrias_4674)
+    validas = np.array([geometria is not None and geometria.is_valid for geometria in geometrias_4674], dtype=bool)
+    for i in np.flatnonzero(~validas):
+        resultados[i] = (_prodes({}, False, "Geometria do imóvel inválida para análise PRODES."), False)
+    if not validas.any():
+        return resultados
+    indices = np.flatnonzero(validas)
+
+    catalogo = catalogo_prodes.get_catalogo(current_app.config['PRODES_CATALOGO'])
+    caminho = current_app.config['PRODES_FILE_MS_RECORTE']
+    try:
+        with metricas.cronometro('prodes_grupo'):
+            if catalogo is not None:
+                valores, transform, crs, geometrias, janelas = _ler_grupo_catalogo(catalogo, geometrias_4674[indices])
+            elif os.path.exists(caminho):
+                valores, transform, crs, geometrias, janelas = _ler_grupo_arquivo(caminho, geometrias_4674[indices])
+            else:
+                for i in indices:
+                    resultados[i] = (_prodes({}, False, "Arquivo PRODES de recorte não encontrado."), False)
+                return resultados
+    except Exception as e:
+        current_app.logger.error(f"Erro na análise PRODES dos vizinhos: {e}", exc_info=True)
+        for i in indices:
+            resultados[i] = (_prodes({}, False, f"Erro ao processar imagem PRODES: {str(e)}"), False)
+        return resultados
+
+    pixel_area_m2 = utils.prodes_pixel_area_m2(crs, transform) if transform is not None else 0
+    for i, geometria, janela in zip(indices, geometrias, janelas):
+        if janela is None:
+            resultados[i] = (_prodes({}, False, "Imóvel fora da área do raster PRODES de recorte."), True)
+            continue
+        linha, coluna, altura, largura = janela
+        trecho = valores[linha:linha + altura, coluna:coluna + largura]
+        dentro = geometry_mask([geometria], out_shape=trecho.shape, transform=transform * transform.translation(coluna, linha),
+                               all_touched=True, invert=True)
+        trecho = np.where(dentro, trecho, NODATA_PRODES)
+        if not (trecho != NODATA_PRODES).any():
+            resultados[i] = (_prodes({}, False, "Nenhuma área PRODES válida no recorte."), True)
+            continue
+        resultados[i] = (_prodes(utils.prodes_areas_por_ano(trecho, pixel_area_m2), True, None), True)
+    return resultados
+
+
+def _resumo(imovel, prodes, incluir_geometria, tolerancia):
+    desmatamento_ha = {int(ano): round(float(area), 4) for ano, area in sorted(prodes['desmatamento_ha'].items())}
+    area_ha_car = imovel.get('area_ha_car')
+    resumo = {
+        'cod_imovel': imovel['cod_imovel'],
+        'municipio': imovel.get('municipio'),
+        'area_ha_car': float(area_ha_car) if area_ha_car is not None else None, # numeric -> Decimal no psycopg2
+        'distancia_m': round(imovel['distancia_m'], 1),
+        'desmatamento_ha': desmatamento_ha,
+        'desmatamento_total_ha': round(sum(desmatamento_ha.values()), 4),
+        'aviso': prodes['aviso'],
+    }
+    if incluir_geometria:
+        resumo['geometria'] = analise.geometria_geojson(utils.geometria_exibicao(imovel), tolerancia,
+                                                        propriedades={'cod_imovel': imovel['cod_imovel']})
+    return resumo
+
+
+def analisar_vizinhos(imovel_car_data, quantidade, distancia_m=0, incluir_geometria=False, tolerancia=0.00005):
+    """Até `quantidade` vizinhos do imóvel (do mais próximo ao mais distante) com o desmatamento PRODES de cada um.
+
+    Retorna (lista de dicts serializáveis em JSON, erro).
+    """
+    vizinhos, err = utils.get_imoveis_car_vizinhos(imovel_car_data, quantidade, distancia_m)
+    if err:
+        return [], err
+    prodes = [None] * len(vizinhos)
+    versao = utils.versao_prodes_atual() if vizinhos else None
+    pendentes = []
+    for i, imovel in enumerate(vizinhos):
+        em_cache = cache_analise.obter_resultado(imovel['cod_imovel'], imovel['sigla_uf'])
+        if em_cache is not None:
+            prodes[i] = em_cache['prodes']
+            continue
+        if 'prodes_contagens' in imovel: # Histograma calculado na consulta dos vizinhos
+            prodes[i] = prodes_postgis.prodes_imovel(imovel, versao)
+        elif prodes_vetorial.ativo():
+            prodes[i] = prodes_vetorial.prodes_imovel(imovel, versao)
+        if prodes[i] is None:
+            pendentes.append(i)
+        else:
+            cache_analise.gravar_resultado(imovel['cod_imovel'], imovel['sigla_uf'], imovel, prodes[i])
+
+    if pendentes:
+        for i, (resultado, ok) in zip(pendentes, prodes_grupo([vizinhos[i]['geometry'] for i in pendentes])):
+            prodes[i] = resultado
+            if ok:
+                cache_analise.gravar_resultado(vizinhos[i]['cod_imovel'], vizinhos[i]['sigla_uf'], vizinhos[i], resultado)
+    return [_resumo(imovel, resultado, incluir_geometria, tolerancia) for imovel, resultado in zip(vizinhos, prodes)], None
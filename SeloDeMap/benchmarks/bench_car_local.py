@@ -0,0 +1,107 @@
+# SeloDeMap/benchmarks/bench_car_local.py
+# Backend CAR local (app/car_local.py) x a tabela CAR: grava os imóveis
+# sintéticos em GeoParquet e FlatGeobuf pelo mesmo caminho do `flask
+# exportar-car-local` e mede as buscas por coordenada, por código e de
+# vizinhos em cada backend. Confere que os registros são idênticos aos da
+# tabela (id, código, área, WKB completo e de exibição; a ordem dos vizinhos).
+#
+# A tabela é a substituta em processo (benchmarks/fixtures.py), sem latência
+# de rede: no PostGIS da VPS cada busca soma ainda a ida e volta ao servidor.
+#
+# Uso: python -m benchmarks.bench_car_local [--imoveis 20000] [--amostras 200]
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault('LOTE_EXECUTOR_ATIVO', '0')
+
+import numpy as np
+
+from app import car_local, create_app, db, utils
+
+from . import fixtures
+
+
+def _chave(imovel):
+    """Campos que os dois backends devem devolver iguais."""
+    exibicao = imovel['geometria_exibicao']
+    return (imovel['gid_car'], imovel['cod_imovel'], imovel['sigla_uf'], imovel['municipio'], float(imovel['area_ha_car']),
+            imovel['geometry'].wkb, exibicao.wkb if exibicao is not None else None)
+
+
+def _medir(funcao, itens):
+    funcao(itens[0])
+    tempos, resultados = [], []
+    for item in itens:
+        inicio = time.perf_counter()
+        resultados.append(funcao(item))
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return tempos, resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do backend CAR local (GeoParquet/FlatGeobuf).")
+    parser.add_argument('--imoveis', type=int, default=20000)
+    parser.add_argument('--amostras', type=int, default=200)
+    parser.add_argument('--vizinhos', type=int, default=10)
+    parser.add_argument('--distancia', type=float, default=1000, help="Distância máxima dos vizinhos (m).")
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+
+    imoveis = fixtures.gerar_imoveis(args.imoveis, semente=args.semente)
+    app = create_app()
+    app.config.update({'CAR_VERSAO': 'benchmark', 'CACHE_ANALISE_DIR': None, 'CAR_GEOMETRIA_COMPACTA': True})
+    tabela = fixtures.CarEmMemoria(imoveis, app.config['CAR_GEOMETRIA_TOLERANCIA_EXIBICAO'], app.config['CAR_GEOMETRIA_PRECISAO'])
+    db.conexao = tabela.conexao
+    amostra = imoveis.sample(args.amostras, random_state=args.semente).to_dict('records')
+    # Ordem espacial dos registros, como o ORDER BY ST_GeoHash da exportação
+    linhas = [tabela.linhas[i] for i in np.argsort(imoveis.geometry.hilbert_distance().to_numpy(), kind='stable')]
+    metadados = {'sigla_uf': 'MS', 'srid': app.config['CAR_SRID'], 'precisao': app.config['CAR_GEOMETRIA_PRECISAO'],
+                 'tolerancia_exibicao': app.config['CAR_GEOMETRIA_TOLERANCIA_EXIBICAO']}
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        referencia = None
+        for backend, formato in (('postgis', None), ('local', 'parquet'), ('local', 'fgb')):
+            nome = formato or 'tabela'
+            app.config['CAR_BACKEND'] = backend
+            if formato:
+                app.config['CAR_LOCAL_DIR'] = os.path.join(diretorio, formato)
+                caminho = os.path.join(app.config['CAR_LOCAL_DIR'], f"car_ms{car_local.FORMATOS[formato]}")
+                inicio = time.perf_counter()
+                car_local.gravar((linhas[i:i + 2000] for i in range(0, len(linhas), 2000)), caminho, metadados)
+                gravacao = time.perf_counter() - inicio
+                with app.app_context():
+                    inicio = time.perf_counter()
+                    car_local.get_arquivo(caminho)
+                    carga = time.perf_counter() - inicio
+                print(f"{nome:8}: {os.path.getsize(caminho) / 2**20:6.1f} MiB, gravado em {gravacao:5.2f} s, "
+                      f"índices carregados em {carga * 1000:6.1f} ms")
+
+            with app.app_context():
+                tempos_coords, por_coords = _medir(lambda r: utils.get_imovel_car_from_coords(r['centro_y'], r['centro_x'])[0], amostra)
+                tempos_codigo, por_codigo = _medir(lambda r: utils.get_imovel_car_from_code(r['cod_imovel'])[0], amostra)
+                tempos_vizinhos, vizinhos = _medir(lambda r: utils.get_imoveis_car_vizinhos(
+                    r, args.vizinhos, args.distancia)[0], amostra)
+            resultado = {
+                'coords': [_chave(imovel) if imovel else None for imovel in por_coords],
+                'codigo': [_chave(imovel) if imovel else None for imovel in por_codigo],
+                'vizinhos': [[_chave(v)[:6] for v in lista] for lista in vizinhos],
+                'distancias': np.array([v['distancia_m'] for lista in vizinhos for v in lista]),
+            }
+            print(f"{'':10}por coordenada: mediana {np.median(tempos_coords):6.3f} ms  p95 {np.percentile(tempos_coords, 95):6.3f} ms")
+            print(f"{'':10}por código    : mediana {np.median(tempos_codigo):6.3f} ms  p95 {np.percentile(tempos_codigo, 95):6.3f} ms")
+            print(f"{'':10}vizinhos={args.vizinhos:<4}: mediana {np.median(tempos_vizinhos):6.3f} ms  p95 {np.percentile(tempos_vizinhos, 95):6.3f} ms")
+            if referencia is None:
+                referencia = resultado
+                continue
+            divergentes = {caso: sum(a != b for a, b in zip(resultado[caso], referencia[caso])) for caso in ('coords', 'codigo', 'vizinhos')}
+            print(f"{'':10}registros diferentes da tabela: {divergentes} (de {len(amostra)} buscas cada)")
+            if len(resultado['distancias']) == len(referencia['distancias']):
+                # A tabela em processo aproxima distancia_m por graus x 111 320 m; o PostGIS, como aqui, usa o elipsoide
+                print(f"{'':10}distancia_m: diferença mediana para a aproximação da tabela "
+                      f"{np.median(np.abs(resultado['distancias'] - referencia['distancias'])):.1f} m")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# SeloDeMap/benchmarks/bench_carteira.py
+# Análise de carteiras (app/carteira.py) sobre imóveis e raster sintéticos de
+# benchmarks/fixtures.py: vazão em imóveis/s na saída GeoParquet e na CSV.
+# Confere que a saída tem todas as feições e as colunas de resultado com tipos
+# fixos, mesmo quando o primeiro bloco não tem nenhum aviso e um bloco seguinte
+# tem (imóveis deslocados para fora do raster), e que uma execução que falha
+# não deixa arquivo de saída.
+#
+# Uso: python -m benchmarks.bench_carteira [--imoveis 1200] [--tamanho-bloco 100] [--workers 2]
+import argparse
+import os
+import tempfile
+import time
+
+import geopandas as gpd
+import pandas as pd
+from shapely.affinity import translate
+
+from app import carteira
+
+from . import fixtures
+
+
+def gerar_carteira(caminho, quantidade, tamanho_bloco, semente):
+    """Carteira GeoPackage em que só os blocos depois do primeiro têm imóveis fora do raster (com aviso)."""
+    imoveis = fixtures.gerar_imoveis(quantidade, semente=semente)[['cod_imovel', 'geometry']]
+    fora = [i for i in range(tamanho_bloco, quantidade) if i % 7 == 0]
+    imoveis.loc[fora, 'geometry'] = [translate(geometria, 5, 0) for geometria in imoveis.geometry[fora]]
+    imoveis.to_file(caminho)
+    return len(fora)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da análise de carteiras (GeoParquet e CSV).")
+    parser.add_argument('--imoveis', type=int, default=1200)
+    parser.add_argument('--tamanho-bloco', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        raster_path = fixtures.gerar_raster_prodes(os.path.join(diretorio, 'prodes.tif'), semente=args.semente)
+        entrada = os.path.join(diretorio, 'carteira.gpkg')
+        com_aviso = gerar_carteira(entrada, args.imoveis, args.tamanho_bloco, args.semente)
+
+        for extensao in ('parquet', 'csv'):
+            saida = os.path.join(diretorio, f'resultado.{extensao}')
+            inicio = time.perf_counter()
+            total = carteira.analisar_carteira(entrada, saida, raster_path, workers=args.workers,
+                                               tamanho_bloco=args.tamanho_bloco)
+            decorrido = time.perf_counter() - inicio
+            resultado = gpd.read_parquet(saida) if extensao == 'parquet' else pd.read_csv(saida)
+            assert total == len(resultado) == args.imoveis, f"{extensao}: {len(resultado)} de {args.imoveis} feições gravadas"
+            fora_do_raster = (resultado['aviso_prodes'] == "Imóvel fora da área do raster PRODES de recorte.").sum()
+            assert fora_do_raster == com_aviso, f"{extensao}: avisos perdidos"
+            assert resultado['aviso_prodes'].iloc[:args.tamanho_bloco].isna().all(), "o primeiro bloco não deveria ter avisos"
+            assert not os.path.exists(os.path.join(diretorio, f'resultado.tmp.{extensao}'))
+            if extensao == 'parquet':
+                assert all(str(resultado[coluna].dtype) == 'float64' for coluna in carteira.COLUNAS_RESULTADO[:-1])
+            print(f"{extensao:8}: {total} imóveis em {decorrido:6.2f} s ({total / decorrido:7.1f} imóveis/s), "
+                  f"{resultado['aviso_prodes'].notna().sum()} com aviso")
+
+        # Falha no meio da execução (raster ausente): nenhum arquivo de saída, nem temporário
+        saida = os.path.join(diretorio, 'falha.parquet')
+        try:
+            carteira.analisar_carteira(entrada, saida, os.path.join(diretorio, 'ausente.tif'), workers=1,
+                                       tamanho_bloco=args.tamanho_bloco)
+        except FileNotFoundError:
+            pass
+        else:
+            raise AssertionError("a análise sem raster deveria falhar")
+        assert not os.path.exists(saida) and not os.path.exists(os.path.join(diretorio, 'falha.tmp.parquet'))
+        print("Falha  : nenhum arquivo de saída deixado")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# SeloDeMap/benchmarks/bench_catalogo.py
+# Recorte PRODES pelo catálogo de tiles (app/catalogo_prodes.py) contra o
+# arquivo único. O raster sintético de benchmarks/fixtures.py é dividido em
+# tiles (um "bioma") e o catálogo recebe ainda milhares de tiles minúsculos
+# espalhados pelo resto do país, simulando a cobertura nacional. Confere que
+# as áreas por ano coincidem com as do arquivo único e mostra que o custo por
+# imóvel não cresce com o número de tiles catalogados. Também confere que os
+# tiles XYZ do mapa (app/tiles.py) renderizados pelo catálogo são iguais aos
+# do arquivo único.
+#
+# Uso: python -m benchmarks.bench_catalogo [--imoveis 300] [--divisoes 4] [--tiles-extras 2000]
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from app import catalogo_prodes, create_app, tiles, utils
+
+from . import fixtures
+
+LIMITES_BRASIL = (-74.0, -34.0, -35.0, 5.0)
+
+
+def dividir_raster(origem, diretorio, divisoes):
+    """Grava o raster em divisoes x divisoes tiles com a mesma grade."""
+    os.makedirs(diretorio, exist_ok=True)
+    with rasterio.open(origem) as src:
+        perfil = src.profile.copy()
+        passo_x, passo_y = -(-src.width // divisoes), -(-src.height // divisoes)
+        for linha in range(0, src.height, passo_y):
+            for coluna in range(0, src.width, passo_x):
+                janela = Window(coluna, linha, min(passo_x, src.width - coluna), min(passo_y, src.height - linha))
+                perfil.update(width=int(janela.width), height=int(janela.height), transform=src.window_transform(janela),
+                              blockxsize=256, blockysize=256)
+                with rasterio.open(os.path.join(diretorio, f"tile_{linha:06d}_{coluna:06d}.tif"), 'w', **perfil) as dst:
+                    dst.write(src.read(1, window=janela), 1)
+
+
+def gerar_tiles_extras(diretorio, quantidade, resolucao, limites_excluidos, semente=42):
+    """Tiles pequenos (16 x 16 px) na grade do raster, fora da área dos imóveis."""
+    os.makedirs(diretorio, exist_ok=True)
+    rng = np.random.default_rng(semente)
+    esq_ex, baixo_ex, dir_ex, topo_ex = limites_excluidos
+    gravados = 0
+    while gravados < quantidade:
+        x = esq_ex + np.floor(rng.uniform(LIMITES_BRASIL[0], LIMITES_BRASIL[2]) - esq_ex)
+        y = topo_ex + np.floor(rng.uniform(LIMITES_BRASIL[1], LIMITES_BRASIL[3]) - topo_ex)
+        if esq_ex - 1 <= x <= dir_ex + 1 and baixo_ex - 1 <= y <= topo_ex + 1:
+            continue
+        perfil = {'driver': 'GTiff', 'dtype': 'uint8', 'count': 1, 'width': 16, 'height': 16, 'crs': "EPSG:4674",
+                  'transform': from_origin(x, y, resolucao, resolucao), 'nodata': 255}
+        with rasterio.open(os.path.join(diretorio, f"extra_{gravados:05d}.tif"), 'w', **perfil) as dst:
+            dst.write(np.full((16, 16), 100, dtype=np.uint8), 1)
+        gravados += 1
+
+
+def medir(funcao, geometrias):
+    funcao(geometrias[0])
+    tempos, resultados = [], []
+    for geometria in geometrias:
+        inicio = time.perf_counter()
+        resultados.append(funcao(geometria))
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return np.array(tempos), resultados
+
+
+def tile_xyz(lon, lat, z):
+    """(x, y) do tile XYZ que contém o ponto."""
+    n = 2 ** z
+    y = (1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n
+    return int((lon + 180) / 360 * n), int(y)
+
+
+def comparar_tiles_xyz(arquivo_unico, catalogo, geometrias, zooms=(8, 11, 14)):
+    """(tiles comparados, tiles diferentes) entre o arquivo único e o catálogo, nos centros dos imóveis."""
+    xyz = {(z, *tile_xyz(g.centroid.x, g.centroid.y, z)) for g in geometrias for z in zooms}
+    diferentes = sum(1 for z, x, y in xyz
+                     if tiles.renderizar_tile(arquivo_unico, z, x, y) != tiles.renderizar_tile(catalogo, z, x, y))
+    return len(xyz), diferentes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do recorte PRODES: catálogo de tiles x arquivo único.")
+    parser.add_argument('--imoveis', type=int, default=300)
+    parser.add_argument('--divisoes', type=int, default=4, help="Divisões por eixo do raster sintético.")
+    parser.add_argument('--tiles-extras', type=int, default=2000, help="Tiles fora da área (cobertura nacional).")
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        arquivo_unico = fixtures.gerar_raster_prodes(os.path.join(diretorio, 'prodes.tif'), semente=args.semente)
+        dividir_raster(arquivo_unico, os.path.join(diretorio, 'tiles', 'cerrado'), args.divisoes)
+        catalogo_regional = os.path.join(diretorio, 'tiles', 'catalogo_regional.sqlite')
+        catalogo_prodes.construir_catalogo(os.path.join(diretorio, 'tiles'), catalogo_regional)
+        gerar_tiles_extras(os.path.join(diretorio, 'tiles', 'outros'), args.tiles_extras,
+                           fixtures.RESOLUCAO_PADRAO, fixtures.LIMITES_PADRAO, args.semente)
+        catalogo_nacional = os.path.join(diretorio, 'tiles', 'catalogo_nacional.sqlite')
+        inicio = time.perf_counter()
+        total = catalogo_prodes.construir_catalogo(os.path.join(diretorio, 'tiles'), catalogo_nacional)
+        print(f"Catálogo nacional: {total} tiles indexados em {time.perf_counter() - inicio:.1f} s")
+
+        geometrias = list(fixtures.gerar_imoveis(args.imoveis, semente=args.semente).geometry)
+        app = create_app()
+        app.config.update({'PRODES_FILE_MS_RECORTE': arquivo_unico, 'PRODES_VERSAO': 'benchmark'})
+        resultados = {}
+        with app.app_context():
+            for nome, catalogo in (("Arquivo único", None), (f"Catálogo ({args.divisoes ** 2} tiles)", catalogo_regional),
+                                   (f"Catálogo ({total} tiles)", catalogo_nacional)):
+                app.config['PRODES_CATALOGO'] = catalogo
+                tempos, recortes = medir(utils.analyze_prodes_recorter, geometrias)
+                resultados[nome] = [areas for _, areas, _, _, _ in recortes]
+                print(f"{nome:24}: mediana {np.median(tempos):7.2f} ms  p95 {np.percentile(tempos, 95):7.2f} ms")
+
+            catalogo = catalogo_prodes.get_catalogo(catalogo_nacional)
+            inicio = time.perf_counter()
+            comparados, diferentes = comparar_tiles_xyz(arquivo_unico, catalogo, geometrias[:50])
+            print(f"Tiles XYZ pelo catálogo: {diferentes} de {comparados} diferentes do arquivo único "
+                  f"({time.perf_counter() - inicio:.1f} s)")
+
+    referencia = resultados["Arquivo único"]
+    for nome, areas in resultados.items():
+        divergentes = sum(1 for a, b in zip(referencia, areas)
+                          if a.keys() != b.keys() or any(abs(a[ano] - b[ano]) > 1e-6 for ano in a))
+        print(f"{nome:24}: {divergentes} imóveis com áreas diferentes do arquivo único")
+
+
+if __name__ == '__main__':
+    main()
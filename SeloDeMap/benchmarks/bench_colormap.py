@@ -0,0 +1,83 @@
+# SeloDeMap/benchmarks/bench_colormap.py
+# Compara o colormap pixel a pixel do Folium (utils.prodes_colormap_folium +
+# folium.utilities.write_png) com a paleta vetorizada + PNG indexado de
+# app/colormap.py, verificando que as imagens decodificadas são idênticas.
+#
+# Uso: python -m benchmarks.bench_colormap [--raster dados/prodes_desmatamento.tif] [--repeticoes 3]
+import argparse
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+import rasterio
+from folium.utilities import write_png
+
+from app import colormap
+from app.utils import prodes_colormap_folium
+
+RASTER_PADRAO = os.path.join(os.path.dirname(__file__), '..', 'dados', 'prodes_desmatamento.tif')
+
+
+def _ler_chunks(png):
+    pos, chunks = 8, {}
+    while pos < len(png):
+        tamanho, = struct.unpack("!I", png[pos:pos + 4])
+        tag = png[pos + 4:pos + 8]
+        chunks[tag] = chunks.get(tag, b"") + png[pos + 8:pos + 8 + tamanho]
+        pos += 12 + tamanho
+    return chunks
+
+
+def decodificar_png(png):
+    """Decodifica os PNGs sem filtro gerados pelos dois caminhos para RGBA (H, W, 4)."""
+    chunks = _ler_chunks(png)
+    largura, altura, _, tipo_cor = struct.unpack("!2I2B", chunks[b"IHDR"][:10])
+    bruto = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8)
+    if tipo_cor == 6:
+        return bruto.reshape(altura, largura * 4 + 1)[:, 1:].reshape(altura, largura, 4)
+    indices = bruto.reshape(altura, largura + 1)[:, 1:]
+    paleta = np.zeros((256, 4), dtype=np.uint8)
+    paleta[:, :3] = np.frombuffer(chunks[b"PLTE"], dtype=np.uint8).reshape(-1, 3)
+    paleta[:, 3] = np.frombuffer(chunks[b"tRNS"], dtype=np.uint8)
+    return paleta[indices]
+
+
+def medir(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos), resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do colormap PRODES (Folium x paleta vetorizada).")
+    parser.add_argument('--raster', default=RASTER_PADRAO)
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--tamanho', type=int, default=None,
+                        help="Recorta uma janela quadrada de N pixels (padrão: raster inteiro).")
+    args = parser.parse_args()
+
+    with rasterio.open(args.raster) as src:
+        valores = src.read(1)
+    if args.tamanho:
+        valores = valores[:args.tamanho, :args.tamanho]
+    print(f"Raster: {args.raster} - {valores.shape[1]}x{valores.shape[0]} pixels")
+
+    t_folium, png_folium = medir(
+        lambda: write_png(valores.astype(np.float32), colormap=prodes_colormap_folium), args.repeticoes)
+    t_lut, png_lut = medir(
+        lambda: colormap.encode_png_paleta(valores, colormap.paleta_prodes(valores)), args.repeticoes)
+
+    identicas = np.array_equal(decodificar_png(png_folium), decodificar_png(png_lut))
+    print(f"Folium (pixel a pixel): {t_folium * 1000:9.1f} ms  {len(png_folium) / 1024:8.1f} KiB")
+    print(f"Paleta + PNG indexado : {t_lut * 1000:9.1f} ms  {len(png_lut) / 1024:8.1f} KiB")
+    print(f"Aceleração: {t_folium / t_lut:.1f}x - imagens idênticas: {'sim' if identicas else 'NÃO'}")
+    return 0 if identicas else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
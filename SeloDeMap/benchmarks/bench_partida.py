@@ -0,0 +1,121 @@
+# SeloDeMap/benchmarks/bench_partida.py
+# Partida a frio do servidor de produção (gunicorn.conf.py): sobe o gunicorn
+# com o raster PRODES e as UFs sintéticos de benchmarks/fixtures.py, com e sem
+# aquecimento (SERVIDOR_AQUECIMENTO), e mede o tempo até o /status/pronto
+# responder 200 e até a primeira resposta de cada worker a uma análise
+# completa (/analisar por coordenada: UF, tentativa de busca CAR, mapa) e a
+# um tile PRODES.
+#
+# O banco aponta para uma porta local fechada: a busca CAR falha na hora e o
+# restante da análise segue, como numa queda do PostGIS.
+#
+# Uso: python -m benchmarks.bench_partida [--workers 2] [--porta 8765] [--rodadas 2]
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from . import fixtures
+
+DIRETORIO_PROJETO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def requisitar(url, dados=None, prazo=60):
+    """(status, segundos no servidor) de um GET (ou POST de formulário, com `dados`).
+
+    O tempo é o 'total' do cabeçalho Server-Timing (sem o custo do cliente);
+    na falta dele, o tempo medido no cliente.
+    """
+    corpo = urllib.parse.urlencode(dados).encode() if dados else None
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, data=corpo, timeout=prazo) as resposta:
+            resposta.read()
+            status, cabecalhos = resposta.status, resposta.headers
+    except urllib.error.HTTPError as e:
+        status, cabecalhos = e.code, e.headers
+    duracao = time.perf_counter() - inicio
+    for entrada in (cabecalhos.get('Server-Timing') or '').split(','):
+        nome, _, valor = entrada.strip().partition(';dur=')
+        if nome == 'total' and valor:
+            duracao = float(valor) / 1000
+    return status, duracao
+
+
+def esperar_pronto(url, prazo=120):
+    limite = time.monotonic() + prazo
+    while time.monotonic() < limite:
+        try:
+            status, _ = requisitar(url, prazo=2)
+            if status == 200:
+                return True
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            pass
+        time.sleep(0.02)
+    return False
+
+
+def rodada(aquecimento, args, ambiente):
+    base = f"http://127.0.0.1:{args.porta}"
+    env = dict(ambiente, SERVIDOR_AQUECIMENTO='1' if aquecimento else '0')
+    inicio = time.perf_counter()
+    processo = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+                                cwd=DIRETORIO_PROJETO, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not esperar_pronto(base + '/status/pronto'):
+            raise RuntimeError("O servidor não ficou pronto no prazo.")
+        pronto = time.perf_counter() - inicio
+        esq, baixo, dir_, topo = fixtures.LIMITES_PADRAO
+        analise = {'inputType': 'coords', 'latitude': (baixo + topo) / 2, 'longitude': (esq + dir_) / 2}
+        # Uma requisição por worker (conexões novas são distribuídas entre eles): a primeira de cada um é a fria
+        primeiras = [requisitar(base + '/analisar', analise) for _ in range(args.workers)]
+        primeira_resposta = time.perf_counter() - inicio
+        tiles = [requisitar(base + f'/tiles/prodes/10/{354 + i}/{574 + i}.png') for i in range(args.workers)]
+        quentes = [requisitar(base + '/analisar', analise)[1] for _ in range(5 * args.workers)]
+    finally:
+        processo.send_signal(signal.SIGTERM)
+        processo.wait(timeout=60)
+    return {
+        'pronto_s': round(pronto, 3),
+        'primeira_resposta_s': round(primeira_resposta, 3),
+        'analisar_primeira_ms': [round(t * 1000, 1) for _, t in primeiras],
+        'analisar_status': [status for status, _ in primeiras],
+        'tile_primeiro_ms': [round(t * 1000, 1) for _, t in tiles],
+        'analisar_quente_mediana_ms': round(sorted(quentes)[len(quentes) // 2] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partida a frio do gunicorn, com e sem aquecimento.")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--porta', type=int, default=8765)
+    parser.add_argument('--rodadas', type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        raster_path = fixtures.gerar_raster_prodes(os.path.join(diretorio, 'prodes_sintetico.tif'))
+        estados_path = os.path.join(diretorio, 'estados_sinteticos.gpkg')
+        fixtures.gerar_estados().to_file(estados_path, driver='GPKG')
+        ambiente = dict(os.environ, PRODES_FILE=raster_path, ESTADOS_FILE=estados_path,
+                        PRODES_CATALOGO=os.path.join(diretorio, 'sem_catalogo.sqlite'),
+                        POSTGRES_HOST='127.0.0.1', POSTGRES_PORT='9', DB_CONNECT_TIMEOUT='1',
+                        CAR_VERSAO='benchmark', LOTE_EXECUTOR_ATIVO='0',
+                        SERVIDOR_BIND=f'127.0.0.1:{args.porta}', SERVIDOR_WORKERS=str(args.workers),
+                        SERVIDOR_THREADS=str(args.threads))
+        for aquecimento in (False, True):
+            for i in range(args.rodadas):
+                resultado = rodada(aquecimento, args, ambiente)
+                print(f"{'com' if aquecimento else 'sem'} aquecimento, rodada {i + 1}: {json.dumps(resultado)}")
+
+
+if __name__ == '__main__':
+    main()
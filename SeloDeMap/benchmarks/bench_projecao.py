@@ -0,0 +1,87 @@
+# SeloDeMap/benchmarks/bench_projecao.py
+# Custo das reprojeções feitas a cada requisição: GeoDataFrame de uma linha +
+# to_crs (código antigo) contra app/projecao.py (Transformer em cache e
+# coordenadas transformadas de uma vez). Cobre o ponto clicado (4326 -> 4674),
+# o imóvel (4674 -> CRS do PRODES e 4674 -> 4326) e a bounding box do recorte
+# (CRS do PRODES -> 4326), conferindo que os resultados coincidem.
+#
+# Uso: python -m benchmarks.bench_projecao [--repeticoes 300] [--vertices 2000] [--crs-prodes EPSG:5880]
+import argparse
+import time
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Point, Polygon, box
+
+from app import projecao
+
+
+def poligono_imovel(vertices, centro=(-54.6, -20.4), raio=0.02, semente=42):
+    """Polígono irregular em EPSG:4674 com o número de vértices de um imóvel CAR grande."""
+    rng = np.random.default_rng(semente)
+    angulos = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    raios = raio * rng.uniform(0.7, 1.0, vertices)
+    return Polygon(np.column_stack((centro[0] + raios * np.cos(angulos), centro[1] + raios * np.sin(angulos))))
+
+
+def medir(funcao, repeticoes):
+    funcao()  # Aquecimento (cache de CRS do PROJ, imports tardios)
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return np.array(tempos) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de reprojeção: GeoDataFrame.to_crs x Transformer em cache.")
+    parser.add_argument('--repeticoes', type=int, default=300)
+    parser.add_argument('--vertices', type=int, default=2000)
+    parser.add_argument('--crs-prodes', default="EPSG:5880", help="CRS do raster PRODES simulado.")
+    args = parser.parse_args()
+
+    ponto = Point(-54.6, -20.4)
+    imovel = poligono_imovel(args.vertices)
+    bbox_prodes = projecao.reprojetar_limites(imovel.bounds, projecao.SIRGAS2000, args.crs_prodes)
+
+    def gdf(geometria, origem, destino):
+        return gpd.GeoDataFrame([{'id': 1, 'geometry': geometria}], crs=origem).to_crs(destino).geometry.iloc[0]
+
+    casos = (
+        ("Ponto 4326 -> 4674",
+         lambda: gdf(ponto, "EPSG:4326", "EPSG:4674"),
+         lambda: projecao.reprojetar_geometria(ponto, projecao.WGS84, projecao.SIRGAS2000)),
+        (f"Imóvel 4674 -> {args.crs_prodes}",
+         lambda: gdf(imovel, "EPSG:4674", args.crs_prodes),
+         lambda: projecao.reprojetar_geometria(imovel, projecao.SIRGAS2000, args.crs_prodes)),
+        ("Imóvel 4674 -> 4326",
+         lambda: gdf(imovel, "EPSG:4674", "EPSG:4326"),
+         lambda: projecao.reprojetar_geometria(imovel, projecao.SIRGAS2000, projecao.WGS84)),
+        (f"Bbox {args.crs_prodes} -> 4326",
+         lambda: gdf(box(*bbox_prodes), args.crs_prodes, "EPSG:4326"),
+         lambda: projecao.reprojetar_limites(bbox_prodes, args.crs_prodes, projecao.WGS84)),
+    )
+
+    print(f"{args.repeticoes} repetições, imóvel com {args.vertices} vértices")
+    total_antigo = total_novo = 0.0
+    coincidem = True
+    for nome, antigo, novo in casos:
+        r_antigo, r_novo = antigo(), novo()
+        if isinstance(r_novo, tuple):
+            # transform_bounds densifica as bordas; a caixa do GeoDataFrame só usa os 4 cantos
+            coincidem &= np.allclose(r_antigo.bounds, r_novo, atol=1e-6)
+        else:
+            coincidem &= r_antigo.equals_exact(r_novo, 1e-9)
+        t_antigo, t_novo = medir(antigo, args.repeticoes), medir(novo, args.repeticoes)
+        total_antigo += np.median(t_antigo)
+        total_novo += np.median(t_novo)
+        print(f"{nome:24}: to_crs {np.median(t_antigo):7.3f} ms  projecao {np.median(t_novo):7.3f} ms  "
+              f"({np.median(t_antigo) / np.median(t_novo):.0f}x)")
+    print(f"Por requisição (soma das medianas): {total_antigo:.2f} ms -> {total_novo:.2f} ms; "
+          f"resultados coincidem: {'sim' if coincidem else 'NÃO'}")
+    return 0 if coincidem else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,100 @@
+# SeloDeMap/benchmarks/bench_raster.py
+# Custo por requisição do recorte PRODES: arquivo original (em faixas), aberto
+# a cada requisição como no código antigo, contra o COG lido por um handle
+# reaproveitado (app/raster.py). Usa polígonos aleatórios dentro da extensão
+# do raster e confere que os recortes dos dois arquivos são idênticos.
+#
+# Uso: python -m benchmarks.bench_raster [--raster dados/prodes_desmatamento.tif] [--poligonos 200]
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+from rasterio.mask import mask
+from shapely.geometry import box
+
+from app import raster
+
+RASTER_PADRAO = os.path.join(os.path.dirname(__file__), '..', 'dados', 'prodes_desmatamento.tif')
+
+
+def poligonos_aleatorios(limites, quantidade, tamanho_max, semente=42):
+    """Retângulos levemente rotacionados dentro dos limites, com lado de até `tamanho_max` (unidades do CRS)."""
+    rng = np.random.default_rng(semente)
+    esq, baixo, dir_, topo = limites
+    poligonos = []
+    for _ in range(quantidade):
+        largura, altura = rng.uniform(tamanho_max / 10, tamanho_max, 2)
+        x = rng.uniform(esq, dir_ - largura)
+        y = rng.uniform(baixo, topo - altura)
+        poligonos.append(box(x, y, x + largura, y + altura).buffer(largura / 20, join_style=2))
+    return poligonos
+
+
+def recortar(src, poligono):
+    valores, _ = mask(src, [poligono], crop=True, all_touched=True, nodata=255)
+    return valores[0]
+
+
+def medir_por_requisicao(funcao, poligonos):
+    tempos, recortes = [], []
+    for poligono in poligonos:
+        inicio = time.perf_counter()
+        recortes.append(funcao(poligono))
+        tempos.append(time.perf_counter() - inicio)
+    tempos = np.array(tempos) * 1000
+    return tempos, recortes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do recorte PRODES: arquivo em faixas x COG com handle persistente.")
+    parser.add_argument('--raster', default=RASTER_PADRAO)
+    parser.add_argument('--cog', default=None, help="COG já convertido (padrão: converte para um arquivo temporário).")
+    parser.add_argument('--poligonos', type=int, default=200)
+    parser.add_argument('--tamanho', type=float, default=None,
+                        help="Lado máximo dos polígonos em unidades do CRS (padrão: 5%% da largura do raster).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cog = args.cog
+        if cog is None:
+            cog = os.path.join(tmp, 'prodes_cog.tif')
+            inicio = time.perf_counter()
+            raster.converter_para_cog(args.raster, cog)
+            print(f"Conversão para COG: {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+        for nome, caminho in (('Original', args.raster), ('COG', cog)):
+            layout = raster.info_layout(caminho)
+            print(f"{nome:8}: blocos {layout['blocos']}, compressão {layout['compressao']}, "
+                  f"overviews {layout['overviews']}, {os.path.getsize(caminho) / 1024:.0f} KiB")
+
+        with rasterio.open(args.raster) as src:
+            limites = src.bounds
+        tamanho = args.tamanho or (limites.right - limites.left) * 0.05
+        poligonos = poligonos_aleatorios(limites, args.poligonos, tamanho)
+
+        def original_por_requisicao(poligono):
+            with rasterio.open(args.raster) as src:
+                return recortar(src, poligono)
+
+        def cog_handle_persistente(poligono):
+            with raster.dataset(cog) as src:
+                return recortar(src, poligono)
+
+        raster.aquecer(cog)
+        t_original, r_original = medir_por_requisicao(original_por_requisicao, poligonos)
+        t_cog, r_cog = medir_por_requisicao(cog_handle_persistente, poligonos)
+
+    identicos = all(np.array_equal(a, b) for a, b in zip(r_original, r_cog))
+    print(f"{len(poligonos)} polígonos, lado máximo {tamanho:.4f}")
+    for nome, tempos in (('Original, abre por requisição', t_original), ('COG, handle persistente', t_cog)):
+        print(f"{nome:30}: mediana {np.median(tempos):7.2f} ms  p95 {np.percentile(tempos, 95):7.2f} ms")
+    print(f"Aceleração (mediana): {np.median(t_original) / np.median(t_cog):.1f}x - "
+          f"recortes idênticos: {'sim' if identicos else 'NÃO'}")
+    return 0 if identicos else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,82 @@
+# SeloDeMap/benchmarks/bench_vizinhos.py
+# Vizinhos do imóvel (app/vizinhos.py): o PRODES do grupo com uma leitura do
+# raster x um recorte (mask) por vizinho, e a API com vizinhos=N x as N+1
+# chamadas que o analista faria um imóvel por vez. Confere que as áreas por
+# ano do grupo são idênticas às dos recortes individuais.
+#
+# Uso: python -m benchmarks.bench_vizinhos [--vizinhos 10] [--distancia 1000]
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app import cache_analise, create_app, db, utils, vizinhos
+
+from . import fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da análise de vizinhos (KNN + PRODES em grupo).")
+    parser.add_argument('--imoveis', type=int, default=2000)
+    parser.add_argument('--amostras', type=int, default=30)
+    parser.add_argument('--vizinhos', type=int, default=10)
+    parser.add_argument('--distancia', type=float, default=1000, help="Distância máxima (m).")
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        imoveis = fixtures.gerar_imoveis(args.imoveis, semente=args.semente)
+        raster_path = fixtures.gerar_raster_prodes(os.path.join(diretorio, 'prodes.tif'), semente=args.semente)
+        app = create_app()
+        app.config.update({'PRODES_FILE_MS_RECORTE': raster_path, 'PRODES_CATALOGO': None, 'PRODES_VERSAO': 'benchmark',
+                           'CAR_VERSAO': 'benchmark', 'CACHE_ANALISE_DIR': None, 'VIZINHOS_MAX': max(args.vizinhos, 20)})
+        db.conexao = fixtures.CarEmMemoria(imoveis).conexao
+        amostra = imoveis.sample(args.amostras, random_state=args.semente).to_dict('records')
+
+        tempos_grupo, tempos_individual, grupos, divergencias = [], [], [], 0
+        with app.app_context():
+            for registro in amostra:
+                imovel = {'cod_imovel': registro['cod_imovel'], 'sigla_uf': registro['sigla_uf']}
+                lista, _ = utils.get_imoveis_car_vizinhos(imovel, args.vizinhos, args.distancia)
+                geometrias = [v['geometry'] for v in lista]
+                if not geometrias:
+                    continue
+                grupos.append(len(geometrias))
+                inicio = time.perf_counter()
+                grupo = vizinhos.prodes_grupo(geometrias)
+                tempos_grupo.append((time.perf_counter() - inicio) * 1000)
+                inicio = time.perf_counter()
+                individuais = [utils.analyze_prodes_recorter(g)[1] for g in geometrias]
+                tempos_individual.append((time.perf_counter() - inicio) * 1000)
+                divergencias += sum(resultado['desmatamento_ha'] != individual
+                                    for (resultado, _), individual in zip(grupo, individuais))
+
+        print(f"Grupos: {len(grupos)} (mediana {np.median(grupos):.0f} vizinhos a até {args.distancia:g} m)")
+        print(f"PRODES em grupo (1 leitura): mediana {np.median(tempos_grupo):7.2f} ms  p95 {np.percentile(tempos_grupo, 95):7.2f} ms")
+        print(f"PRODES por vizinho (N mask): mediana {np.median(tempos_individual):7.2f} ms  p95 {np.percentile(tempos_individual, 95):7.2f} ms")
+        print(f"Imóveis com áreas diferentes do recorte individual: {divergencias} de {sum(grupos)}")
+
+        # API: vizinhos=N numa chamada x a chamada do imóvel seguida de uma por vizinho (cache limpo a cada amostra)
+        with app.test_client() as cliente:
+            tempos_api, tempos_sequencial = [], []
+            for registro in amostra:
+                cache_analise._caches = None
+                inicio = time.perf_counter()
+                resposta = cliente.get('/api/v1/analise', query_string={'car_code': registro['cod_imovel'],
+                                                                        'vizinhos': args.vizinhos,
+                                                                        'vizinhos_distancia': args.distancia})
+                tempos_api.append((time.perf_counter() - inicio) * 1000)
+                codigos = [v['cod_imovel'] for v in resposta.get_json().get('vizinhos', [])]
+                cache_analise._caches = None
+                inicio = time.perf_counter()
+                for codigo in [registro['cod_imovel']] + codigos:
+                    cliente.get('/api/v1/analise', query_string={'car_code': codigo})
+                tempos_sequencial.append((time.perf_counter() - inicio) * 1000)
+        print(f"API vizinhos={args.vizinhos}          : mediana {np.median(tempos_api):7.2f} ms")
+        print(f"API imóvel + 1 chamada/vizinho: mediana {np.median(tempos_sequencial):7.2f} ms (sem latência de rede/banco)")
+
+
+if __name__ == '__main__':
+    main()
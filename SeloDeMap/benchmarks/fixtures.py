@@ -0,0 +1,226 @@
+# SeloDeMap/benchmarks/fixtures.py
+# Dados sintéticos para rodar os benchmarks sem o banco da VPS nem o WFS do
+# IBGE: imóveis CAR com distribuição de área parecida com a real (muitos
+# pequenos, cauda longa de fazendas grandes), um raster com os códigos PRODES,
+# limites de UFs e dois substitutos em processo - a tabela CAR nacional e o
+# WFS - que atendem às mesmas chamadas feitas por app/utils.py.
+import io
+import json
+import re
+from contextlib import contextmanager
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+import shapely
+from psycopg2.extras import execute_values
+from rasterio.transform import from_origin
+from shapely import STRtree
+from shapely.geometry import Point, Polygon, box
+
+from app import car, db
+
+LIMITES_PADRAO = (-55.0, -21.0, -54.0, -20.0)  # ~1° x 1° no centro de MS (EPSG:4674)
+RESOLUCAO_PADRAO = 0.0002689  # Pixel do recorte PRODES real (~30 m)
+METROS_POR_GRAU = 111320.0
+
+
+def gerar_imoveis(quantidade, limites=LIMITES_PADRAO, semente=42, sigla_uf='MS', cod_municipio='5002704'):
+    """GeoDataFrame (EPSG:4674) de imóveis com área log-normal (mediana ~40 ha, até ~30 mil ha).
+
+    Os polígonos são estrelados em torno do centro (que portanto está dentro
+    do imóvel) e o número de vértices cresce com o perímetro, como nos
+    polígonos digitalizados do CAR. Imóveis podem se sobrepor, como no CAR.
+    """
+    rng = np.random.default_rng(semente)
+    areas_ha = np.clip(rng.lognormal(np.log(40), 1.6, quantidade), 0.5, 30000)
+    esq, baixo, dir_, topo = limites
+    cos_lat = np.cos(np.radians((baixo + topo) / 2))
+    registros = []
+    for i, area_ha in enumerate(areas_ha):
+        raio_y = np.sqrt(area_ha * 10000 / np.pi) / METROS_POR_GRAU
+        raio_x = raio_y / cos_lat
+        cx = rng.uniform(esq + raio_x * 1.3, dir_ - raio_x * 1.3)
+        cy = rng.uniform(baixo + raio_y * 1.3, topo - raio_y * 1.3)
+        vertices = int(np.clip(8 * np.sqrt(area_ha), 16, 4000))
+        angulos = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+        fases = rng.uniform(0, 2 * np.pi, 3)
+        fator = 1 + 0.15 * np.sin(2 * angulos + fases[0]) + 0.1 * np.sin(5 * angulos + fases[1]) \
+            + 0.05 * np.sin(11 * angulos + fases[2]) + rng.uniform(-0.02, 0.02, vertices)
+        poligono = Polygon(np.column_stack((cx + raio_x * fator * np.cos(angulos), cy + raio_y * fator * np.sin(angulos))))
+        registros.append({
+            'id': i + 1,
+            'cod_imovel': f"{sigla_uf}-{cod_municipio}-{rng.bytes(16).hex().upper()}",
+            'sigla_uf': sigla_uf,
+            'municipio': 'Município Sintético',
+            'area': round(float(area_ha), 4),
+            'centro_x': cx,
+            'centro_y': cy,
+            'geometry': shapely.MultiPolygon([poligono]),
+        })
+    return gpd.GeoDataFrame(registros, crs="EPSG:4674")
+
+
+def gerar_raster_prodes(caminho, limites=LIMITES_PADRAO, resolucao=RESOLUCAO_PADRAO, semente=42):
+    """GeoTIFF uint8 (EPSG:4674) com os códigos PRODES: 100 vegetação, 101 não floresta,
+    manchas de desmatamento de 1 a 23 (2001-2023) e nodata 255 numa borda."""
+    rng = np.random.default_rng(semente)
+    esq, baixo, dir_, topo = limites
+    largura, altura = int(round((dir_ - esq) / resolucao)), int(round((topo - baixo) / resolucao))
+    # Classes em blocos grossos (talhões) ampliados, com ruído fino por cima
+    bloco = 16
+    grosso = rng.choice([100, 101] + list(range(1, 24)), size=(altura // bloco + 1, largura // bloco + 1),
+                        p=[0.45, 0.2] + [0.35 / 23] * 23).astype(np.uint8)
+    valores = np.repeat(np.repeat(grosso, bloco, axis=0), bloco, axis=1)[:altura, :largura]
+    ruido = rng.random((altura, largura)) < 0.03
+    valores[ruido] = rng.integers(1, 24, int(ruido.sum()), dtype=np.uint8)
+    valores[:, :max(1, largura // 50)] = 255
+    perfil = {
+        'driver': 'GTiff', 'dtype': 'uint8', 'count': 1, 'width': largura, 'height': altura,
+        'crs': "EPSG:4674", 'transform': from_origin(esq, topo, resolucao, resolucao), 'nodata': 255,
+        'compress': 'deflate', 'tiled': True, 'blockxsize': 512, 'blockysize': 512,
+    }
+    with rasterio.open(caminho, 'w', **perfil) as dst:
+        dst.write(valores, 1)
+    return caminho
+
+
+def gerar_estados(limites=LIMITES_PADRAO):
+    """Duas UFs vizinhas (MS contendo os limites, MT ao norte) com os atributos do WFS do IBGE."""
+    esq, baixo, dir_, topo = limites
+    ms = box(esq - 1, baixo - 1, dir_ + 1, topo + 0.5)
+    mt = box(esq - 1, topo + 0.5, dir_ + 1, topo + 3)
+    return gpd.GeoDataFrame([
+        {'id': 1, 'cd_uf': '50', 'nm_uf': 'Mato Grosso do Sul', 'sigla_uf': 'MS', 'geometry': ms},
+        {'id': 2, 'cd_uf': '51', 'nm_uf': 'Mato Grosso', 'sigla_uf': 'MT', 'geometry': mt},
+    ], crs="EPSG:4674")
+
+
+class WfsFalso:
+    """Substitui owslib.wfs.WebFeatureService: devolve os estados sintéticos em GeoJSON."""
+
+    estados = None
+
+    def __init__(self, url, version=None):
+        self.url = url
+
+    def getfeature(self, typename=None, bbox=None, outputFormat=None, srsname=None):
+        estados = self.estados
+        if bbox is not None:
+            estados = estados[estados.intersects(box(*bbox))]
+        return io.BytesIO(json.dumps(json.loads(estados.to_json())).encode())
+
+
+class _CursorCar:
+    """Cursor que responde aos statements preparados da tabela CAR a partir de um CarEmMemoria."""
+
+    def __init__(self, conexao):
+        self.connection = conexao
+        self._linha = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        nome = re.search(r"EXECUTE (\w+)", sql)
+        self._linha = self.connection.tabela.executar(nome.group(1) if nome else None, params or ())
+
+    def fetchone(self):
+        return self._linha
+
+    def fetchall(self):
+        return self._linha or []
+
+
+class _ConexaoCar:
+    def __init__(self, tabela):
+        self.tabela = tabela
+        self.preparadas = set()
+
+    def cursor(self, cursor_factory=None):
+        return _CursorCar(self)
+
+
+class CarEmMemoria:
+    """Tabela CAR nacional em processo (STRtree), no lugar do PostGIS.
+
+    Atende aos statements `car_coords`, `car_code` e `car_vizinhos_<uf>` de
+    app/utils.py com as mesmas linhas (geometria em WKB, como o ST_AsBinary;
+    nas variantes `_compacta`, também a geometria de exibição simplificada e
+    reduzida à grade; nos vizinhos, distancia_m aproximada pela distância em
+    graus) e responde "nenhuma linha" aos demais (ex: estatísticas pré-calculadas)
+    e aos PREPARE avulsos.
+    """
+
+    def __init__(self, imoveis, tolerancia_exibicao=0.00002, precisao=0.000001):
+        self.geometrias = imoveis.geometry.to_numpy()
+        self.arvore = STRtree(self.geometrias)
+        self.linhas = [{
+            'id': registro['id'], 'cod_imovel': registro['cod_imovel'], 'sigla_uf': registro['sigla_uf'],
+            'municipio': registro['municipio'], 'area': registro['area'],
+            'geom_wkb': memoryview(shapely.to_wkb(registro['geometry'])),
+        } for registro in imoveis.to_dict('records')]
+        exibicao = shapely.set_precision(shapely.simplify(self.geometrias, tolerancia_exibicao), precisao)
+        for linha, geometria in zip(self.linhas, exibicao):
+            linha['geom_exibicao_wkb'] = memoryview(shapely.to_wkb(geometria))
+        self.por_codigo = {(linha['cod_imovel'], linha['sigla_uf']): linha for linha in self.linhas}
+
+    def executar(self, nome, params):
+        if nome is not None and nome.endswith('_prodes'):
+            nome = nome[:-len('_prodes')] # Sem PostGIS Raster aqui: o histograma não vem e o PRODES cai no rasterio
+        compacta = nome is not None and nome.endswith('_compacta')
+        if compacta:
+            nome = nome[:-len('_compacta')]
+        if nome == 'car_coords':
+            indices = self.arvore.query(Point(params[0], params[1]), predicate='within')
+            linha = self.linhas[int(indices.min())] if len(indices) else None
+        elif nome == 'car_code':
+            linha = self.por_codigo.get((params[0], params[1]))
+        elif nome is not None and nome.startswith('car_vizinhos_'):
+            return self._vizinhos(*params[:4])
+        else:
+            return None
+        if linha is not None and not compacta:
+            linha = {chave: valor for chave, valor in linha.items() if chave != 'geom_exibicao_wkb'}
+        return linha
+
+    def _vizinhos(self, cod_imovel, sigla_uf, distancia_graus, limite):
+        referencia = self.por_codigo.get((cod_imovel, sigla_uf))
+        if referencia is None:
+            return []
+        geometria = shapely.from_wkb(bytes(referencia['geom_wkb']))
+        indices = self.arvore.query(geometria, predicate='dwithin', distance=distancia_graus)
+        indices = [i for i in indices if self.linhas[i]['sigla_uf'] == sigla_uf and self.linhas[i]['cod_imovel'] != cod_imovel]
+        distancias = shapely.distance(self.geometrias[indices], geometria) if indices else []
+        ordem = sorted(zip(distancias, indices))[:limite]
+        return [dict({chave: valor for chave, valor in self.linhas[i].items() if chave != 'geom_exibicao_wkb'},
+                     distancia_m=float(distancia) * METROS_POR_GRAU) for distancia, i in ordem]
+
+    @contextmanager
+    def conexao(self):
+        yield _ConexaoCar(self)
+
+
+def carregar_postgis(imoveis, tabela, srid=4674):
+    """Grava os imóveis sintéticos numa tabela CAR nacional (estrutura de app/car.py) no PostGIS da Config."""
+    conn = db.nova_conexao()
+    try:
+        car.criar_estrutura(conn, tabela, srid)
+        particoes = {sigla: car.criar_particao(conn, tabela, sigla) for sigla in imoveis['sigla_uf'].unique()}
+        with conn.cursor() as cursor:
+            for particao in particoes.values():
+                cursor.execute(f'TRUNCATE "{particao}"')
+            execute_values(cursor, f"""
+                INSERT INTO "{tabela}" (id, cod_imovel, sigla_uf, municipio, area, geom)
+                VALUES %s
+            """, [(registro['id'], registro['cod_imovel'], registro['sigla_uf'], registro['municipio'], registro['area'],
+                   shapely.to_wkb(registro['geometry'], hex=True)) for registro in imoveis.to_dict('records')],
+                template=f"(%s, %s, %s, %s, %s, ST_Multi(ST_GeomFromWKB(decode(%s, 'hex'), {int(srid)})))",
+                page_size=500)
+            cursor.execute(f'ANALYZE "{tabela}"')
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,222 @@
+# SeloDeMap/benchmarks/suite.py
+# Suíte de benchmarks offline: gera imóveis CAR, raster PRODES e limites de UF
+# sintéticos (benchmarks/fixtures.py) e mede as funções do caminho de uma
+# análise - busca do imóvel por coordenada e por código, recorte PRODES,
+# colormap, montagem/renderização do mapa - e o /analisar completo pelo
+# test client do Flask. A tabela CAR é a substituta em processo (padrão) ou
+# um PostGIS local (--backend postgis, conexão pelas variáveis POSTGRES_*);
+# o WFS do IBGE nunca é consultado.
+#
+# Os resultados vão para um JSON; com --comparar, cada caso é confrontado com
+# um JSON de referência e a saída é 1 se algum ficou mais lento que a
+# tolerância.
+#
+# Uso:
+#   python -m benchmarks.suite --saida resultados.json
+#   python -m benchmarks.suite --comparar referencia.json [--tolerancia 0.2]
+#   python -m benchmarks.suite --comparar referencia.json --atual resultados.json   # só compara
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault('LOTE_EXECUTOR_ATIVO', '0')  # Sem fila de lotes no processo do benchmark
+
+import numpy as np
+
+from app import create_app, colormap, db, utils
+
+from . import fixtures
+
+
+def resumo(tempos_ms, extra=None):
+    tempos = np.array(tempos_ms)
+    resultado = {
+        'n': len(tempos),
+        'mediana_ms': round(float(np.median(tempos)), 3),
+        'p95_ms': round(float(np.percentile(tempos, 95)), 3),
+        'min_ms': round(float(tempos.min()), 3),
+        'media_ms': round(float(tempos.mean()), 3),
+    }
+    if extra:
+        resultado.update(extra)
+    return resultado
+
+
+def medir(funcao, itens):
+    """Chama funcao(item) para cada item (o primeiro serve de aquecimento); retorna (tempos em ms, resultados)."""
+    funcao(itens[0])
+    tempos, resultados = [], []
+    for item in itens:
+        inicio = time.perf_counter()
+        resultados.append(funcao(item))
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return tempos, resultados
+
+
+def preparar_app(args, diretorio):
+    imoveis = fixtures.gerar_imoveis(args.imoveis, semente=args.semente)
+    raster_path = fixtures.gerar_raster_prodes(os.path.join(diretorio, 'prodes_sintetico.tif'), semente=args.semente)
+    estados = fixtures.gerar_estados()
+
+    app = create_app()
+    app.config.update({
+        'PRODES_FILE_MS_RECORTE': raster_path,
+        'PRODES_CATALOGO': None,
+        'PRODES_VERSAO': None,
+        'CAR_VERSAO': 'benchmark', # Versão fixa: o cache não consulta car_versoes
+        'CACHE_ANALISE_DIR': None,
+        'PRODES_TILE_CACHE_DIR': None,
+        'CAR_GEOMETRIA_COMPACTA': args.geometria_compacta,
+    })
+    if args.estados == 'indice':
+        estados_path = os.path.join(diretorio, 'estados_sinteticos.gpkg')
+        estados.to_file(estados_path, driver='GPKG')
+        app.config['ESTADOS_FILE'] = estados_path
+    else:
+        app.config['ESTADOS_FILE'] = os.path.join(diretorio, 'inexistente.gpkg')
+        fixtures.WfsFalso.estados = estados
+        utils.WebFeatureService = fixtures.WfsFalso
+
+    if args.backend == 'memoria':
+        db.conexao = fixtures.CarEmMemoria(imoveis, app.config['CAR_GEOMETRIA_TOLERANCIA_EXIBICAO'],
+                                           app.config['CAR_GEOMETRIA_PRECISAO']).conexao
+    else:
+        app.config['CAR_TABELA'] = args.tabela
+        with app.app_context():
+            fixtures.carregar_postgis(imoveis, args.tabela, app.config['CAR_SRID'])
+    return app, imoveis
+
+
+def executar_casos(app, imoveis, args):
+    from app import routes
+
+    rng = np.random.default_rng(args.semente)
+    amostra = imoveis.iloc[rng.permutation(len(imoveis))[:min(len(imoveis), args.amostras * 3)]]
+    # Amostras disjuntas para as requisições completas não acertarem o cache umas das outras
+    diretas, e2e_coords, e2e_codigo = (amostra.iloc[i::3].to_dict('records') for i in range(3))
+    casos = {}
+
+    with app.app_context():
+        tempos, encontrados = medir(lambda r: utils.get_imovel_car_from_coords(r['centro_y'], r['centro_x']), diretas)
+        casos['car_por_coords'] = resumo(tempos, {'encontrados': sum(1 for imovel, _ in encontrados if imovel)})
+
+        tempos, encontrados = medir(lambda r: utils.get_imovel_car_from_code(r['cod_imovel']), diretas)
+        casos['car_por_codigo'] = resumo(tempos, {'encontrados': sum(1 for imovel, _ in encontrados if imovel)})
+        imoveis_car = [imovel for imovel, _ in encontrados if imovel]
+
+        tempos, recortes = medir(lambda imovel: utils.analyze_prodes_recorter(imovel['geometry']), imoveis_car)
+        pixels = [r[0].size for r in recortes if r[0] is not None]
+        casos['prodes_recorte'] = resumo(tempos, {'pixels_mediana': int(np.median(pixels)) if pixels else 0})
+
+        com_pixels = [(imovel, r) for imovel, r in zip(imoveis_car, recortes) if r[0] is not None and r[0].size]
+        tempos, _ = medir(lambda par: colormap.png_data_url(
+            colormap.encode_png_paleta(par[1][0], colormap.paleta_prodes(par[1][0]))), com_pixels)
+        casos['colormap'] = resumo(tempos)
+
+        estado_data, _ = utils.get_estado_from_coords(diretas[0]['centro_y'], diretas[0]['centro_x'])
+
+        def montar_mapa(par):
+            imovel, (valores, areas, transform, crs, aviso) = par
+            prodes = {'valores': valores, 'desmatamento_ha': areas, 'transform': transform, 'crs': crs,
+                      'na_area': True, 'aviso': aviso}
+            with app.test_request_context('/analisar', method='POST'):
+                m = routes._montar_mapa_base('car_code', None, None, imovel, estado_data)
+                legenda = routes._adicionar_camada_prodes(m, prodes, imovel, '/tiles/prodes/{z}/{x}/{y}.png')
+                return len(routes.render_map_html(m, legenda))
+
+        tempos, tamanhos = medir(montar_mapa, com_pixels)
+        casos['mapa_render'] = resumo(tempos, {'html_kib_mediana': round(float(np.median(tamanhos)) / 1024, 1)})
+
+    with app.test_client() as cliente:
+        def analisar(dados):
+            # Accept-Encoding de navegador: o tempo inclui a compressão da resposta
+            resposta = cliente.post('/analisar', data=dados, headers={'Accept-Encoding': 'gzip, deflate, br'})
+            return resposta.status_code, len(resposta.get_data())
+
+        for caso, dados, itens in (
+                ('analisar_coords', lambda r: {'inputType': 'coords', 'latitude': r['centro_y'], 'longitude': r['centro_x']},
+                 e2e_coords),
+                ('analisar_codigo', lambda r: {'inputType': 'car_code', 'car_code': r['cod_imovel']}, e2e_codigo)):
+            tempos, respostas = medir(lambda r: analisar(dados(r)), itens)
+            casos[caso] = resumo(tempos, {'status_200': sum(status == 200 for status, _ in respostas),
+                                          'resposta_kib_mediana': round(float(np.median([t for _, t in respostas])) / 1024, 1)})
+    return casos
+
+
+def comparar(referencia, atual, tolerancia, minimo_ms):
+    """Imprime a comparação caso a caso; retorna os nomes dos casos que regrediram."""
+    regressoes = []
+    print(f"{'caso':18} {'referência':>12} {'atual':>12} {'variação':>10}")
+    for nome, base in referencia['casos'].items():
+        caso = atual['casos'].get(nome)
+        if caso is None:
+            print(f"{nome:18} {base['mediana_ms']:>10.2f}ms {'-':>12} {'ausente':>10}")
+            continue
+        variacao = caso['mediana_ms'] / base['mediana_ms'] - 1 if base['mediana_ms'] else 0.0
+        regrediu = variacao > tolerancia and caso['mediana_ms'] - base['mediana_ms'] > minimo_ms
+        if regrediu:
+            regressoes.append(nome)
+        print(f"{nome:18} {base['mediana_ms']:>10.2f}ms {caso['mediana_ms']:>10.2f}ms {variacao:>+9.0%}"
+              f"{'  REGRESSÃO' if regrediu else ''}")
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks offline do SeloDeMap com dados sintéticos.")
+    parser.add_argument('--imoveis', type=int, default=2000, help="Imóveis CAR sintéticos.")
+    parser.add_argument('--amostras', type=int, default=40, help="Chamadas medidas por caso.")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--backend', choices=('memoria', 'postgis'), default='memoria',
+                        help="Tabela CAR em processo ou num PostGIS local (variáveis POSTGRES_*).")
+    parser.add_argument('--tabela', default='bench_imoveis_car_br', help="Tabela CAR criada no PostGIS (--backend postgis).")
+    parser.add_argument('--estados', choices=('indice', 'wfs'), default='indice',
+                        help="UFs pelo snapshot local ou pelo WFS (substituído por um falso em processo).")
+    parser.add_argument('--geometria-compacta', action='store_true',
+                        help="Ativa o transporte compacto das geometrias CAR (CAR_GEOMETRIA_COMPACTA).")
+    parser.add_argument('--saida', default=None, help="Arquivo JSON com os resultados.")
+    parser.add_argument('--comparar', default=None, help="JSON de referência para detectar regressões.")
+    parser.add_argument('--atual', default=None, help="JSON já gerado a comparar (não roda os benchmarks).")
+    parser.add_argument('--tolerancia', type=float, default=0.2, help="Aumento relativo da mediana tolerado.")
+    parser.add_argument('--minimo-ms', type=float, default=0.5, help="Diferença absoluta abaixo da qual não há regressão.")
+    args = parser.parse_args()
+
+    if args.atual:
+        with open(args.atual, encoding='utf-8') as f:
+            resultado = json.load(f)
+    else:
+        with tempfile.TemporaryDirectory() as diretorio:
+            app, imoveis = preparar_app(args, diretorio)
+            resultado = {
+                'metadados': {
+                    'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    'python': sys.version.split()[0],
+                    'plataforma': platform.platform(),
+                    'parametros': {chave: getattr(args, chave) for chave in ('imoveis', 'amostras', 'semente', 'backend', 'estados',
+                                                                                     'geometria_compacta')},
+                },
+                'casos': executar_casos(app, imoveis, args),
+            }
+        for nome, caso in resultado['casos'].items():
+            print(f"{nome:18}: mediana {caso['mediana_ms']:8.2f} ms  p95 {caso['p95_ms']:8.2f} ms  (n={caso['n']})")
+        if args.saida:
+            with open(args.saida, 'w', encoding='utf-8') as f:
+                json.dump(resultado, f, indent=2, ensure_ascii=False)
+            print(f"Resultados gravados em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            referencia = json.load(f)
+        regressoes = comparar(referencia, resultado, args.tolerancia, args.minimo_ms)
+        if regressoes:
+            print(f"Regressões acima de {args.tolerancia:.0%}: {', '.join(regressoes)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
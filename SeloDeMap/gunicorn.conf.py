@@ -0,0 +1,37 @@
+# SeloDeMap/gunicorn.conf.py
+# Servidor de produção: gunicorn -c gunicorn.conf.py run:app
+#
+# Workers pré-criados (fork) com threads, configurados pela Config
+# (variáveis SERVIDOR_*). Com SERVIDOR_AQUECIMENTO, a aplicação é carregada no
+# mestre (preload_app: geopandas, rasterio, folium e owslib importados uma
+# única vez), o estado imutável é aquecido antes do fork e cada worker abre
+# suas conexões e handles antes de aceitar requisições (app/aquecimento.py).
+from app.config import Config
+
+bind = Config.SERVIDOR_BIND
+workers = Config.SERVIDOR_WORKERS
+threads = Config.SERVIDOR_THREADS
+worker_class = 'gthread'
+timeout = Config.SERVIDOR_TIMEOUT
+graceful_timeout = Config.SERVIDOR_GRACEFUL_TIMEOUT
+keepalive = Config.SERVIDOR_KEEPALIVE
+max_requests = Config.SERVIDOR_MAX_REQUESTS
+max_requests_jitter = max_requests // 10
+preload_app = Config.SERVIDOR_AQUECIMENTO
+accesslog = '-'
+
+
+def when_ready(server):
+    # Executado no mestre depois de carregar a aplicação e antes de criar os workers
+    if preload_app:
+        from app import aquecimento
+        registro = aquecimento.aquecer_mestre(server.app.wsgi())
+        server.log.info(f"Mestre aquecido em {sum(registro['etapas'].values()):.2f}s: {registro['etapas']}")
+
+
+def post_worker_init(worker):
+    # Executado em cada worker antes de aceitar conexões
+    from app import aquecimento
+    registro = aquecimento.aquecer_worker(worker.wsgi, aquecer=Config.SERVIDOR_AQUECIMENTO)
+    for aviso in registro['avisos']:
+        worker.log.warning(f"Aquecimento: {aviso}")
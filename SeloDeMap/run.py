@@ -1,7 +1,14 @@
 # run.py
+# Servidor de desenvolvimento (processo único, reloader). Em produção:
+#   gunicorn -c gunicorn.conf.py run:app
+import os
+
 from app import create_app
 
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true': # Processo que atende (não o monitor do reloader)
+        from app import aquecimento
+        aquecimento.aquecer_worker(app, aquecer=app.config['SERVIDOR_AQUECIMENTO'])
+    app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,48 @@
+# selodemap.py
+# Linha de comando sem o Flask (sem banco e sem servidor), para processamento local.
+#   python selodemap.py analisar carteira.gpkg -o resultado.parquet
+# O subcomando também responde por `analyze`.
+import argparse
+import sys
+
+from app import carteira
+from app.config import Config
+
+
+def analisar_command(args):
+    total = carteira.contar_feicoes(args.entrada, args.camada)
+    progresso = None if args.silencioso else carteira.Progresso(total)
+    feitos = carteira.analisar_carteira(args.entrada, args.saida, args.prodes, args.catalogo, workers=args.workers,
+                                        tamanho_bloco=args.tamanho_bloco, camada=args.camada, progresso=progresso)
+    print(f"{feitos} imóveis analisados; resultados em {args.saida}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='selodemap', description="Ferramentas de linha de comando do SeloDeMap.")
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+
+    analisar = subcomandos.add_parser(
+        'analisar', aliases=['analyze'],
+        help="Áreas PRODES por ano de cada polígono de uma carteira (GeoPackage, Shapefile, FlatGeobuf, GeoParquet).")
+    analisar.add_argument('entrada', help="Arquivo vetorial com os polígonos dos imóveis.")
+    analisar.add_argument('-o', '--saida', required=True, help="Resultado: .parquet (GeoParquet) ou .csv.")
+    analisar.add_argument('--camada', default=None, help="Camada do arquivo de entrada (padrão: a primeira).")
+    analisar.add_argument('--prodes', default=Config.PRODES_FILE_MS_RECORTE,
+                          help="Raster PRODES (padrão: Config.PRODES_FILE_MS_RECORTE).")
+    analisar.add_argument('--catalogo', default=Config.PRODES_CATALOGO,
+                          help="Catálogo de tiles PRODES; usado no lugar de --prodes se existir (padrão: Config.PRODES_CATALOGO).")
+    analisar.add_argument('--workers', type=int, default=Config.LOTE_WORKERS, help="Processos de análise.")
+    analisar.add_argument('--tamanho-bloco', type=int, default=carteira.TAMANHO_BLOCO,
+                          help="Feições lidas e enviadas a cada processo por vez.")
+    analisar.add_argument('--silencioso', action='store_true', help="Não imprime o progresso.")
+    analisar.set_defaults(funcao=analisar_command)
+
+    args = parser.parse_args(argv)
+    try:
+        args.funcao(args)
+    except carteira.EntradaCarteiraInvalida as e:
+        parser.exit(2, f"Erro: {e}\n")
+
+
+if __name__ == '__main__':
+    main()